@@ -4,10 +4,60 @@ Client base-classes:
 """
 
 import abc
-import sys
+import contextlib
 import logging
+import os
+import sys
+import threading
 
 from arestor.worker import base as base_worker
+from arestor.worker import engine
+from arestor.worker import history
+from arestor.worker import metrics
+from arestor.worker import trace
+from arestor.worker import util
+
+
+class _SharedSettings(object):
+
+    """Let the commands running in the current process (the jobs of
+    the daemon) share the tracer, the metrics registry and the timing
+    history, which are configured for the whole process.
+
+    The commands with the same settings run at the same time, the
+    others wait until the current settings are no longer used. The
+    commands that record a trace run alone, the tracer records the
+    spans of all the threads.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._settings = None
+        self._exclusive = False
+        self._users = 0
+
+    @contextlib.contextmanager
+    def use(self, settings, exclusive=False):
+        """Wait until the received settings can be used.
+
+        :param settings:    The settings required by the command.
+        :param exclusive:   Whether the command must run alone.
+        """
+        with self._condition:
+            while self._users and (exclusive or self._exclusive or
+                                   self._settings != settings):
+                self._condition.wait()
+            self._settings, self._exclusive = settings, exclusive
+            self._users += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._users -= 1
+                self._condition.notify_all()
+
+
+_SETTINGS = _SharedSettings()
 
 
 class Command(base_worker.Worker):
@@ -18,6 +68,7 @@ class Command(base_worker.Worker):
         super(Command, self).__init__()
         self._args = None
         self._command_line = None
+        self._environ = None
         self._logger = None
         self._parent = parent
         self._parser = parser
@@ -44,6 +95,13 @@ class Command(base_worker.Worker):
 
         return self._command_line
 
+    @property
+    def environ(self):
+        """The environment variables of the client."""
+        if self._environ is None:
+            self._environ = self._discover_attribute("environ")
+        return self._environ
+
     @property
     def logger(self):
         """Expose the logger object."""
@@ -51,6 +109,11 @@ class Command(base_worker.Worker):
             self._logger = self._discover_attribute("logger")
         return self._logger
 
+    def resolve_path(self, path):
+        """Return the received path relative to the working directory
+        of the client (used as the type of the path arguments)."""
+        return self._discover_attribute("resolve_path")(path)
+
     def _discover_attribute(self, attribute):
         """Search for the received attribute in the command tree."""
         command_tree = [self.parent]
@@ -181,11 +244,16 @@ class Application(Group, base_worker.Worker):
             # ...
     """
 
-    def __init__(self, command_line):
+    def __init__(self, command_line, logger_name=None, environ=None,
+                 cwd=None):
+        # The parsers use the environment for the default values
+        self._environ = os.environ if environ is None else environ
+        self._cwd = cwd or os.getcwd()
         super(Application, self).__init__(parent=None, parser=None)
         self._args = None
         self._command_line = command_line
         self._logger = None
+        self._logger_name = logger_name or __name__
 
     @property
     def args(self):
@@ -197,13 +265,26 @@ class Application(Group, base_worker.Worker):
         """Command line provided to parser."""
         return self._command_line
 
+    @property
+    def environ(self):
+        """The environment variables of the client (the ones of the
+        current process, unless the command runs in the daemon)."""
+        return self._environ
+
+    def resolve_path(self, path):
+        """Return the received path relative to the working directory
+        of the client (used as the type of the path arguments)."""
+        if not path:
+            return path
+        return os.path.join(self._cwd, path)
+
     @property
     def logger(self):
         """Expose the logger object."""
         if not self._logger:
             level = (logging.DEBUG if self.args["verbose"]
                      else logging.ERROR)
-            self._logger = self._get_logger(__name__, level)
+            self._logger = self._get_logger(self._logger_name, level)
         return self._logger
 
     @staticmethod
@@ -224,6 +305,13 @@ class Application(Group, base_worker.Worker):
         logger.setLevel(level)
         return logger
 
+    def _flush_metrics(self):
+        """Export the metrics collected by the current command."""
+        try:
+            metrics.flush()
+        except (IOError, OSError) as exc:
+            self.logger.warning("Failed to export the metrics: %s", exc)
+
     @abc.abstractmethod
     def setup(self):
         """Extend the parser configuration in order to expose all
@@ -243,10 +331,15 @@ class Application(Group, base_worker.Worker):
         """
         pass
 
+    def parse(self):
+        """Parse the command line and return the arguments."""
+        self._args = vars(self._parser.parse_args(self.command_line))
+        return self._args
+
     def _prologue(self):
         """Executed once before the command running."""
         super(Application, self)._prologue()
-        self._args = vars(self._parser.parse_args(self.command_line))
+        self.parse()
 
     def _work(self):
         """Parse the command line."""
@@ -260,4 +353,38 @@ class Application(Group, base_worker.Worker):
                               "required action. (%s)", self.args)
             return
 
-        return work_function()
+        if self.args.get("cache_dir"):
+            try:
+                util.check_private_dir(self.args["cache_dir"])
+            except (OSError, ValueError) as exc:
+                self.logger.error("The cache directory can't be used: %s",
+                                  exc)
+                return False
+
+        trace_file = self.args.get("trace")
+        settings = (trace_file, self.args.get("metrics_dir"),
+                    history.location(self.args))
+        with _SETTINGS.use(settings, exclusive=bool(trace_file)):
+            return self._run_command(work_function)
+
+    def _run_command(self, work_function):
+        """Run the command with the tracer, the metrics registry and
+        the timing history required by the command line."""
+        # The tasks use the engine from the threads of the scheduler
+        engine.handle_sigterm()
+        trace_file = self.args.get("trace")
+        if trace_file:
+            trace.configure(trace_file)
+        metrics.configure(self.args.get("metrics_dir"))
+        history.configure(history.location(self.args))
+        try:
+            with trace.get_tracer().span(
+                    " ".join(["arestor"] + list(self.command_line)),
+                    "command"):
+                return work_function()
+        finally:
+            if self.args.get("metrics_dir"):
+                self._flush_metrics()
+            if trace_file:
+                trace.finish()
+                self.logger.info("The trace was written to %s", trace_file)
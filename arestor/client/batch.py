@@ -0,0 +1,271 @@
+"""
+Batch provisioning:
+    Run the install pipeline for multiple builds over a pool of
+    processes.
+"""
+
+import concurrent.futures
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import time
+
+from arestor.client import base as client_base
+from arestor.worker import engine
+from arestor.worker import history
+from arestor.worker import metrics
+from arestor.worker import scheduler
+from arestor.worker import trace
+
+# The queue used by the worker processes for sending their log records
+# to the process that started the batch
+_LOG_QUEUE = None
+
+
+class Build(object):
+
+    """The executor used for the tasks of a single build.
+
+    :param args:    The arguments for the current build.
+    :param logger:  The logger object.
+    :param environ: The environment variables of the client.
+                    (Default: the ones of the current process)
+    """
+
+    def __init__(self, args, logger, environ=None):
+        self._args = args
+        self._logger = logger
+        self._environ = os.environ if environ is None else environ
+        self._failures = []
+
+    @property
+    def args(self):
+        """The arguments for the current build."""
+        return self._args
+
+    @property
+    def logger(self):
+        """Expose the logger object."""
+        return self._logger
+
+    @property
+    def environ(self):
+        """The environment variables of the client."""
+        return self._environ
+
+    @property
+    def name(self):
+        """The name of the executor."""
+        return "Build(%s)" % self._args.get("build")
+
+    @property
+    def failures(self):
+        """The (task, error) pairs for all the failed tasks."""
+        return list(self._failures)
+
+    def on_task_done(self, task, result):
+        """What to execute after successfully finished processing a task."""
+        self.logger.info("[%s] Task %s successfully finished. (Result: %s)",
+                         self._args.get("build"), task.name, result)
+
+    def on_task_fail(self, task, exc):
+        """What to do when the program fails processing a task."""
+        self._failures.append((task.name, str(exc)))
+        self.logger.error("[%s] Task %s failed: %s",
+                          self._args.get("build"), task.name, exc)
+
+
+class _LogForwarder(logging.Handler):
+
+    """Pass the log records received from the worker processes to the
+    logger of the batch (which may send them to a daemon client)."""
+
+    def __init__(self, logger):
+        super(_LogForwarder, self).__init__()
+        self._logger = logger
+
+    def emit(self, record):
+        self._logger.handle(record)
+
+
+def initialize(log_queue):
+    """Prepare a new worker process: its log records are sent to the
+    process that started the batch through the received queue."""
+    global _LOG_QUEUE  # pylint: disable=global-statement
+    _LOG_QUEUE = log_queue
+
+
+def _get_logger(name, level):
+    """Obtain the logger of a worker process."""
+    if _LOG_QUEUE is None:
+        # pylint: disable=protected-access
+        return client_base.Application._get_logger(name, level)
+
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.addHandler(logging.handlers.QueueHandler(_LOG_QUEUE))
+        logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+
+def provision(tasks, args, logger_name, level, environ=None):
+    """Run the received tasks for a single build.
+
+    This is the entry point of the worker processes. When tracing is
+    enabled every build writes its own trace file, next to the one
+    received from the command line (`<trace>.<build>.json`).
+
+    :returns: A dictionary with the result of the build.
+    """
+    logger = _get_logger(logger_name, level)
+    build = Build(args, logger, environ=environ)
+    started = time.time()
+
+    # The worker processes run the builds from their main thread
+    engine.handle_sigterm()
+    if args.get("trace"):
+        root, extension = os.path.splitext(args["trace"])
+        trace.configure("%s.%s%s" % (root, args.get("build"), extension))
+    if args.get("metrics_dir"):
+        metrics.configure(args["metrics_dir"])
+    history.configure(history.location(args))
+
+    task_scheduler = scheduler.Scheduler(executor=build, tasks=tasks,
+                                         workers=args.get("workers", 1))
+    try:
+        with trace.get_tracer().span("build %s" % args.get("build"),
+                                     "build"):
+            status = task_scheduler.run()
+    except Exception as exc:
+        logger.error("[%s] Build failed: %s", args.get("build"), exc)
+        status = False
+    finally:
+        trace.finish()
+        try:
+            metrics.flush()
+        except (IOError, OSError) as exc:
+            logger.warning("[%s] Failed to export the metrics: %s",
+                           args.get("build"), exc)
+
+    return {
+        "build": args.get("build"),
+        "status": status,
+        "duration": time.time() - started,
+        "failed": build.failures,
+        "cancelled": sorted(task.__name__
+                            for task in task_scheduler.cancelled),
+    }
+
+
+def load_manifest(path):
+    """Read the builds from a JSON manifest.
+
+    The manifest contains a list of builds (or an object with the list
+    under the `builds` key). Every build is either the build id or an
+    object with the `build` key and the arguments that should be
+    overridden for it (like `argus_branch` or `tempest_branch`).
+    """
+    with open(path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if isinstance(manifest, dict):
+        manifest = manifest.get("builds", [])
+
+    builds = []
+    for item in manifest:
+        if not isinstance(item, dict):
+            item = {"build": item}
+        if not item.get("build"):
+            raise ValueError("Invalid build in %(path)s: %(item)r" %
+                             {"path": path, "item": item})
+        item["build"] = str(item["build"])
+        builds.append(item)
+    return builds
+
+
+class Batch(object):
+
+    """Provision multiple builds over a pool of processes.
+
+    :param tasks:       The tasks that should run for every build.
+    :param parallel:    How many builds can run at the same time.
+    :param logger:      The logger object.
+    :param environ:     The environment variables of the client.
+    """
+
+    def __init__(self, tasks, parallel, logger, environ=None):
+        self._tasks = tuple(tasks)
+        self._parallel = max(1, parallel or 1)
+        self._logger = logger
+        # Sent to the worker processes, so it must be a plain dictionary
+        self._environ = dict(environ) if environ is not None else None
+
+    def run(self, builds):
+        """Provision all the received builds.
+
+        :param builds:  A list with the arguments for every build.
+        :returns:       A list with the results, in the received order.
+        """
+        # The worker processes are started from scratch, so they don't
+        # inherit the threads (like the execution engine) of this one.
+        context = multiprocessing.get_context("spawn")
+        log_queue = context.Queue()
+        listener = logging.handlers.QueueListener(
+            log_queue, _LogForwarder(self._logger))
+        listener.start()
+        try:
+            return self._run(builds, context, log_queue)
+        finally:
+            # Wait for all the log records sent by the worker processes
+            listener.stop()
+
+    def _run(self, builds, context, log_queue):
+        """Provision the builds over a new pool of worker processes."""
+        results = {}
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(self._parallel, len(builds)) or 1,
+                mp_context=context, initializer=initialize,
+                initargs=(log_queue, )) as pool:
+            futures = {}
+            for args in builds:
+                future = pool.submit(provision, self._tasks, args,
+                                     self._logger.name,
+                                     self._logger.level,
+                                     self._environ)
+                futures[future] = args["build"]
+
+            for future in concurrent.futures.as_completed(futures):
+                build = futures[future]
+                try:
+                    results[build] = future.result()
+                except Exception as exc:
+                    self._logger.error("[%s] Build failed: %s", build, exc)
+                    results[build] = {"build": build, "status": False,
+                                      "duration": None,
+                                      "failed": [("Build", str(exc))],
+                                      "cancelled": []}
+
+        return [results[args["build"]] for args in builds]
+
+
+def format_summary(results):
+    """Return a short report for the received build results."""
+    lines = ["%-24s %-8s %10s  %s" % ("BUILD", "STATUS", "DURATION",
+                                      "DETAILS")]
+    for result in results:
+        details = ["%s: %s" % failure for failure in result["failed"]]
+        if result["cancelled"]:
+            details.append("cancelled: %s" % ", ".join(result["cancelled"]))
+        duration = ("%.1fs" % result["duration"]
+                    if result["duration"] is not None else "-")
+        lines.append(("%-24s %-8s %10s  %s" % (
+            result["build"], "OK" if result["status"] else "FAILED",
+            duration, "; ".join(details))).rstrip())
+
+    failed = len([result for result in results if not result["status"]])
+    lines.append("%d build(s), %d failed." % (len(results), failed))
+    return "\n".join(lines)
+
@@ -0,0 +1,321 @@
+"""
+Arestor daemon:
+    A resident process that runs the jobs received on a Unix socket,
+    and the thin client used for submitting them.
+
+The protocol is line based: the client sends a JSON object with the
+command line, its working directory and its `OS_*` / `ARGUS_*`
+environment variables (`{"argv": [...], "cwd": "...", "env": {...}}`).
+The daemon answers with a JSON object for every log record
+(`{"log": "..."}`) and for everything the job writes on the standard
+streams (`{"stdout": "..."}`, `{"stderr": "..."}`), followed by the
+exit status of the job (`{"status": 0}`).
+
+The daemon runs the jobs with its own privileges (usually root), so
+only the processes of the same user can submit them: the socket is
+created with the 0600 mode, in a directory that no other user can
+change, and the credentials of every peer are checked.
+"""
+
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+from arestor.worker import engine
+from arestor.worker import util
+
+DEFAULT_SOCKET = "/run/arestor/arestor.sock"
+# The environment variables sent by the clients with every job
+FORWARDED = ("OS_", "ARGUS_", "TEMPEST_")
+
+# The job running on the current thread
+_JOB = threading.local()
+
+
+def run_application(application, command_line, logger_name=None,
+                    environ=None, cwd=None):
+    """Run the received application and return the exit status.
+
+    :param application:  The :class:`client.base.Application` subclass.
+    :param command_line: The arguments for the application.
+    :param logger_name:  The name of the logger used by the application.
+    :param environ:      The environment variables of the client.
+    :param cwd:          The working directory of the client.
+    """
+    client = application(command_line, logger_name=logger_name,
+                         environ=environ, cwd=cwd)
+    try:
+        result = client.run()
+    except SystemExit as exc:
+        code = exc.code
+        return code if isinstance(code, int) else int(bool(code))
+    return 1 if result is False else 0
+
+
+def forwarded_environment(environ=None):
+    """Return the variables from the received environment which are
+    sent to the daemon (see :data:`FORWARDED`)."""
+    environ = os.environ if environ is None else environ
+    return dict((name, value) for name, value in environ.items()
+                if name.startswith(FORWARDED))
+
+
+def job_environment(variables):
+    """Return the environment of a job: the one of the daemon, with the
+    forwarded variables replaced by the ones received from the client.
+    """
+    environ = dict((name, value) for name, value in os.environ.items()
+                   if not name.startswith(FORWARDED))
+    environ.update(forwarded_environment(
+        dict((str(name), str(value)) for name, value in variables.items())))
+    return environ
+
+
+class _JobStream(object):
+
+    """Send what the jobs write on a standard stream (like the reports
+    or the messages of the parser) to their clients. Everything written
+    outside of a job goes to the original stream.
+
+    :param stream:  The original stream.
+    :param channel: The name of the stream (`stdout` or `stderr`).
+    """
+
+    def __init__(self, stream, channel):
+        self._stream = stream
+        self._channel = channel
+
+    def write(self, data):
+        """Write the received text on the stream of the current job."""
+        send = getattr(_JOB, "send", None)
+        if send is None:
+            return self._stream.write(data)
+        try:
+            send({self._channel: data})
+        except (IOError, OSError):
+            # The client is gone, the job doesn't have to fail for it
+            pass
+        return len(data)
+
+    def flush(self):
+        """Flush the original stream (the messages are not buffered)."""
+        if getattr(_JOB, "send", None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _JobLogHandler(logging.Handler):
+
+    """Send the log records of a job to the client."""
+
+    def __init__(self, send):
+        super(_JobLogHandler, self).__init__()
+        self._send = send
+
+    def emit(self, record):
+        try:
+            self._send({"log": self.format(record)})
+        except Exception:
+            self.handleError(record)
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+
+    """Handle a connection received by the daemon."""
+
+    def _send(self, message):
+        """Send a message to the client."""
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with self._lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def handle(self):
+        self._lock = threading.Lock()
+        line = self.rfile.readline()
+        if not line.strip():
+            # Probe from a client checking if the daemon is running
+            return
+
+        try:
+            request = json.loads(line.decode("utf-8"))
+            command_line = [str(argument) for argument in request["argv"]]
+            environ = job_environment(request.get("env") or {})
+            cwd = request.get("cwd")
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            self._send({"log": "Invalid request: %s" % exc})
+            self._send({"status": 2})
+            return
+
+        status = self.server.run_job(command_line, self._send,
+                                     environ=environ, cwd=cwd)
+        try:
+            self._send({"status": status})
+        except (IOError, OSError):
+            pass
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """Listen on a Unix socket and run the received jobs on a pool of
+    workers.
+
+    :param path:        The location of the Unix socket.
+    :param application: The :class:`client.base.Application` subclass
+                        used for running the jobs.
+    :param workers:     How many jobs can run at the same time.
+    :param logger:      The logger used by the daemon.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, application, workers, logger):
+        self._path = path
+        self._application = application
+        self._logger = logger
+        self._counter = itertools.count(1)
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, workers or 1))
+
+        # The directory must not be writable by other users, otherwise
+        # they can replace the socket
+        util.check_private_dir(os.path.dirname(os.path.abspath(path)))
+        if os.path.exists(path):
+            if is_running(path):
+                raise ValueError("Another daemon is listening on %(path)s" %
+                                 {"path": path})
+            os.remove(path)
+
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _JobHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+
+    @property
+    def path(self):
+        """The location of the Unix socket."""
+        return self._path
+
+    def verify_request(self, request, client_address):
+        """Accept only the clients of the user running the daemon."""
+        credentials = request.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        pid, uid, _ = struct.unpack("3i", credentials)
+        if uid != os.geteuid():
+            self._logger.warning("Rejected the connection of process %d "
+                                 "(uid %d).", pid, uid)
+            return False
+        return True
+
+    def _run(self, job_id, command_line, send, environ, cwd):
+        """Run a job and return its exit status."""
+        logger_name = "arestor.job.%d" % job_id
+        logger = logging.getLogger(logger_name)
+        handler = _JobLogHandler(send)
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+        _JOB.send = send
+        try:
+            return run_application(self._application, command_line,
+                                   logger_name=logger_name,
+                                   environ=environ, cwd=cwd)
+        except Exception as exc:
+            logger.exception("Job %d failed: %s", job_id, exc)
+            return 1
+        finally:
+            _JOB.send = None
+            logger.removeHandler(handler)
+            handler.close()
+            # Every job has its own logger, don't keep them forever
+            logging.Logger.manager.loggerDict.pop(logger_name, None)
+
+    def run_job(self, command_line, send, environ=None, cwd=None):
+        """Run the received command line on the pool of workers and
+        wait for its exit status.
+
+        :param environ: The environment variables of the client.
+        :param cwd:     The working directory of the client.
+        """
+        job_id = next(self._counter)
+        self._logger.info("Job %d: %s", job_id, " ".join(command_line))
+        future = self._pool.submit(self._run, job_id, command_line, send,
+                                   environ, cwd)
+        status = future.result()
+        self._logger.info("Job %d finished with status %s", job_id, status)
+        return status
+
+    def serve(self):
+        """Handle the requests until the daemon is interrupted."""
+        self._logger.info("Listening on %s", self._path)
+        # The jobs run on other threads, the handler is installed here
+        engine.handle_sigterm()
+        streams = sys.stdout, sys.stderr
+        sys.stdout = _JobStream(sys.stdout, "stdout")
+        sys.stderr = _JobStream(sys.stderr, "stderr")
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout, sys.stderr = streams
+            self.server_close()
+            self._pool.shutdown(wait=True)
+            if os.path.exists(self._path):
+                os.remove(self._path)
+
+
+def is_running(path):
+    """Check if a daemon is listening on the received socket."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except (IOError, OSError):
+        return False
+    finally:
+        client.close()
+    return True
+
+
+def submit(path, command_line, output=None):
+    """Submit a job to the daemon and stream back its logs and its
+    output.
+
+    :returns: The exit status of the job.
+    """
+    output = output or sys.stdout
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    try:
+        request = json.dumps({"argv": list(command_line),
+                              "cwd": os.getcwd(),
+                              "env": forwarded_environment()}) + "\n"
+        client.sendall(request.encode("utf-8"))
+        for line in client.makefile("rb"):
+            message = json.loads(line.decode("utf-8"))
+            if "log" in message:
+                print(message["log"], file=output)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+            if "stderr" in message:
+                sys.stderr.write(message["stderr"])
+            if "status" in message:
+                return message["status"]
+    finally:
+        sys.stdout.flush()
+        client.close()
+
+    # The daemon closed the connection without sending the status
+    return 1
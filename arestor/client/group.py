@@ -1,9 +1,43 @@
 """The commands used by the command line parser."""
 
 import os
+import time
 
 from arestor.client import base as client_base
+from arestor.client import batch
+from arestor.client import daemon
 from arestor.worker import command
+from arestor.worker import history
+from arestor.worker import scheduler
+
+ARGUS_TASKS = (
+    # Create the virtual environment for Argus-Ci
+    command.CreateEnvironment,
+    # Fetch and build Tempest
+    command.InstallTempest,
+    # Fetch and build Arugs-Ci
+    command.InstallArgusCi,
+    # Install both of them, with their requirements resolved together
+    command.InstallRequirements,
+    # Check everything that was installed, at once
+    command.VerifyEnvironment,
+)
+
+
+def add_build_arguments(parser, environ):
+    """Expose the arguments required for installing Argus-CI."""
+    parser.add_argument("--user", dest="user", default="root",
+                        help="Run the commands as specified user.")
+    parser.add_argument(
+        "--argus-branch", dest="argus_branch",
+        default=environ.get("ARGUS_BRANCH", "master"),
+        help="the required branch / revision of argus repository "
+             "(Default: master)")
+    parser.add_argument(
+        "--tempest-branch", dest="tempest_branch",
+        default=environ.get("TEMPEST_BRANCH", "tags/7"),
+        help="the required branch / revision of argus repository "
+             "(Default: tags/7)")
 
 
 class InstallArgusCiDependences(client_base.Command):
@@ -29,7 +63,8 @@ class InstallArgusCiDependences(client_base.Command):
 
         # Create the virtual environment for Argus-Ci
         task = command.SetupEnvironment(self)
-        return task.run()
+        result = task.run()
+        return False if task.error else result
 
 
 class InstallArgusCi(client_base.Command):
@@ -48,18 +83,7 @@ class InstallArgusCi(client_base.Command):
             "argus",
             help="Install the Argus-CI on the current machine.")
 
-        parser.add_argument("--user", dest="user", default="root",
-                            help="Run the commands as specified user.")
-        parser.add_argument(
-            "--argus-branch", dest="argus_branch",
-            default=os.environ.get("ARGUS_BRANCH", "master"),
-            help="the required branch / revision of argus repository "
-                 "(Default: master)")
-        parser.add_argument(
-            "--tempest-branch", dest="tempest_branch",
-            default=os.environ.get("TEMPEST_BRANCH", "tags/7"),
-            help="the required branch / revision of argus repository "
-                 "(Default: tags/7)")
+        add_build_arguments(parser, self.environ)
         parser.add_argument(
             "--build", dest="build", type=str, required=True,
             help="The unique identifier for the current job."
@@ -77,21 +101,272 @@ class InstallArgusCi(client_base.Command):
 
     def _work(self):
         """Install the Argus-CI on the current machine."""
-        tasks = (
-            # Create the virtual environment for Argus-Ci
-            command.CreateEnvironment,
-            # Install Tempest and its requirements
-            command.InstallTempest,
-            # Install Arugs-Ci and its requirements
-            command.InstallArgusCi
-        )
+        task_scheduler = scheduler.Scheduler(
+            executor=self, tasks=ARGUS_TASKS,
+            workers=self.args.get("workers", 1))
+        return task_scheduler.run() and self.__status
+
+
+class InstallArgusCiBatch(client_base.Command):
+
+    """Install the Argus-CI for multiple builds at once."""
+
+    def setup(self):
+        """Extend the parser configuration in order to expose all
+        the received commands.
+        """
+        parser = self._parser.add_parser(
+            "batch",
+            help="Install the Argus-CI for multiple builds at once.")
+
+        add_build_arguments(parser, self.environ)
+        builds = parser.add_mutually_exclusive_group(required=True)
+        builds.add_argument(
+            "--builds", dest="builds", nargs="+", metavar="BUILD",
+            help="The unique identifiers for the jobs.")
+        builds.add_argument(
+            "--manifest", dest="manifest", type=self.resolve_path,
+            help="A JSON file with the builds and their arguments.")
+        parser.add_argument(
+            "--parallel", dest="parallel", type=int,
+            default=int(self.environ.get("ARGUS_PARALLEL", 4)),
+            help="How many builds can be provisioned at the same time. "
+                 "(Default: 4)")
+
+        parser.set_defaults(work=self.run)
+
+    def _get_builds(self):
+        """Return the arguments for every build from the batch."""
+        if self.args.get("manifest"):
+            overrides = batch.load_manifest(self.args["manifest"])
+        else:
+            overrides = [{"build": build} for build in self.args["builds"]]
+
+        builds, seen = [], set()
+        for override in overrides:
+            if override["build"] in seen:
+                self.logger.warning("Duplicate build %s ignored.",
+                                    override["build"])
+                continue
+            seen.add(override["build"])
+
+            args = dict((key, value) for key, value in self.args.items()
+                        if key not in ("work", "builds", "manifest"))
+            args.update(override)
+            builds.append(args)
+        return builds
+
+    def _prefetch(self, builds):
+        """Warm up the shared caches before starting the builds, so the
+        OpenStack resources and the revisions are resolved only once.
+        """
+        try:
+            command.InstallTempest(batch.Build(
+                builds[0], self.logger,
+                environ=self.environ)).prefetch_resources()
+        except Exception as exc:
+            self.logger.warning("Failed to prefetch the OpenStack "
+                                "resources: %s", exc)
+
+        resolved = set()
+        for args in builds:
+            for task in (command.InstallTempest, command.InstallArgusCi):
+                if (task, args[task.BRANCH]) in resolved:
+                    continue
+                resolved.add((task, args[task.BRANCH]))
+                try:
+                    task(batch.Build(args, self.logger,
+                                     environ=self.environ)).prefetch()
+                except Exception as exc:
+                    self.logger.warning("Failed to resolve %s: %s",
+                                        args[task.BRANCH], exc)
+
+            # The caches are fresh, there is no need to refresh them again
+            args["refresh_cache"] = False
+
+    def _work(self):
+        """Install the Argus-CI for all the received builds."""
+        builds = self._get_builds()
+        if not builds:
+            self.logger.error("No build was provided.")
+            return False
+
+        self._prefetch(builds)
+        runner = batch.Batch(ARGUS_TASKS, self.args.get("parallel"),
+                             self.logger, environ=self.environ)
+        results = runner.run(builds)
+        print(batch.format_summary(results))
+        return all(result["status"] for result in results)
+
+
+class FillEnvironmentPool(client_base.Command):
+
+    """Create the virtual environments from the pool."""
+
+    def setup(self):
+        """Extend the parser configuration in order to expose all
+        the received commands.
+        """
+        parser = self._parser.add_parser(
+            "fill",
+            help="Create virtual environments until the pool is full.")
+        parser.add_argument("--user", dest="user", default="root",
+                            help="The owner of the virtual environments.")
+
+        parser.set_defaults(work=self.run)
+
+    def _work(self):
+        """Fill the pool of virtual environments."""
+        task = command.FillEnvironmentPool(self)
+        result = task.run()
+        return False if task.error else result
+
+
+class ReapEnvironments(client_base.Command):
+
+    """Delete the old build environments."""
+
+    def setup(self):
+        """Extend the parser configuration in order to expose all
+        the received commands.
+        """
+        parser = self._parser.add_parser(
+            "reap",
+            help="Delete the discarded build environments and the least "
+                 "recently used ones that exceed the quota.")
+
+        parser.set_defaults(work=self.run)
+
+    def _work(self):
+        """Reap the build environments."""
+        task = command.ReapEnvironments(self)
+        result = task.run()
+        return False if task.error else result
+
+
+class Serve(client_base.Command):
+
+    """Run the jobs received on a Unix socket."""
+
+    def setup(self):
+        """Extend the parser configuration in order to expose all
+        the received commands.
+        """
+        parser = self._parser.add_parser(
+            "serve",
+            help="Run the Arestor daemon. The clients submit their jobs "
+                 "to it when $ARESTOR_SOCKET is set.")
+        parser.add_argument(
+            "--socket", dest="socket", type=self.resolve_path,
+            default=self.environ.get("ARESTOR_SOCKET",
+                                     daemon.DEFAULT_SOCKET),
+            help="The Unix socket used for receiving the jobs. "
+                 "(Default: %s)" % daemon.DEFAULT_SOCKET)
+        parser.add_argument(
+            "--jobs", dest="jobs", type=int,
+            default=int(self.environ.get("ARESTOR_JOBS", 4)),
+            help="How many jobs can run at the same time. (Default: 4)")
+
+        parser.set_defaults(work=self.run)
+
+    def _application(self):
+        """Return the class of the application that contains the
+        current command.
+        """
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return type(node)
+
+    def _work(self):
+        """Run the daemon until it is interrupted."""
+        server = daemon.Server(self.args["socket"], self._application(),
+                               workers=self.args["jobs"],
+                               logger=self.logger)
+        server.serve()
+
+
+def _format_duration(value):
+    """Format a duration for the reports."""
+    return "%.1fs" % value if value is not None else "-"
+
 
-        for task in tasks:
-            if not self.__status:
-                break
-            task(self).run()
+class Stats(client_base.Command):
 
-        return self.__status
+    """Report how long the tasks take, using the timing history."""
+
+    def setup(self):
+        """Extend the parser configuration in order to expose all
+        the received commands.
+        """
+        parser = self._parser.add_parser(
+            "stats",
+            help="Report the p50 / p95 / p99 durations of the tasks and "
+                 "flag the ones that became slower.")
+        parser.add_argument(
+            "--days", dest="days", type=float, default=30,
+            help="How many days of history are used. (Default: 30)")
+        parser.add_argument(
+            "--window", dest="window", type=float, default=7,
+            help="The last WINDOW days are compared with the WINDOW days "
+                 "before them. (Default: 7)")
+        parser.add_argument(
+            "--threshold", dest="threshold", type=float, default=1.5,
+            help="Flag the tasks whose median duration grew by at least "
+                 "THRESHOLD times. (Default: 1.5)")
+        parser.add_argument(
+            "--phase", dest="phase", default="task",
+            choices=("task", "prologue", "work", "epilogue", "execute"),
+            help="Report the whole tasks, one of their phases or the "
+                 "executed commands. (Default: task)")
+        parser.add_argument(
+            "--trend", dest="trend", action="store_true", default=False,
+            help="Show the daily median duration of every task.")
+
+        parser.set_defaults(work=self.run)
+
+    def _print_trend(self, timings):
+        """Print the daily median duration of every task."""
+        for task, periods in sorted(history.trend(timings).items()):
+            print("\n%s" % task)
+            for start, runs, median in periods:
+                print("  %s %6d run(s) %10s" % (
+                    time.strftime("%Y-%m-%d", time.localtime(start)), runs,
+                    _format_duration(median)))
+
+    def _work(self):
+        """Print the report."""
+        path = history.location(self.args)
+        if not path or not os.path.exists(path):
+            self.logger.error("The timing history is not available: %s",
+                              path)
+            return False
+
+        timings = history.History(path).timings(
+            phase=self.args["phase"],
+            since=time.time() - self.args["days"] * 86400)
+        summary = history.report(timings, window=self.args["window"] * 86400,
+                                 threshold=self.args["threshold"])
+
+        print("%-26s %-16s %6s %9s %9s %9s %9s %8s" % (
+            "TASK", "BRANCH", "RUNS", "P50", "P95", "P99", "RECENT",
+            "CHANGE"))
+        for item in summary:
+            change = ("%+.0f%%" % ((item["change"] - 1) * 100)
+                      if item["change"] else "-")
+            print(("%-26s %-16s %6d %9s %9s %9s %9s %8s %s" % (
+                item["task"], item["branch"] or "-", item["runs"],
+                _format_duration(item["p50"]), _format_duration(item["p95"]),
+                _format_duration(item["p99"]),
+                _format_duration(item["recent"]), change,
+                "REGRESSION" if item["regression"] else "")).rstrip())
+
+        if self.args["trend"]:
+            self._print_trend(timings)
+        regressions = [item for item in summary if item["regression"]]
+        print("%d task(s), %d regression(s)." % (len(summary),
+                                                  len(regressions)))
+        return True
 
 
 class InstallGroup(client_base.Group):
@@ -100,6 +375,7 @@ class InstallGroup(client_base.Group):
 
     commands = [
         (InstallArgusCi, "install"),
+        (InstallArgusCiBatch, "install"),
         (InstallArgusCiDependences, "install"),
     ]
 
@@ -113,3 +389,44 @@ class InstallGroup(client_base.Group):
 
         install_action = parser.add_subparsers()
         self._register_parser("install", install_action)
+
+
+class PoolGroup(client_base.Group):
+
+    """Group for the commands that manage the pool of virtual
+    environments."""
+
+    commands = [
+        (FillEnvironmentPool, "pool"),
+    ]
+
+    def setup(self):
+        """Extend the parser configuration in order to expose all
+        the received commands.
+        """
+        parser = self._parser.add_parser(
+            "pool",
+            help="Manage the pool of pre-built virtual environments.")
+
+        pool_action = parser.add_subparsers()
+        self._register_parser("pool", pool_action)
+
+
+class EnvironmentGroup(client_base.Group):
+
+    """Group for the commands that manage the build environments."""
+
+    commands = [
+        (ReapEnvironments, "env"),
+    ]
+
+    def setup(self):
+        """Extend the parser configuration in order to expose all
+        the received commands.
+        """
+        parser = self._parser.add_parser(
+            "env",
+            help="Manage the virtual environments of the builds.")
+
+        env_action = parser.add_subparsers()
+        self._register_parser("env", env_action)
@@ -0,0 +1,147 @@
+"""Arestor command line application."""
+
+import argparse
+import os
+import sys
+
+from arestor.client import base as client_base
+from arestor.client import daemon
+from arestor.client import group as arestor_group
+
+
+def default_cache_dir(environ):
+    """Return the default cache directory: the one shared by the
+    builds for root and a private one for the other users (which can't
+    create /var/cache/arestor)."""
+    if os.geteuid() == 0:
+        return "/var/cache/arestor"
+    cache_home = (environ.get("XDG_CACHE_HOME") or
+                  os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "arestor")
+
+
+class ArestorClient(client_base.Application):
+
+    """Command line application for deploying Argus-Ci."""
+
+    commands = [
+        (arestor_group.InstallGroup, "commands"),
+        (arestor_group.PoolGroup, "commands"),
+        (arestor_group.EnvironmentGroup, "commands"),
+        (arestor_group.Serve, "commands"),
+        (arestor_group.Stats, "commands"),
+    ]
+
+    def setup(self):
+        """Extend the parser configuration in order to expose all
+        the received commands.
+        """
+        self._parser = argparse.ArgumentParser()
+        self._parser.add_argument(
+            "--attempts", dest="attempts", type=int,
+            default=int(self.environ.get("ARGUS_ATTEMPTS", 3)),
+            help="Interval between execute attempts, in seconds. "
+                 "(Default: 3)")
+        self._parser.add_argument(
+            "--retry_interval", dest="retry_interval", type=float,
+            default=float(self.environ.get("ARGUS_RETRY_INTERVAL", 0.1)),
+            help="How many times to retry running the command. "
+                 "(Default: 0.1)")
+        self._parser.add_argument(
+            "--workers", dest="workers", type=int,
+            default=int(self.environ.get("ARGUS_WORKERS", 2)),
+            help="How many independent tasks can run at the same time. "
+                 "(Default: 2)")
+        self._parser.add_argument(
+            "--max-processes", dest="max_processes", type=int,
+            default=int(self.environ.get("ARGUS_MAX_PROCESSES", 8)),
+            help="How many child processes can run at the same time. "
+                 "(Default: 8)")
+        self._parser.add_argument(
+            "--timeout", dest="timeout", type=float,
+            default=self.environ.get("ARGUS_TIMEOUT"),
+            help="How long a command can run, in seconds, before it is "
+                 "stopped and its attempt fails, instead of the limit of "
+                 "each task. Zero disables it. (Default: the limit of the "
+                 "task, 3600 for most of them)")
+        self._parser.add_argument(
+            "--log-dir", dest="log_dir", type=self.resolve_path,
+            default=self.environ.get("ARGUS_LOG_DIR"),
+            help="Stream the output of the long running commands in "
+                 "<log-dir>/<build>/<task>.log")
+        self._parser.add_argument(
+            "--cache-dir", dest="cache_dir", type=self.resolve_path,
+            default=self.environ.get("ARGUS_CACHE_DIR",
+                                     default_cache_dir(self.environ)),
+            help="The directory shared by the builds for caching the "
+                 "installation artifacts. It must not be writable by "
+                 "other users. An empty value disables the cache. "
+                 "(Default: /var/cache/arestor for root, "
+                 "$XDG_CACHE_HOME/arestor or ~/.cache/arestor for the "
+                 "other users)")
+        self._parser.add_argument(
+            "--cache-ttl", dest="cache_ttl", type=int,
+            default=int(self.environ.get("ARGUS_CACHE_TTL", 300)),
+            help="How long the OpenStack resources are cached, in seconds. "
+                 "(Default: 300)")
+        self._parser.add_argument(
+            "--refresh-cache", dest="refresh_cache", action="store_true",
+            default=False,
+            help="Ignore the cached OpenStack resources.")
+        self._parser.add_argument(
+            "--pool-size", dest="pool_size", type=int,
+            default=int(self.environ.get("ARGUS_POOL_SIZE", 2)),
+            help="How many pre-built virtual environments are kept in "
+                 "/tmp/argus-env/.pool for the new builds. Zero disables "
+                 "the pool. (Default: 2)")
+        self._parser.add_argument(
+            "--env-max-count", dest="env_max_count", type=int,
+            default=int(self.environ.get("ARGUS_ENV_MAX_COUNT", 0)),
+            help="How many build environments are kept in /tmp/argus-env. "
+                 "The least recently used ones are removed first, except "
+                 "the ones used in the last hour. Zero disables the "
+                 "limit. (Default: 0)")
+        self._parser.add_argument(
+            "--env-max-size", dest="env_max_size", type=int,
+            default=int(self.environ.get("ARGUS_ENV_MAX_SIZE", 0)),
+            help="How much disk space the build environments can use, in "
+                 "MiB. Zero disables the limit. (Default: 0)")
+        self._parser.add_argument(
+            "--trace", dest="trace", metavar="FILE",
+            type=self.resolve_path,
+            default=self.environ.get("ARGUS_TRACE"),
+            help="Record how long every task, child process and API call "
+                 "takes in FILE, as Chrome trace events.")
+        self._parser.add_argument(
+            "--metrics-dir", dest="metrics_dir", type=self.resolve_path,
+            default=self.environ.get("ARGUS_METRICS_DIR"),
+            help="Export the metrics in <metrics-dir>/arestor.prom, for "
+                 "the Prometheus textfile collector.")
+        self._parser.add_argument(
+            "--history", dest="history", metavar="FILE",
+            type=self.resolve_path,
+            default=self.environ.get("ARGUS_HISTORY"),
+            help="Record how long every task and command takes in the "
+                 "FILE SQLite database. An empty value disables it. "
+                 "(Default: <cache-dir>/history.sqlite)")
+        self._parser.add_argument(
+            "--no-journal", dest="journal", action="store_false",
+            default=True,
+            help="Run all the tasks, even if they were already completed "
+                 "for the current build.")
+
+        group = self._parser.add_mutually_exclusive_group()
+        group.add_argument("-v", "--verbose", action="store_true",
+                           default=False)
+        group.add_argument("-q", "--quiet", action="store_true",
+                           default=False)
+
+        commands = self._parser.add_subparsers(title="[commands]",
+                                               dest="command")
+
+        self._register_parser("commands", commands)
+
+
+if __name__ == "__main__":
+    # Used for running the commands in detached processes
+    sys.exit(daemon.run_application(ArestorClient, sys.argv[1:]))
@@ -0,0 +1,121 @@
+"""Tests for the task journal."""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from arestor.worker import base
+from arestor.worker import environments
+from arestor.worker import journal
+
+
+class FakeExecutor(object):
+
+    """The executor of a build, for the fingerprints of the tasks."""
+
+    def __init__(self, args):
+        self.args = args
+        self.logger = logging.getLogger("arestor.tests")
+        self.name = "FakeExecutor"
+
+
+class Parent(base.Command):
+
+    JOURNAL_ARGS = ("user", )
+
+    def _work(self):
+        pass
+
+
+class Child(base.Command):
+
+    DEPENDS = (Parent, )
+
+    def _work(self):
+        pass
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._root)
+        self._path = os.path.join(self._root, "build.journal")
+        self._journal = journal.Journal(self._path)
+
+    def test_missing_journal(self):
+        self.assertIsNone(self._journal.entry("Task"))
+        self.assertIsNone(self._journal.stamp("Task"))
+        self.assertFalse(self._journal.is_valid("Task", "fingerprint"))
+
+    def test_record(self):
+        stamp = self._journal.record("Task", "fingerprint")
+        self.assertEqual(self._journal.stamp("Task"), stamp)
+        self.assertTrue(self._journal.is_valid("Task", "fingerprint"))
+        self.assertFalse(self._journal.is_valid("Task", "changed"))
+        # Another process reads the same file
+        self.assertTrue(journal.Journal(self._path).is_valid(
+            "Task", "fingerprint"))
+
+    def test_run_again_changes_the_stamp(self):
+        first = self._journal.record("Task", "fingerprint")
+        second = self._journal.record("Task", "fingerprint")
+        self.assertNotEqual(first, second)
+
+    def test_remove(self):
+        self._journal.record("Task", "fingerprint")
+        self._journal.record("Other", "fingerprint")
+        self._journal.remove("Task")
+        self.assertFalse(self._journal.is_valid("Task", "fingerprint"))
+        self.assertTrue(self._journal.is_valid("Other", "fingerprint"))
+
+    def test_clear(self):
+        self._journal.record("Task", "fingerprint")
+        self._journal.clear()
+        self.assertIsNone(self._journal.entry("Task"))
+
+    def test_corrupted_journal(self):
+        with open(self._path, "w") as journal_file:
+            journal_file.write("{not json")
+        self.assertIsNone(self._journal.entry("Task"))
+        self._journal.record("Task", "fingerprint")
+        self.assertTrue(self._journal.is_valid("Task", "fingerprint"))
+
+
+class TestInvalidation(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        patcher = mock.patch.object(environments, "ROOT", root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._args = {"build": "build", "user": "argus"}
+
+    def _task(self, task, **args):
+        return task(FakeExecutor(dict(self._args, **args)))
+
+    def test_arguments_change_the_fingerprint(self):
+        self.assertEqual(self._task(Parent).fingerprint(),
+                         self._task(Parent).fingerprint())
+        self.assertNotEqual(self._task(Parent).fingerprint(),
+                            self._task(Parent, user="root").fingerprint())
+
+    def test_running_a_dependency_invalidates_the_task(self):
+        parent, child = self._task(Parent), self._task(Child)
+        parent.journal.record(parent.name, parent.fingerprint())
+        child.journal.record(child.name, child.fingerprint())
+        self.assertTrue(child.journal.is_valid(child.name,
+                                               child.fingerprint()))
+
+        # The parent runs again, with the same inputs
+        parent.journal.record(parent.name, parent.fingerprint())
+        self.assertFalse(child.journal.is_valid(child.name,
+                                                child.fingerprint()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Tests for the retry policies."""
+
+import subprocess
+import unittest
+
+from arestor.worker import engine
+from arestor.worker import retry
+
+
+def _error(returncode=1, stdout="", stderr=""):
+    """Return the error raised by a failed command."""
+    return subprocess.CalledProcessError(returncode=returncode,
+                                         cmd=["fake"],
+                                         output=(stdout, stderr))
+
+
+class TestClassifiers(unittest.TestCase):
+
+    def test_exit_code(self):
+        classifier = retry.ExitCodeClassifier([100], decision=retry.FAIL)
+        self.assertIs(classifier(_error(100)), retry.FAIL)
+        self.assertIsNone(classifier(_error(1)))
+
+    def test_apt_lock(self):
+        error = _error(stderr="E: Could not get lock /var/lib/dpkg/lock")
+        self.assertIs(retry.APT_LOCK(error), retry.RETRY)
+        self.assertIsNone(retry.APT_LOCK(_error(stderr="E: Broken")))
+
+    def test_network_error_bytes(self):
+        error = _error(stderr=b"fatal: early EOF")
+        self.assertIs(retry.NETWORK_ERROR(error), retry.RETRY)
+
+    def test_timeout(self):
+        error = engine.CommandTimeout(returncode=-15, cmd=["fake"],
+                                      timeout=10)
+        self.assertIs(retry.TIMEOUT(error), retry.RETRY)
+        self.assertIsNone(retry.TIMEOUT(_error()))
+
+    def test_classifier_is_abstract(self):
+        self.assertRaises(TypeError, retry.Classifier)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_first_decision_wins(self):
+        policy = retry.RetryPolicy(
+            attempts=3, classifiers=(
+                retry.ExitCodeClassifier([2], decision=retry.FAIL),
+                retry.ExitCodeClassifier([2, 3])),
+            default=retry.RETRY)
+        self.assertIsNone(policy.next_delay(1, _error(2), 0))
+        self.assertEqual(policy.next_delay(1, _error(3), 0), 0)
+
+    def test_default(self):
+        self.assertIsNone(retry.NETWORK_POLICY.bind(3, 0).next_delay(
+            1, _error(stderr="SyntaxError"), 0))
+
+    def test_attempts(self):
+        policy = retry.RetryPolicy(attempts=2, interval=1)
+        self.assertEqual(policy.next_delay(1, _error(), 0), 1)
+        self.assertIsNone(policy.next_delay(2, _error(), 0))
+
+    def test_budget(self):
+        policy = retry.RetryPolicy(attempts=5, interval=10, budget=60)
+        self.assertEqual(policy.next_delay(1, _error(), 45), 10)
+        self.assertIsNone(policy.next_delay(1, _error(), 55))
+
+    def test_backoff(self):
+        policy = retry.RetryPolicy(interval=1, backoff=2, max_interval=5)
+        self.assertEqual([policy.delay(attempt) for attempt in (1, 2, 3, 4)],
+                         [1, 2, 4, 5])
+
+    def test_bind(self):
+        policy = retry.RetryPolicy(interval=3).bind(attempts=4, interval=1)
+        self.assertEqual((policy.attempts, policy.interval), (4, 3))
+
+    def test_timed_out_attempt_is_retried(self):
+        # The tasks limit their commands below the budget of the policy
+        error = engine.CommandTimeout(returncode=-15, cmd=["fake"],
+                                      timeout=1800)
+        policy = retry.NETWORK_POLICY.bind(attempts=2, interval=0)
+        self.assertIsNotNone(policy.next_delay(1, error, 1800))
+
+
+if __name__ == "__main__":
+    unittest.main()
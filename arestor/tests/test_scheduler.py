@@ -0,0 +1,118 @@
+"""Tests for the task scheduler."""
+
+import logging
+import unittest
+
+from arestor.worker import scheduler
+
+
+class FakeExecutor(object):
+
+    """The executor received by the fake tasks."""
+
+    def __init__(self):
+        self.logger = logging.getLogger("arestor.tests")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.started = []
+
+
+class FakeTask(object):
+
+    """A task which succeeds, unless FAIL is set."""
+
+    DEPENDS = ()
+    FAIL = False
+
+    def __init__(self, executor):
+        self._executor = executor
+        self.error = None
+
+    def run(self):
+        """Record the task and fail if it was asked to."""
+        self._executor.started.append(type(self))
+        if self.FAIL:
+            self.error = ValueError("%s failed" % type(self).__name__)
+
+
+class Root(FakeTask):
+    pass
+
+
+class Child(FakeTask):
+    DEPENDS = (Root, )
+
+
+class GrandChild(FakeTask):
+    DEPENDS = (Child, )
+
+
+class Sibling(FakeTask):
+    DEPENDS = (Root, )
+
+
+class FailingChild(FakeTask):
+    DEPENDS = (Root, )
+    FAIL = True
+
+
+class Dependent(FakeTask):
+    DEPENDS = (FailingChild, )
+
+
+class Indirect(FakeTask):
+    DEPENDS = (Dependent, Sibling)
+
+
+class Cycle(FakeTask):
+    pass
+
+
+class Cycle2(FakeTask):
+    DEPENDS = (Cycle, )
+
+
+Cycle.DEPENDS = (Cycle2, )
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self._executor = FakeExecutor()
+
+    def _run(self, *tasks, **kwargs):
+        task_scheduler = scheduler.Scheduler(self._executor, tasks=tasks,
+                                             **kwargs)
+        return task_scheduler, task_scheduler.run()
+
+    def test_dependencies_order(self):
+        task_scheduler, status = self._run(GrandChild, Child, Root,
+                                           workers=4)
+        self.assertTrue(status)
+        self.assertEqual(self._executor.started, [Root, Child, GrandChild])
+        self.assertEqual(task_scheduler.done, {Root, Child, GrandChild})
+
+    def test_failure_cancels_dependents(self):
+        task_scheduler, status = self._run(
+            Root, FailingChild, Dependent, Indirect, Sibling, workers=2)
+        self.assertFalse(status)
+        self.assertEqual(task_scheduler.failed, {FailingChild})
+        self.assertEqual(task_scheduler.cancelled, {Dependent, Indirect})
+        self.assertEqual(task_scheduler.done, {Root, Sibling})
+        self.assertNotIn(Dependent, self._executor.started)
+        self.assertNotIn(Indirect, self._executor.started)
+
+    def test_unregistered_dependencies_are_ignored(self):
+        task_scheduler, status = self._run(Child)
+        self.assertTrue(status)
+        self.assertEqual(task_scheduler.done, {Child})
+
+    def test_circular_dependency(self):
+        task_scheduler = scheduler.Scheduler(self._executor,
+                                             tasks=(Cycle, Cycle2))
+        self.assertRaises(ValueError, task_scheduler.run)
+        self.assertEqual(self._executor.started, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
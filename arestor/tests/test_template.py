@@ -0,0 +1,98 @@
+"""Tests for the config templates."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from arestor.worker import cache
+from arestor.worker import template
+
+TEMPLATE = """# A comment = not a slot
+global = ignored
+
+[compute]
+image_ref = default-image
+flavor_ref=m1.small
+
+[network]
+; image_ref = commented
+public_network_id =
+"""
+
+
+class TestParse(unittest.TestCase):
+
+    def test_slots(self):
+        config = template.ConfigTemplate(
+            template.ConfigTemplate.parse(TEMPLATE))
+        self.assertEqual(config.slots, [("compute", "image_ref"),
+                                        ("compute", "flavor_ref"),
+                                        ("network", "public_network_id")])
+
+    def test_render_defaults(self):
+        config = template.ConfigTemplate(
+            template.ConfigTemplate.parse(TEMPLATE))
+        rendered = config.render({})
+        self.assertIn("image_ref = default-image\n", rendered)
+        self.assertIn("flavor_ref = m1.small\n", rendered)
+        self.assertIn("; image_ref = commented\n", rendered)
+        self.assertTrue(rendered.startswith("# A comment = not a slot\n"
+                                            "global = ignored\n"))
+
+    def test_render_values(self):
+        config = template.ConfigTemplate(
+            template.ConfigTemplate.parse(TEMPLATE))
+        rendered = config.render({"image_ref": "image",
+                                  "network.public_network_id": "net",
+                                  "public_network_id": "ignored"})
+        self.assertIn("image_ref = image\n", rendered)
+        self.assertIn("public_network_id = net\n", rendered)
+
+    def test_line_endings(self):
+        tokens = template.ConfigTemplate.parse("[a]\r\nkey = value\r\n")
+        self.assertEqual(template.ConfigTemplate(tokens).render({}),
+                         "[a]\r\nkey = value\r\n")
+
+
+class TestCompile(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._root)
+        self._path = os.path.join(self._root, "tempest.conf")
+        with open(self._path, "w") as template_file:
+            template_file.write(TEMPLATE)
+
+    def test_compiled_once(self):
+        first = template.ConfigTemplate.compile(self._path)
+        self.assertIs(template.ConfigTemplate.compile(self._path), first)
+
+    def test_changed_template(self):
+        first = template.ConfigTemplate.compile(self._path)
+        with open(self._path, "a") as template_file:
+            template_file.write("[extra]\nkey = value\n")
+        second = template.ConfigTemplate.compile(self._path)
+        self.assertIn(("extra", "key"), second.slots)
+        self.assertNotIn(("extra", "key"), first.slots)
+
+    def test_disk_cache(self):
+        disk_cache = cache.DiskCache(os.path.join(self._root, "cache"),
+                                     ttl=300)
+        compiled = template.ConfigTemplate.compile(self._path,
+                                                   cache=disk_cache)
+        stat = os.stat(self._path)
+        key = "%s|%s|%s" % (self._path, stat.st_mtime, stat.st_size)
+        self.assertEqual(disk_cache.get(template.ConfigTemplate.NAMESPACE,
+                                        key), compiled.tokens)
+
+    def test_write_only_changes(self):
+        config = template.ConfigTemplate.compile(self._path)
+        target = os.path.join(self._root, "etc", "tempest.conf")
+        self.assertTrue(config.write(target, {"image_ref": "image"}))
+        self.assertFalse(config.write(target, {"image_ref": "image"}))
+        self.assertTrue(config.write(target, {"image_ref": "other"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
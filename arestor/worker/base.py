@@ -2,16 +2,25 @@
 Worker base-classes:
     (Beginning of) the contract that workers and commands must follow.
 """
-from __future__ import print_function
 
 import abc
+import contextlib
+import functools
+import hashlib
+import json
 import os
 import sys
-import subprocess
-import platform
 import time
 
-import six
+from arestor.worker import engine
+from arestor.worker import environments
+from arestor.worker import facts
+from arestor.worker import history
+from arestor.worker import journal
+from arestor.worker import metrics
+from arestor.worker import retry
+from arestor.worker import trace
+from arestor.worker import util
 
 
 def do_nothing():
@@ -19,8 +28,7 @@ def do_nothing():
     pass
 
 
-@six.add_metaclass(abc.ABCMeta)
-class Worker(object):
+class Worker(object, metaclass=abc.ABCMeta):
 
     """Contract class for all the commands and clients."""
 
@@ -40,18 +48,51 @@ class Worker(object):
     def run(self):
         """Run the command."""
         result = None
-        self._prologue()
-        result = self._work()
-        self._epilogue()
+        tracer = trace.get_tracer()
+        with tracer.span(self.__class__.__name__, "worker"):
+            with tracer.span("prologue", "phase"):
+                self._prologue()
+            with tracer.span("work", "phase"):
+                result = self._work()
+            with tracer.span("epilogue", "phase"):
+                self._epilogue()
         return result
 
 
-@six.add_metaclass(abc.ABCMeta)
 class Command(Worker):
 
-    """Contract class for all the commands."""
+    """Contract class for all the commands.
+
+    :ivar: DEPENDS: The commands that must successfully finish before
+                    the current one can be started by the scheduler.
+    :ivar: RETRY_POLICY: The :class:`retry.RetryPolicy` used for all the
+                         commands executed by the current task. (Default:
+                         retry every failure, using the values received
+                         from the command line)
+    :ivar: JOURNAL_ARGS: The arguments that are part of the fingerprint
+                         of the task. The tasks are recorded in the build
+                         journal and skipped when the build is resumed
+                         with the same fingerprint.
+    :ivar: REQUIRES: The tools (or the full paths of the executables)
+                     required by the task. The task fails early when
+                     one of them is missing from the machine.
+    :ivar: ROUTES: The suffix of the methods used on every platform /
+                   distribution (see :attr:`facts.HostFacts.platform`).
+    :ivar: TIMEOUT: How long a command executed by the task can run,
+                    in seconds, lower than the budget of the RETRY_POLICY
+                    so a timed out attempt can be retried. The `timeout`
+                    argument, when it is set, is used instead (zero
+                    disables the limit).
+    """
+
+    DEPENDS = ()
+    RETRY_POLICY = None
+    JOURNAL_ARGS = ()
+    REQUIRES = ()
+    TIMEOUT = 3600
 
     ROUTES = {
+        "linux": {"default": ""},
         "linux2": {"default": ""},
         "win32": {"default": "_win"},
     }
@@ -59,15 +100,41 @@ class Command(Worker):
     def __init__(self, executor):
         super(Command, self).__init__()
         self._executor = executor
+        self._error = None
         self._attemts = self._executor.args.get('attempts', 1)
         self._retry_interval = self._executor.args.get('retry_interval', 0)
+        self._engine = None
+        self._started = None
+        self._skipped = False
+        self._executions = []
 
         build = self._executor.args.get("build", "")
         self._resources = os.path.join(sys.prefix, "share", "doc", "arestor")
-        self._venv = os.path.join("/tmp/argus-env", build) if build else ""
+        self._venv = os.path.join(environments.ROOT, build) if build else ""
         self._python = os.path.join(self._venv, "bin", "python")
         self._pip = os.path.join(self._venv, "bin", "pip")
 
+        log_dir = self._executor.args.get("log_dir")
+        self._log_file = (os.path.join(log_dir, build, "%s.log" % self.name)
+                          if log_dir else None)
+
+        self._journal = None
+        if self._venv and self._executor.args.get("journal", True):
+            self._journal = journal.Journal(self._venv + ".journal")
+        elif self._venv:
+            self._forget_journal(self._venv + ".journal")
+
+    @staticmethod
+    def _forget_journal(path):
+        """Remove the journal of a build that runs without it: the tasks
+        are not recorded, so the next runs would trust the old entries.
+        """
+        try:
+            os.remove(path)
+        except OSError:
+            # There is no journal
+            pass
+
     @property
     def args(self):
         """Expose the args object."""
@@ -78,11 +145,145 @@ class Command(Worker):
         """Expose the logger object."""
         return self._executor.logger
 
+    @property
+    def environ(self):
+        """The environment variables of the client that started the
+        task (the `OS_*` credentials, for example)."""
+        return getattr(self._executor, "environ", os.environ)
+
     @property
     def name(self):
         """Return the name of the task."""
         return self.__class__.__name__
 
+    @property
+    def facts(self):
+        """Expose the facts about the current machine."""
+        return facts.get_facts(self.args.get("cache_dir"),
+                               refresh=self.args.get("refresh_cache",
+                                                     False))
+
+    @property
+    def engine(self):
+        """Expose the execution engine (started on first use)."""
+        if self._engine is None:
+            self._engine = engine.get_engine(
+                self._executor.args.get('max_processes'))
+        return self._engine
+
+    @property
+    def log_file(self):
+        """The file where the output of the task is streamed."""
+        return self._log_file
+
+    @property
+    def journal(self):
+        """The journal of the current build (None if not available)."""
+        return self._journal
+
+    @property
+    def error(self):
+        """The exception raised during the last run, if any."""
+        return self._error
+
+    @property
+    def python_version(self):
+        """The interpreter of the virtual environment (`python2.7`)."""
+        return os.path.basename(os.path.realpath(self._python))
+
+    def _venv_lock(self):
+        """Serialize the changes made to the virtual environment of the
+        build: pip has no locking, so two installs running at the same
+        time can leave the site-packages half-written."""
+        return util.file_lock(os.path.join(self._venv, ".arestor.lock"))
+
+    def _execute_options(self, command, kwargs):
+        """Validate the options received by the execute helpers."""
+        attempts = kwargs.pop("attempts", None)
+        binary = kwargs.pop('binary', False)
+        check_exit_code = kwargs.pop('check_exit_code', [0])
+        cwd = kwargs.pop('cwd', None)
+        env_variables = kwargs.pop("env_variables", None)
+        retry_interval = kwargs.pop("retry_interval", None)
+        retry_policy = kwargs.pop("retry_policy", None)
+        shell = kwargs.pop("shell", False)
+        stream = kwargs.pop("stream", False)
+        log_file = kwargs.pop("log_file", self.log_file if stream else None)
+        tail = kwargs.pop("tail", engine.DEFAULT_TAIL)
+        timeout = kwargs.pop("timeout", None)
+        command = [str(argument) for argument in command]
+
+        if cwd and not os.path.isdir(cwd):
+            self.logger.warning("Invalid value for cwd: %s", cwd)
+            cwd = None
+
+        if isinstance(check_exit_code, bool):
+            check_exit_code = [0] if check_exit_code else None
+        elif isinstance(check_exit_code, int):
+            check_exit_code = [check_exit_code]
+
+        if retry_policy is None:
+            if (attempts, retry_interval) != (None, None):
+                # Legacy options: fixed interval, retry every failure
+                retry_policy = retry.RetryPolicy(attempts=attempts,
+                                                 interval=retry_interval)
+            else:
+                retry_policy = self.RETRY_POLICY or retry.RetryPolicy()
+        retry_policy = retry_policy.bind(self._attemts, self._retry_interval)
+
+        if timeout is None:
+            timeout = self._executor.args.get("timeout")
+        if timeout is None:
+            timeout = self.TIMEOUT
+
+        return command, {
+            "retry_policy": retry_policy, "binary": binary,
+            "check_exit_code": check_exit_code, "cwd": cwd,
+            "env_variables": env_variables, "logger": self.logger,
+            "shell": shell,
+            "stream": self._log_line if stream else None,
+            "log_file": log_file, "tail": tail, "timeout": timeout or None,
+            "observer": functools.partial(self._record_execution,
+                                          engine.describe(command)),
+        }
+
+    def _record_execution(self, name, attempts, exit_code, duration,
+                          status):
+        """Keep the timing of an executed command until the task ends.
+
+        This is called from the thread of the engine, so the commands
+        are written to the timing history later, by
+        :meth:`_flush_executions`.
+        """
+        self._executions.append({
+            "started": time.time() - duration, "duration": duration,
+            "command": name, "attempts": attempts, "status": status,
+            "exit_code": exit_code})
+
+    def _flush_executions(self):
+        """Add the commands executed by the task to the timing history."""
+        executions, self._executions = self._executions, []
+        timings = history.get_history()
+        for execution in executions:
+            timings.record(self.name, "execute",
+                           build=self.args.get("build"), **execution)
+
+    def _log_line(self, channel, line):
+        """Report a line received from the output of a child process."""
+        self.logger.info("%s [%s] %s", self.name, channel,
+                         os.fsdecode(line).rstrip())
+
+    def _execute_async(self, command, **kwargs):
+        """Return a coroutine that shells out and executes a command
+        on the execution engine.
+
+        The coroutine can be awaited together with other ones in order
+        to run multiple commands at the same time. The arguments are the
+        same as for :meth:`_execute`.
+        """
+        command, options = self._execute_options(command, kwargs)
+        return self.engine.execute(command, **options)
+
     def _execute(self, command, **kwargs):
         """Helper method to shell out and execute a command through subprocess.
 
@@ -101,69 +302,76 @@ class Command(Worker):
         :param shell:           whether or not there should be a shell used to
                                 execute this command.
 
+        :param stream:          Report the output line by line, as soon as
+                                it is available, instead of collecting it.
+        :param log_file:        Append the output to the received file as
+                                soon as it is available. (Default: the log
+                                file of the task, when stream is used)
+        :param tail:            How many lines of output to keep in memory
+                                when the output is streamed.
+        :param timeout:         How long an attempt can run, in seconds,
+                                before the process group of the command
+                                is stopped and the attempt fails (zero
+                                disables it). (Default: the `timeout`
+                                argument or :attr:`TIMEOUT`)
+
         :param admin:           run command as superuser
 
         :raises:                :class:`subprocess.CalledProcessError`
+                                (:class:`engine.CommandTimeout` when the
+                                last attempt timed out)
         """
-        # pylint: disable=too-many-locals
+        return self.engine.run(self._execute_async(command, **kwargs))
 
-        attempts = kwargs.pop("attempts", self._attemts)
-        binary = kwargs.pop('binary', False)
-        check_exit_code = kwargs.pop('check_exit_code', [0])
-        cwd = kwargs.pop('cwd', None)
-        env_variables = kwargs.pop("env_variables", None)
-        retry_interval = kwargs.pop("retry_interval", self._retry_interval)
-        shell = kwargs.pop("shell", False)
-        command = [str(argument) for argument in command]
+    def _execute_many(self, *commands, **kwargs):
+        """Execute all the received commands at the same time.
 
-        if cwd and not os.path.isdir(cwd):
-            self.logger.warning("Invalid value for cwd: %s", cwd)
-            cwd = None
+        The keyword arguments are the same as for :meth:`_execute` and
+        they are used for all the commands.
 
-        ignore_exit_code = False
-        if isinstance(check_exit_code, bool):
-            ignore_exit_code = not check_exit_code
-            check_exit_code = [0]
-        elif isinstance(check_exit_code, int):
-            check_exit_code = [check_exit_code]
-
-        for attempt in range(attempts):
-            self.logger.debug("Execute command: %r (attempt %d)",
-                              command, attempt + 1)
-            try:
-                process = subprocess.Popen(command,
-                                           stdin=subprocess.PIPE,
-                                           stdout=subprocess.PIPE,
-                                           stderr=subprocess.PIPE, shell=shell,
-                                           cwd=cwd, env=env_variables)
-                result = process.communicate()
-                return_code = process.returncode
-                self.logger.debug("%r (return code %s)", command, return_code)
-
-                if six.PY3 and not binary and result is not None:
-                    # pylint: disable=no-member
-
-                    # Decode from the locale using using the surrogate escape
-                    # error handler (decoding cannot fail)
-                    (stdout, stderr) = result
-                    stdout = os.fsdecode(stdout)
-                    stderr = os.fsdecode(stderr)
-                else:
-                    stdout, stderr = result
-
-                if not ignore_exit_code and return_code not in check_exit_code:
-                    raise subprocess.CalledProcessError(
-                        returncode=return_code, cmd=command,
-                        output=(stdout, stderr))
-                else:
-                    return (stdout, stderr)
-            except subprocess.CalledProcessError:
-                if attempt == attempts - 1:
-                    raise
-                time.sleep(retry_interval)
+        :returns: A list with the (stdout, stderr) of every command.
+        :raises:  :class:`subprocess.CalledProcessError`
+        """
+        coroutines = [self._execute_async(command, **dict(kwargs))
+                      for command in commands]
+        return self.engine.run(self.engine.gather(*coroutines))
+
+    def _refs(self):
+        """Return the branches / revisions used by the task, recorded
+        in the timing history."""
+        return {}
+
+    def _observe(self, status):
+        """Record the duration of the last run in the task metrics
+        and in the timing history."""
+        self._flush_executions()
+        if self._started is None:
+            return
+        duration = time.time() - self._started
+        metrics.get_registry().observe(
+            "arestor_task_duration_seconds", duration,
+            task=self.name, status=status)
+        history.get_history().record(
+            self.name, "task", duration, started=self._started,
+            build=self.args.get("build"), status=status, refs=self._refs())
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        """Trace the received phase of the task and record how long
+        it takes in the timing history."""
+        started, status = time.time(), "failed"
+        try:
+            with trace.get_tracer().span(name, "phase"):
+                yield
+            status = "done"
+        finally:
+            history.get_history().record(
+                self.name, name, time.time() - started, started=started,
+                build=self.args.get("build"), status=status)
 
     def _done(self, result):
         """What to execute after successfully finished processing a task."""
+        self._observe("skipped" if self._skipped else "done")
         callback = getattr(self._executor, "on_task_done", None)
         if callback:
             callback(self, result)
@@ -173,6 +381,7 @@ class Command(Worker):
 
     def _fail(self, exc):
         """What to do when the program fails processing a task."""
+        self._observe("failed")
         callback = getattr(self._executor, "on_task_fail", None)
         if callback:
             callback(self, exc)
@@ -180,11 +389,46 @@ class Command(Worker):
             self.logger.debug("%r: No callback found for task_fail in %r",
                               self.name, self._executor.name)
 
+    def _fingerprint(self):
+        """Return the inputs of the task that are recorded in the journal.
+
+        Extend this in order to add other inputs (like resolved revisions
+        or the hash of the templates).
+        """
+        return {
+            "task": self.name,
+            "args": dict((name, self.args.get(name))
+                         for name in self.JOURNAL_ARGS),
+            "depends": dict((task.__name__,
+                             self._journal.stamp(task.__name__))
+                            for task in self.DEPENDS),
+        }
+
+    def fingerprint(self):
+        """Return the digest of the task inputs."""
+        inputs = json.dumps(self._fingerprint(), sort_keys=True)
+        return hashlib.sha1(inputs.encode("utf-8")).hexdigest()
+
+    def _is_complete(self):
+        """Check if the results of the last run are still available.
+
+        Override this in order to validate the journal entry against
+        the current state of the machine.
+        """
+        return True
+
+    def _is_up_to_date(self, fingerprint):
+        """Check if the task can be skipped."""
+        return (self._journal.is_valid(self.name, fingerprint) and
+                self._is_complete())
+
     def run(self):
         """Run the command."""
         result = None
-        distributions = self.ROUTES.get(sys.platform, {})
-        prefix = distributions.get(platform.dist(), "")
+        host = self.facts
+        distributions = self.ROUTES.get(host.platform, {})
+        prefix = distributions.get(host.distribution,
+                                   distributions.get("default", ""))
 
         prologue = getattr(self, "_prologue%s" % prefix, do_nothing)
         work = getattr(self, "_work%s" % prefix, do_nothing)
@@ -192,14 +436,50 @@ class Command(Worker):
 
         if work is do_nothing:
             self.logger.warning("%s not available on %r - %r", self.name,
-                                sys.platform, platform.dist())
+                                host.platform, host.distribution)
             return
 
+        self._error = None
+        self._started = time.time()
+        self._skipped = False
+        fingerprint = None
+        tracer = trace.get_tracer()
+        if self._venv:
+            # Keep the environments of the running builds out of the
+            # least recently used ones
+            environments.EnvironmentManager.touch(self._venv)
         try:
-            prologue()
-            result = work()
-            epilogue()
+            with tracer.span(self.name, "task") as details:
+                if self._journal:
+                    with tracer.span("journal", "phase"):
+                        fingerprint = self.fingerprint()
+                        up_to_date = self._is_up_to_date(fingerprint)
+                    if up_to_date:
+                        self.logger.info("%s is up to date, skipping it.",
+                                         self.name)
+                        details["skipped"] = self._skipped = True
+                        self._done(result)
+                        return result
+                    self._journal.remove(self.name)
+
+                missing = host.missing(self.REQUIRES)
+                if missing:
+                    raise ValueError(
+                        "%(task)s requires %(tools)s, which is not "
+                        "available on this machine." %
+                        {"task": self.name, "tools": ", ".join(missing)})
+
+                with self._phase("prologue"):
+                    prologue()
+                with self._phase("work"):
+                    result = work()
+                with self._phase("epilogue"):
+                    epilogue()
+
+                if self._journal:
+                    self._journal.record(self.name, fingerprint)
         except Exception as exc:
+            self._error = exc
             self._fail(exc)
         else:
             self._done(result)
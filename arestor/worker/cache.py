@@ -0,0 +1,80 @@
+"""
+Disk cache:
+    JSON documents shared by the builds from the current machine,
+    valid for a limited amount of time.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from arestor.worker import metrics
+from arestor.worker import util
+
+
+class DiskCache(object):
+
+    """Store JSON serializable values on disk.
+
+    :param root:    The directory that contains the cached values.
+    :param ttl:     How long a value is valid, in seconds.
+    :param refresh: Ignore the values that are already cached.
+    """
+
+    def __init__(self, root, ttl, refresh=False):
+        self._root = root
+        self._ttl = ttl
+        self._refresh = refresh
+
+    @property
+    def root(self):
+        """The directory that contains the cached values."""
+        return self._root
+
+    def _path(self, namespace, key):
+        """Return the location of the received key."""
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self._root, namespace, "%s.json" % digest)
+
+    def get(self, namespace, key, ttl=None):
+        """Return the cached value for the received key or None if the
+        value is missing or expired.
+        """
+        value = self._get(namespace, key, ttl)
+        metrics.get_registry().increment(
+            "arestor_cache_requests_total", cache=namespace,
+            result="miss" if value is None else "hit")
+        return value
+
+    def _get(self, namespace, key, ttl):
+        """Read the received key from the disk."""
+        if self._refresh:
+            return None
+
+        ttl = self._ttl if ttl is None else ttl
+        path = self._path(namespace, key)
+        try:
+            with open(path, "r") as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if entry.get("key") != key:
+            return None
+        if time.time() - entry.get("created", 0) > ttl:
+            return None
+        return entry.get("value")
+
+    def set(self, namespace, key, value):
+        """Store the received value."""
+        entry = {"key": key, "created": time.time(), "value": value}
+        util.atomic_write(self._path(namespace, key), json.dumps(entry),
+                          mode=0o600)
+
+    def invalidate(self, namespace, key):
+        """Remove the cached value for the received key."""
+        try:
+            os.remove(self._path(namespace, key))
+        except OSError:
+            pass
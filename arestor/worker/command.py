@@ -1,29 +1,186 @@
 """The commands used by the client actions."""
 
+import hashlib
+import inspect
+import json
 import os
 import re
 import shutil
-
-from neutronclient.v2_0 import client as neutron_client
+import subprocess
+import sys
 
 from arestor.worker import base as worker_base
+from arestor.worker import cache
+from arestor.worker import environments
+from arestor.worker import metrics
+from arestor.worker import mirror
+from arestor.worker import openstack
+from arestor.worker import pool
+from arestor.worker import probe
+from arestor.worker import retry
+from arestor.worker import template
+from arestor.worker import util
 
 
 class SetupEnvironment(worker_base.Command):
 
-    """Command used for installing the global requirements."""
+    """Command used for installing the global requirements.
+
+    Only the packages which are missing are installed, so running the
+    command on a machine which is already prepared is a no-op.
+
+    :ivar: PACKAGES:        The system packages required by Argus-CI.
+    :ivar: PIP_PACKAGES:    The Python packages installed globally.
+    """
+
+    RETRY_POLICY = retry.APT_POLICY
+    REQUIRES = ("sudo", "apt-get", "dpkg-query")
+    TIMEOUT = 600
+    PACKAGES = ("build-essential", "git", "python-dev", "libffi-dev",
+                "libssl-dev", "python-pip")
+    PIP_PACKAGES = ("virtualenv", )
+
+    def _installed_packages(self):
+        """Return the system packages which are already installed."""
+        # dpkg-query fails when some of the packages are unknown
+        stdout, _ = self._execute(
+            ["dpkg-query", "--show", "--showformat",
+             "${Package} ${Status}\\n"] + list(self.PACKAGES),
+            check_exit_code=False, attempts=1)
+
+        installed = set()
+        for line in stdout.splitlines():
+            package, _, status = line.strip().partition(" ")
+            if status.split()[-1:] == ["installed"]:
+                installed.add(package.split(":")[0])
+        return installed
+
+    def _installed_pip_packages(self):
+        """Return the Python packages which are already installed."""
+        if not self.facts.which("pip"):
+            return set()
+
+        stdout, _ = self._execute(["pip", "show"] + list(self.PIP_PACKAGES),
+                                  check_exit_code=False, attempts=1)
+        installed = set()
+        for line in stdout.splitlines():
+            key, _, value = line.partition(":")
+            if key.strip() == "Name":
+                installed.add(value.strip().lower())
+        return installed
 
     def _work(self):
         """Install dependences for Argus-Ci."""
-        self._execute(["sudo", "apt-get", "install", "-y", "build-essential",
-                       "git", "python-dev", "libffi-dev", "libssl-dev"])
-        self._execute(["sudo", "apt-get", "install", "-y", "python-pip"])
-        self._execute(["sudo", "pip", "install", "virtualenv"])
+        installed = self._installed_packages()
+        packages = [package for package in self.PACKAGES
+                    if package not in installed]
+        if packages:
+            self.logger.info("Installing the missing packages: %s",
+                             ", ".join(packages))
+            self._execute(["sudo", "apt-get", "install", "-y"] + packages)
+
+        installed = self._installed_pip_packages()
+        pip_packages = [package for package in self.PIP_PACKAGES
+                        if package.lower() not in installed]
+        if pip_packages:
+            self.logger.info("Installing the missing Python packages: %s",
+                             ", ".join(pip_packages))
+            self._execute(["sudo", "pip", "install"] + pip_packages)
+
+        if not packages and not pip_packages:
+            self.logger.info("All the dependences are already installed.")
+        else:
+            # The tools and their versions changed
+            self.facts.invalidate()
+        return packages + pip_packages
 
 
 class CreateEnvironment(worker_base.Command):
 
-    """Command used for creating virtual environment for Argus-CI."""
+    """Command used for creating virtual environment for Argus-CI.
+
+    :ivar: PYTHON:  The interpreter used by the virtual environment.
+    """
+
+    JOURNAL_ARGS = ("user", )
+    PYTHON = "/usr/bin/python2.7"
+    REQUIRES = ("sudo", "virtualenv", PYTHON)
+
+    def __init__(self, executor):
+        super(CreateEnvironment, self).__init__(executor=executor)
+        self._claimed = False
+        self._pool = None
+        self._environments = environments.EnvironmentManager(
+            max_count=self.args.get("env_max_count"),
+            max_size=self.args.get("env_max_size", 0) * 1024 * 1024)
+
+        if self.args.get("pool_size"):
+            self._pool = pool.EnvironmentPool(
+                self.args["user"], self.PYTHON, self._execute,
+                size=self.args["pool_size"], root=self._environments.root)
+
+    def _is_complete(self):
+        """Check if the virtual environment is still available."""
+        return os.path.isfile(self._python) and os.path.isfile(self._pip)
+
+    def _claim(self):
+        """Try to use one of the virtual environments from the pool."""
+        try:
+            self._claimed = self._pool.claim(self._venv)
+        except Exception as exc:
+            self.logger.warning("Failed to claim a virtual environment "
+                                "from the pool: %s", exc)
+            self._claimed = False
+        finally:
+            self._refill_pool()
+
+        metrics.get_registry().increment(
+            "arestor_cache_requests_total", cache="venv-pool",
+            result="hit" if self._claimed else "miss")
+        if self._claimed:
+            self.logger.info("Using a virtual environment from the pool "
+                             "for %s", self._venv)
+        else:
+            self.logger.info("The pool of virtual environments is empty.")
+        return self._claimed
+
+    @staticmethod
+    def _detach(command, log_file):
+        """Run the received command in a detached process, so the
+        current build doesn't wait for it.
+        """
+        util.ensure_dir(os.path.dirname(log_file))
+        with open(os.devnull, "rb") as stdin, \
+                open(log_file, "ab") as output:
+            subprocess.Popen(command, stdin=stdin, stdout=output,
+                             stderr=subprocess.STDOUT, close_fds=True,
+                             start_new_session=True)
+
+    def _refill_pool(self):
+        """Fill the pool of virtual environments in a detached process."""
+        log_file = os.path.join(os.path.dirname(self._pool.path), "fill.log")
+        command = [sys.executable, "-m", "arestor.client.shell",
+                   "--pool-size", str(self._pool.size),
+                   "pool", "fill", "--user", self.args["user"]]
+        try:
+            self._detach(command, log_file)
+        except (IOError, OSError) as exc:
+            self.logger.warning("Failed to refill the pool of virtual "
+                                "environments: %s", exc)
+
+    def _reap_environments(self):
+        """Delete the discarded environments and enforce the quota in
+        a detached process."""
+        log_file = os.path.join(self._environments.root, ".reap.log")
+        command = [sys.executable, "-m", "arestor.client.shell",
+                   "--env-max-count", str(self.args.get("env_max_count", 0)),
+                   "--env-max-size", str(self.args.get("env_max_size", 0)),
+                   "env", "reap"]
+        try:
+            self._detach(command, log_file)
+        except (IOError, OSError) as exc:
+            self.logger.warning("Failed to reap the old virtual "
+                                "environments: %s", exc)
 
     def _work(self):
         """Create the virtual environment for Argus-Ci and Tempest."""
@@ -32,51 +189,454 @@ class CreateEnvironment(worker_base.Command):
                                 "the virtual environment")
             return
 
+        if self._journal:
+            # The tasks run for the old environment have to run again
+            self._journal.clear()
+        # Reap only when there is something to delete or a quota
+        reap = bool(self.args.get("env_max_count") or
+                    self.args.get("env_max_size"))
         if os.path.isdir(self._venv):
             self.logger.warning("The virtual environment already exists. %s",
                                 self._venv)
             try:
-                shutil.rmtree(self._venv)
+                # The old environment is deleted in the background
+                if self._environments.discard(self._venv):
+                    reap = True
+                    metrics.get_registry().increment(
+                        "arestor_environments_discarded_total",
+                        reason="stale")
             except OSError as exc:
                 self.logger.warning("Failed to remove the old "
                                     "environment: %s", exc)
+        if reap:
+            self._reap_environments()
+
+        if self._pool and self._claim():
+            return
 
         self._execute(["sudo", "-u", self.args["user"], "virtualenv",
-                       self._venv, "--python", "/usr/bin/python2.7"])
+                       self._venv, "--python", self.PYTHON])
 
     def _epilogue(self):
         """Executed once after the command running."""
+        if self._claimed:
+            # The environments from the pool already have the latest pip
+            return
         self._execute(["sudo", "-u", self.args["user"],
                        self._pip, "install", "pip", "--upgrade"])
 
 
-class InstallTempest(worker_base.Command):
+class FillEnvironmentPool(worker_base.Command):
+
+    """Command used for creating the virtual environments from the pool."""
+
+    RETRY_POLICY = retry.NETWORK_POLICY
+    REQUIRES = CreateEnvironment.REQUIRES
+    TIMEOUT = 1200
+
+    def _work(self):
+        """Create virtual environments until the pool is full."""
+        if not self.args.get("pool_size"):
+            self.logger.warning("The pool of virtual environments is "
+                                "disabled.")
+            return 0
+
+        ready = pool.EnvironmentPool(
+            self.args["user"], CreateEnvironment.PYTHON, self._execute,
+            size=self.args["pool_size"])
+        created = ready.fill()
+        self.logger.info("%d virtual environment(s) created, %d ready.",
+                         created, ready.available())
+        return created
+
+
+class ReapEnvironments(worker_base.Command):
+
+    """Command used for deleting the discarded virtual environments
+    and for enforcing the quota of the build environments."""
+
+    def _work(self):
+        """Evict the least recently used environments and delete the
+        discarded ones."""
+        manager = environments.EnvironmentManager(
+            max_count=self.args.get("env_max_count"),
+            max_size=self.args.get("env_max_size", 0) * 1024 * 1024)
+        for environment in manager.evict():
+            self.logger.info("Evicted the virtual environment %s",
+                             environment)
+            metrics.get_registry().increment(
+                "arestor_environments_discarded_total", reason="quota")
+        deleted = manager.reap()
+        self.logger.info("%d virtual environment(s) deleted.", deleted)
+        return deleted
+
+
+class InstallRepository(worker_base.Command):
+
+    """Base class for the commands that fetch a git repository and
+    build its wheel. The repositories are installed by
+    :class:`InstallRequirements`, which resolves their requirements
+    together.
+
+    :ivar: URL:     The URL of the git repository.
+    :ivar: REPO:    The pip requirement for a revision of the repository.
+    :ivar: BRANCH:  The name of the argument that contains the required
+                    branch / revision of the repository.
+    :ivar: MODULE:  The module that should be importable after the
+                    repository was installed.
+
+    The wheel of every revision is cached for the interpreter of the
+    virtual environment:
+    ::
+        <cache-dir>/wheelhouse/<project>/<revision>-<python>/
+    """
+
+    DEPENDS = (CreateEnvironment, )
+    RETRY_POLICY = retry.NETWORK_POLICY
+    JOURNAL_ARGS = ("user", )
+    REQUIRES = ("sudo", "git")
+    TIMEOUT = 1800
+    SHA_REGEXP = re.compile(r"^[0-9a-f]{40}$")
+    URL = None
+    REPO = None
+    BRANCH = None
+    MODULE = None
+
+    def __init__(self, executor):
+        super(InstallRepository, self).__init__(executor=executor)
+        self._revision = None
+        self._source = None
+        self._mirror = None
+
+        cache_dir = self.args.get("cache_dir")
+        if cache_dir:
+            self._mirror = mirror.GitMirror(self.URL, cache_dir,
+                                            self._execute)
+
+    @property
+    def branch(self):
+        """The required branch / revision of the repository."""
+        return self.args[self.BRANCH]
+
+    @property
+    def project(self):
+        """The name of the repository."""
+        name = self.URL.rstrip("/").rsplit("/", 1)[-1]
+        return name[:-4] if name.endswith(".git") else name
+
+    @property
+    def revision(self):
+        """The commit SHA the required branch points to."""
+        if self._revision is None:
+            self._revision = self._resolve_revision()
+        return self._revision
+
+    @property
+    def source(self):
+        """What should be passed to pip in order to install the
+        required revision.
+        """
+        if self._source is None:
+            self._source = self._get_source()
+        return self._source
+
+    def _get_source(self):
+        """Prepare the source of the required revision.
+
+        When the git mirror is available, the revision is checked out
+        in the virtual environment, otherwise it is installed straight
+        from the remote repository.
+        """
+        revision = self.revision
+        if self._mirror and revision:
+            target = os.path.join(self._venv, "src", self.project)
+            return self._mirror.checkout(revision, target,
+                                         user=self.args["user"])
+        return self.REPO % (revision or self.branch)
+
+    def _resolve_revision(self):
+        """Resolve the required branch / revision to a commit SHA.
+
+        :returns: The commit SHA or an empty string if the branch can
+                  not be resolved.
+        """
+        if self._mirror:
+            try:
+                return self._resolve_mirror_revision()
+            except Exception as exc:
+                self.logger.warning("The git mirror for %s is not "
+                                    "available: %s", self.project, exc)
+                self._mirror = None
+
+        if self.SHA_REGEXP.match(self.branch):
+            return self.branch
+
+        try:
+            stdout, _ = self._execute(["git", "ls-remote", self.URL,
+                                       self.branch, self.branch + "^{}"])
+        except Exception as exc:
+            self.logger.warning("Failed to resolve %s@%s: %s",
+                                self.project, self.branch, exc)
+            return ""
+
+        references = {}
+        for line in stdout.splitlines():
+            sha, _, reference = line.strip().partition("\t")
+            references[reference] = sha
+
+        candidates = (
+            # The commit pointed by an annotated tag
+            "refs/tags/%s^{}" % self.branch,
+            "refs/%s^{}" % self.branch,
+            "refs/heads/%s" % self.branch,
+            "refs/tags/%s" % self.branch,
+            "refs/%s" % self.branch,
+        )
+        for reference in candidates:
+            if reference in references:
+                return references[reference]
+
+        self.logger.warning("Failed to resolve %s@%s: unknown reference.",
+                            self.project, self.branch)
+        return ""
+
+    def prefetch(self):
+        """Resolve the required revision and update the git mirror."""
+        return self.revision
+
+    def _fingerprint(self):
+        """Return the inputs of the task that are recorded in the journal."""
+        inputs = super(InstallRepository, self)._fingerprint()
+        inputs["branch"] = self.branch
+        inputs["revision"] = self.revision
+        return inputs
+
+    def _refs(self):
+        """Return the branches / revisions used by the task, recorded
+        in the timing history."""
+        return {"branch": self.branch, "revision": self._revision}
+
+    def _is_complete(self):
+        """Branches that can't be resolved are always installed again,
+        like the ones whose manifest is missing."""
+        return bool(self.revision) and os.path.isfile(self.manifest)
+
+    def _resolve_mirror_revision(self):
+        """Resolve the required branch / revision using the git mirror."""
+        if os.path.isdir(self._mirror.path):
+            revision = self._mirror.resolve(self.branch)
+            if revision and revision == self.branch:
+                # The required commit is already in the mirror
+                metrics.get_registry().increment(
+                    "arestor_cache_requests_total", cache="git-mirror",
+                    result="hit")
+                return revision
+
+        metrics.get_registry().increment(
+            "arestor_cache_requests_total", cache="git-mirror",
+            result="miss")
+
+        self._mirror.update()
+        revision = self._mirror.resolve(self.branch)
+        if not revision:
+            self.logger.warning("Failed to resolve %s@%s: unknown "
+                                "reference.", self.project, self.branch)
+        return revision
+
+    def _cache_path(self, name, extension=""):
+        """Return the location of an artifact cached for the required
+        revision and for the interpreter of the virtual environment.
+        """
+        return os.path.join(self.args["cache_dir"], name, self.project,
+                            "%s-%s%s" % (self.revision, self.python_version,
+                                         extension))
+
+    @property
+    def manifest(self):
+        """The file that describes what was prepared for the build
+        (the revision, the source and the wheel of the repository)."""
+        return os.path.join(self._venv, "etc", "arestor",
+                            "%s.json" % self.project)
+
+    def read_manifest(self):
+        """Return the details recorded by the last run of the task."""
+        with open(self.manifest, "r") as manifest:
+            return json.load(manifest)
+
+    def verification_checks(self):
+        """Return the checks run by :class:`VerifyEnvironment` for the
+        current repository (see :mod:`probe`)."""
+        checks = [{"check": "import", "name": self.MODULE}]
+        wheel = (self.read_manifest().get("wheel")
+                 if os.path.isfile(self.manifest) else None)
+        if wheel:
+            # The version of the repository is not in the lockfile
+            name, version = os.path.basename(wheel).split("-")[:2]
+            checks.append({"check": "version", "name": name,
+                           "expected": version})
+        return checks
+
+    def _build_wheel(self, wheelhouse):
+        """Build the wheel of the required revision, without its
+        dependencies (they are resolved by :class:`InstallRequirements`,
+        together with the ones of the other repositories)."""
+        self._execute(["sudo", "-u", self.args["user"], self._pip, "wheel",
+                       "--no-deps", "--wheel-dir", wheelhouse, self.source],
+                      stream=True)
+
+    def _get_wheel(self):
+        """Return the wheel built for the required revision, building
+        it if it is missing.
+
+        :returns: The path of the wheel or None if the cache can't be
+                  used.
+        """
+        if not self.args.get("cache_dir") or not self.revision:
+            return None
+
+        wheelhouse = self._cache_path("wheelhouse")
+        cached = util.publish_dir(wheelhouse, self._build_wheel,
+                                  user=self.args["user"])
+        metrics.get_registry().increment(
+            "arestor_cache_requests_total", cache="wheelhouse",
+            result="hit" if cached else "miss")
+        if cached:
+            self.logger.info("Using the cached wheel for %s@%s",
+                             self.project, self.revision)
+        wheels = sorted(name for name in os.listdir(wheelhouse)
+                        if name.endswith(".whl"))
+        if not wheels:
+            raise ValueError("No wheel was built for %s@%s." %
+                             (self.project, self.revision))
+        return os.path.join(wheelhouse, wheels[0])
+
+    def _work(self):
+        """Prepare the source and the wheel of the repository, they are
+        installed by :class:`InstallRequirements`."""
+        util.atomic_write(self.manifest, json.dumps({
+            "project": self.project,
+            "revision": self.revision,
+            "source": self.source,
+            "wheel": self._get_wheel(),
+        }, sort_keys=True))
+
+
+class InstallTempest(InstallRepository):
 
     """Command used for installing tempest and its requirements."""
 
-    REPO = 'git+https://github.com/openstack/tempest.git@%s'
+    URL = 'https://github.com/openstack/tempest.git'
+    REPO = 'git+' + URL + '@%s'
+    BRANCH = "tempest_branch"
+    MODULE = "tempest"
+    # The OpenStack clients used for writing the config file
+    MODULES = ("glanceclient", "keystoneclient", "neutronclient")
 
     def __init__(self, executor):
         super(InstallTempest, self).__init__(executor=executor)
 
         self._template = os.path.join(self._resources, "tempest.conf")
-        self._config = os.path.join(self._venv, "etc", "tempest.conf")
+        self._config_file = os.path.join(self._venv, "etc", "tempest.conf")
+        self._config = None
         self._replace = {}
         self._neutron = None
         self._glance = None
+        self._topology = None
+        self._images = None
+        self._session = None
+        self._cache = None
+
+        cache_dir = self.args.get("cache_dir")
+        if cache_dir:
+            self._cache = cache.DiskCache(
+                os.path.join(cache_dir, "api"),
+                ttl=self.args.get("cache_ttl", 300),
+                refresh=self.args.get("refresh_cache", False))
+
+    @property
+    def session(self):
+        """Expose the OpenStack session shared by the builds."""
+        if not self._session:
+            self._session = openstack.get_session({
+                "username": self.environ.get("OS_USERNAME"),
+                "password": self.environ.get("OS_PASSWORD"),
+                "tenant_name": self.environ.get("OS_TENANT_NAME"),
+                "auth_url": self.environ.get("OS_AUTH_URL"),
+            }, cache=self._cache)
+        return self._session
 
     @property
     def neutron(self):
         """Expose the neutron client."""
         if not self._neutron:
-            self._neutron = neutron_client.Client(
-                username=os.environ.get("OS_USERNAME"),
-                password=os.environ.get("OS_PASSWORD"),
-                tenant_name=os.environ.get("OS_TENANT_NAME"),
-                auth_url=os.environ.get("OS_AUTH_URL")
-            )
+            self._neutron = self.session.neutron
         return self._neutron
 
+    def _renew_token(self):
+        """Authenticate again after the token was rejected (it was
+        probably revoked before its expiration)."""
+        self.logger.warning("The OpenStack token was rejected, "
+                            "authenticating again.")
+        self.session.invalidate()
+        self._neutron = self._glance = None
+
+    def _prologue(self):
+        """Check that the OpenStack clients are available before
+        installing tempest."""
+        missing = [module for module in self.MODULES
+                   if not self.facts.has_module(module)]
+        if missing:
+            raise ValueError("%(task)s requires the %(modules)s Python "
+                             "packages, which are not installed." %
+                             {"task": self.name,
+                              "modules": ", ".join(missing)})
+
+    def prefetch_resources(self):
+        """Fetch the OpenStack resources required by the config file."""
+        _ = self.topology.snapshot
+        return self._get_image_id()
+
+    def _fingerprint(self):
+        """Return the inputs of the task that are recorded in the journal."""
+        inputs = super(InstallTempest, self)._fingerprint()
+        with open(self._template, "rb") as template_file:
+            inputs["template"] = hashlib.sha1(
+                template_file.read()).hexdigest()
+        return inputs
+
+    @property
+    def glance(self):
+        """Expose the glance client."""
+        if not self._glance:
+            self._glance = self.session.glance
+        return self._glance
+
+    @property
+    def cache_key(self):
+        """The key that identifies the OpenStack endpoint and the
+        credentials in the disk cache."""
+        return self.session.key
+
+    @property
+    def images(self):
+        """Expose the index of the Glance images."""
+        if not self._images:
+            # The client is created only if the image is not cached
+            self._images = openstack.ImageIndex(
+                lambda: self.glance, cache=self._cache, key=self.cache_key,
+                renew=self._renew_token)
+        return self._images
+
+    @property
+    def topology(self):
+        """Expose the snapshot of the Neutron resources."""
+        if not self._topology:
+            self._topology = openstack.Topology(
+                lambda: self.neutron, networks=("public", ),
+                routers=("router1", ), cache=self._cache,
+                key=self.cache_key, renew=self._renew_token)
+        return self._topology
+
     @property
     def config(self):
         """Expose the tempest config."""
@@ -88,102 +648,327 @@ class InstallTempest(worker_base.Command):
                 "flavor_ref": "m1.large",
                 "image_ref": argus_image,
                 "admin_tenant_id": self._get_tenant_id(),
-                "admin_tenant_name": os.environ.get("OS_TENANT_NAME"),
-                "admin_password": os.environ.get("OS_PASSWORD"),
-                "admin_username": os.environ.get("OS_USERNAME"),
+                "admin_tenant_name": self.environ.get("OS_TENANT_NAME"),
+                "admin_password": self.environ.get("OS_PASSWORD"),
+                "admin_username": self.environ.get("OS_USERNAME"),
                 "default_network": self._get_default_network(),
                 "public_router_id": self._get_router_id(),
                 "public_network_id": self._get_network_id(),
             }
         return self._config
 
-    def _get_default_network(self):
+    def _get_default_network(self, name="public"):
         """Return the CIDR of the public network."""
-        public_id = self._get_network_id(name="public")
-        network = self.neutron.show_network(public_id).get("network")
-        for subnet_id in network.get("subnets"):
-            subnet = self.neutron.show_subnet(subnet_id).get("subnet")
-            if "cidr" in subnet:
-                return subnet["cidr"]
+        return self.topology.cidr(name)
 
     def _get_image_id(self, pattern="argus.*"):
         """Return the image identifier for the first image that
         matches the received pattern."""
-        regexp = re.compile(pattern)
-        raw_data, _ = self._execute(["glance", "image-list"])
-        for line in raw_data.splitlines():
-            try:
-                image_id, image_name = line.strip(" -+|").split('|')
-            except ValueError:
-                pass
-
-            if regexp.match(image_name):
-                return image_id.strip()
+        return self.images.find(pattern)
 
     def _get_tenant_id(self):
         """Return the tenant id for the current user."""
-        auth_info = self.neutron.get_auth_info()
-        return auth_info.get("auth_tenant_id")
+        # The clients created from a token don't know the tenant id
+        return self.topology.tenant_id or self.session.tenant_id
 
     def _get_network_id(self, name="public"):
         """Get the identifier for the received network name."""
-        networks = self.neutron.list_networks()
-        for network in networks.get("networks", []):
-            if network["name"] == name:
-                return network["id"]
+        network = self.topology.network(name)
+        return network["id"] if network else None
 
     def _get_router_id(self, name="router1"):
         """Get the identifier for the received router name."""
-        routers = self.neutron.list_routers()
-        for router in routers.get("routers", []):
-            if router["name"] == name:
-                return router["id"]
+        router = self.topology.router(name)
+        return router["id"] if router else None
 
     def _write_config(self):
         """Create the Tempest config file."""
-        config = []
-        with open(self._template, "r") as template:
-            for line in template.readlines():
-                key, sep, value = line.partition("=")
-                if sep == "=":
-                    value = self.config.get(key, value)
-                    config.append("%s = %s" % (key, value))
-                else:
-                    config.append(line)
-
-        with open(self._config, "w") as config_file:
-            config_file.write("\n".join(config))
-
-    def _work(self):
-        """Install the tempest package and its requirements."""
-        self._execute(["sudo", "-u", self.args["user"], self._pip,
-                       "install", self.REPO % self.args["tempest_branch"]])
+        config = template.ConfigTemplate.compile(self._template,
+                                                 cache=self._cache)
+        if not config.write(self._config_file, self.config):
+            self.logger.debug("The Tempest config file is up to date: %s",
+                              self._config_file)
+
+    def verification_checks(self):
+        """Return the checks run by :class:`VerifyEnvironment` for the
+        current repository (see :mod:`probe`)."""
+        checks = super(InstallTempest, self).verification_checks()
+        checks.append({"check": "file", "name": self._config_file})
+        return checks
 
     def _epilogue(self):
         """Executed once after the command running."""
-        self._execute(["sudo", "-u", self.args["user"], self._python,
-                       "-c", "import tempest"])
         self._write_config()
         super(InstallTempest, self)._epilogue()
 
 
-class InstallArgusCi(worker_base.Command):
+class InstallArgusCi(InstallRepository):
 
     """Command used for installing argus-ci and its requirements."""
 
-    REPO = 'git+https://github.com/cloudbase/cloudbase-init-ci@%s'
+    URL = 'https://github.com/cloudbase/cloudbase-init-ci'
+    REPO = 'git+' + URL + '@%s'
+    BRANCH = "argus_branch"
+    MODULE = "argus"
 
     def __init__(self, executor):
         super(InstallArgusCi, self).__init__(executor=executor)
 
-    def _work(self):
-        """Install the argus-ci framework and its requirements."""
-        self._execute(["sudo", "-u", self.args["user"], self._pip,
-                       "install", self.REPO % self.args["argus_branch"]])
-
     def _epilogue(self):
         """Executed once after the command running."""
-        self._execute(["sudo", "-u", self.args["user"], self._python,
-                       "-c", "import argus"])
         # TODO(alexandrucoman): Create the config file
         super(InstallArgusCi, self)._epilogue()
+
+
+class InstallRequirements(worker_base.Command):
+
+    """Command used for installing the repositories and their
+    requirements, resolved together so all the repositories share a
+    single set of versions.
+
+    :ivar: REPOSITORIES: The commands whose repositories are installed.
+    :ivar: LOCK_JOBS:    How many processes build the wheels pinned by
+                         a lockfile.
+
+    The lockfile (the pinned requirements) of every combination of
+    revisions and the wheels it pins are cached for the interpreter of
+    the virtual environment:
+    ::
+        <cache-dir>/wheelhouse/requirements/<key>-<python>/
+        <cache-dir>/lockfiles/requirements/<key>-<python>.txt
+    """
+
+    DEPENDS = (InstallTempest, InstallArgusCi)
+    REPOSITORIES = DEPENDS
+    RETRY_POLICY = retry.NETWORK_POLICY
+    JOURNAL_ARGS = ("user", )
+    REQUIRES = ("sudo", )
+    TIMEOUT = 1800
+    LOCK_JOBS = 4
+
+    def __init__(self, executor):
+        super(InstallRequirements, self).__init__(executor=executor)
+        self._manifests = None
+
+    @property
+    def manifests(self):
+        """The details of the repositories, prepared by their tasks."""
+        if self._manifests is None:
+            self._manifests = [task(self._executor).read_manifest()
+                               for task in self.REPOSITORIES]
+        return self._manifests
+
+    @property
+    def key(self):
+        """The key of the revisions in the cache (None when one of the
+        repositories has no wheel)."""
+        if not all(manifest["wheel"] for manifest in self.manifests):
+            return None
+        revisions = sorted("%s@%s" % (manifest["project"],
+                                      manifest["revision"])
+                           for manifest in self.manifests)
+        return hashlib.sha1(",".join(revisions).encode("utf-8")).hexdigest()
+
+    def _cache_path(self, name, extension=""):
+        """Return the location of an artifact cached for the required
+        revisions and for the interpreter of the virtual environment.
+        """
+        return os.path.join(self.args["cache_dir"], name, "requirements",
+                            "%s-%s%s" % (self.key, self.python_version,
+                                         extension))
+
+    @property
+    def lockfile(self):
+        """The location of the lockfile of the build."""
+        return os.path.join(self._venv, "etc", "lockfiles",
+                            "requirements.txt")
+
+    def _is_complete(self):
+        """Check that the lockfile of the build is still available
+        (it is kept only when the wheels were installed from the
+        cache)."""
+        try:
+            cached = bool(self.args.get("cache_dir") and self.key)
+        except (IOError, OSError, ValueError):
+            # The manifests of the repositories are missing or invalid
+            return False
+        return not cached or os.path.isfile(self.lockfile)
+
+    @staticmethod
+    def _read_lockfile(path):
+        """Return the pinned requirements from the received lockfile."""
+        with open(path, "r") as lockfile:
+            return [line.strip() for line in lockfile
+                    if line.strip() and not line.startswith("#")]
+
+    def _write_lockfile(self, path, wheels):
+        """Pin the received wheels (the requirements of the
+        repositories) in a new lockfile."""
+        pins = set()
+        for wheel in wheels:
+            # <name>-<version>[-<build>]-<python>-<abi>-<platform>.whl
+            name, version = wheel.split("-")[:2]
+            pins.add("%s==%s" % (name, version))
+        header = "# %s (%s), generated by arestor\n" % (
+            ", ".join("%s@%s" % (manifest["project"], manifest["revision"])
+                      for manifest in self.manifests),
+            self.python_version)
+        util.atomic_write(path, header + "".join(
+            "%s\n" % pin for pin in sorted(pins)))
+
+    def verification_checks(self):
+        """Return the checks run by :class:`VerifyEnvironment` for the
+        requirements: the versions pinned by the lockfile of the build
+        (see :mod:`probe`)."""
+        checks = []
+        if os.path.isfile(self.lockfile):
+            for pin in self._read_lockfile(self.lockfile):
+                name, _, version = pin.partition("==")
+                checks.append({"check": "version", "name": name,
+                               "expected": version})
+        return checks
+
+    def _get_lockfile(self):
+        """Return the cached lockfile of the required revisions or None
+        if it wasn't generated yet."""
+        path = self._cache_path("lockfiles", ".txt")
+        result = "hit" if os.path.isfile(path) else "miss"
+        metrics.get_registry().increment("arestor_cache_requests_total",
+                                         cache="lockfile", result=result)
+        return path if result == "hit" else None
+
+    def _build_wheels(self, wheelhouse, wheels):
+        """Resolve the requirements of all the repositories at once,
+        build their wheels and generate the lockfile for them."""
+        command = ["sudo", "-u", self.args["user"], self._pip, "wheel",
+                   "--wheel-dir", wheelhouse]
+        for wheel in wheels:
+            command.extend(["--find-links", os.path.dirname(wheel)])
+        # The requirements are resolved using the metadata of the
+        # wheels, without building the repositories again.
+        self._execute(command + wheels, stream=True)
+        own = [os.path.basename(wheel) for wheel in wheels]
+        self._write_lockfile(self._cache_path("lockfiles", ".txt"),
+                             [name for name in os.listdir(wheelhouse)
+                              if name.endswith(".whl") and name not in own])
+
+    def _build_locked_wheels(self, wheelhouse, lockfile):
+        """Build the wheels pinned by the lockfile, without resolving
+        the requirements and in parallel."""
+        pip = ["sudo", "-u", self.args["user"], self._pip, "wheel",
+               "--no-deps", "--wheel-dir", wheelhouse]
+        pins = self._read_lockfile(lockfile)
+        if not pins:
+            util.ensure_dir(wheelhouse)
+            return
+        chunk = max(1, (len(pins) + self.LOCK_JOBS - 1) // self.LOCK_JOBS)
+        self._execute_many(*[pip + pins[index:index + chunk]
+                             for index in range(0, len(pins), chunk)])
+
+    def _get_wheelhouse(self, lockfile, wheels):
+        """Return the directory with the wheels pinned for the required
+        revisions, building them if they are missing."""
+        wheelhouse = self._cache_path("wheelhouse")
+
+        def _build(staging):
+            """Build the wheels in the received directory."""
+            if lockfile:
+                self.logger.info("Using the lockfile %s", lockfile)
+                self._build_locked_wheels(staging, lockfile)
+            else:
+                self._build_wheels(staging, wheels)
+
+        cached = util.publish_dir(wheelhouse, _build,
+                                  user=self.args["user"])
+        metrics.get_registry().increment(
+            "arestor_cache_requests_total", cache="wheelhouse",
+            result="hit" if cached else "miss")
+        if cached:
+            self.logger.info("Using the cached wheels from %s", wheelhouse)
+        return wheelhouse
+
+    def _work(self):
+        """Install the repositories and their requirements."""
+        pip = ["sudo", "-u", self.args["user"], self._pip, "install"]
+        if not self.args.get("cache_dir") or not self.key:
+            # A single resolution for all the repositories
+            with self._venv_lock():
+                self._execute(pip + [manifest["source"]
+                                     for manifest in self.manifests],
+                              stream=True)
+            return
+
+        wheels = [manifest["wheel"] for manifest in self.manifests]
+        lockfile = self._get_lockfile()
+        wheelhouse = self._get_wheelhouse(lockfile, wheels)
+        # Generated together with the wheelhouse
+        lockfile = self._cache_path("lockfiles", ".txt")
+
+        command = pip + ["--no-index", "--find-links", wheelhouse]
+        for wheel in wheels:
+            command.extend(["--find-links", os.path.dirname(wheel)])
+        # The lockfile constrains the versions, pip still checks that
+        # the requirements of every repository are satisfied.
+        with self._venv_lock():
+            self._execute(command + ["--constraint", lockfile] + wheels,
+                          stream=True)
+        # Keep the lockfile with the build, so it can be reproduced
+        util.ensure_dir(os.path.dirname(self.lockfile))
+        shutil.copyfile(lockfile, self.lockfile)
+
+
+class VerifyEnvironment(worker_base.Command):
+
+    """Command used for checking everything that was installed in the
+    virtual environment, using a single probe interpreter.
+
+    The versions of the requirements are checked against the lockfile
+    shared by all the repositories (see :class:`InstallRequirements`).
+
+    :ivar: REPOSITORIES: The commands whose installs are verified.
+    """
+
+    DEPENDS = (InstallRequirements, )
+    REPOSITORIES = (InstallTempest, InstallArgusCi, InstallRequirements)
+
+    def _is_complete(self):
+        """The environment can change between the runs of the build,
+        so it is always verified again."""
+        return False
+
+    def _checks(self):
+        """Collect the checks of all the installed repositories."""
+        checks = []
+        for task in self.REPOSITORIES:
+            checks.extend(task(self._executor).verification_checks())
+        return checks
+
+    def _work(self):
+        """Run the probe and report everything that is broken.
+
+        The source of the probe is passed on the command line, the user
+        of the build might not be able to read the arestor package.
+        """
+        stdout, stderr = self._execute(
+            ["sudo", "-u", self.args["user"], self._python,
+             "-c", inspect.getsource(probe), json.dumps(self._checks())])
+        lines = stdout.strip().splitlines()
+        try:
+            report = json.loads(lines[-1] if lines else "")
+        except ValueError:
+            raise ValueError("Invalid output received from the "
+                             "verification probe: %r (stderr: %r)" %
+                             (stdout, stderr))
+
+        failures = ["%s %s: %s" % (result["check"], result["name"],
+                                   result["error"])
+                    for result in report["results"] if not result["ok"]]
+        if failures:
+            raise ValueError("The verification of %(venv)s failed: "
+                             "%(failures)s" %
+                             {"venv": self._venv,
+                              "failures": "; ".join(failures)})
+        self.logger.info("%d check(s) passed for %s (Python %s).",
+                         len(report["results"]), self._venv,
+                         report.get("python"))
+        return report
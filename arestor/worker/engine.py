@@ -0,0 +1,466 @@
+"""
+Execution engine:
+    Run the shell commands on an asyncio event loop in order to be
+    able to drive multiple child processes at the same time.
+"""
+
+import atexit
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from arestor.worker import metrics
+from arestor.worker import retry
+from arestor.worker import trace
+from arestor.worker import util
+
+# The event loop is started only by the commands that execute
+# something, most of the command line calls never need it.
+asyncio = util.LazyModule("asyncio")  # pylint: disable=invalid-name
+
+DEFAULT_LIMIT = 8
+DEFAULT_TAIL = 100
+# How long a timed out process has to exit after SIGTERM, before SIGKILL
+KILL_GRACE = 10
+# The maximum length of a line read from the child process output
+LINE_LIMIT = 2 ** 20
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+_PREVIOUS_SIGTERM = None
+
+
+class CommandTimeout(subprocess.CalledProcessError):
+
+    """The command was stopped because it ran for too long.
+
+    :param timeout: How long the command was allowed to run, in seconds.
+    """
+
+    def __init__(self, returncode, cmd, timeout, output=None):
+        super(CommandTimeout, self).__init__(returncode=returncode, cmd=cmd,
+                                             output=output)
+        self.timeout = timeout
+
+    def __str__(self):
+        return ("Command '%s' timed out after %s seconds and it was "
+                "stopped (return code %s)." % (self.cmd, self.timeout,
+                                               self.returncode))
+
+
+class OutputTail(object):
+
+    """Keep only the last lines from the output of a child process.
+
+    :param channel: The name of the channel (stdout or stderr).
+    :param size:    How many lines are kept. (None keeps all of them)
+    """
+
+    def __init__(self, channel, size=DEFAULT_TAIL):
+        self._channel = channel
+        self._lines = collections.deque(maxlen=size)
+
+    @property
+    def channel(self):
+        """The name of the channel (stdout or stderr)."""
+        return self._channel
+
+    @property
+    def output(self):
+        """The last lines received from the child process."""
+        return b"".join(self._lines)
+
+    async def consume(self, reader, handler, log_file):
+        """Read the output line by line until the end of the stream."""
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # The line is longer than the limit, read what is available
+                line = await reader.read(LINE_LIMIT)
+
+            if not line:
+                break
+
+            self._lines.append(line)
+            if log_file is not None:
+                log_file.write(line)
+            if handler is not None:
+                handler(self._channel, line)
+
+    async def collect(self, reader):
+        """Read the whole stream, as it arrives, without splitting it
+        into lines."""
+        while True:
+            chunk = await reader.read(LINE_LIMIT)
+            if not chunk:
+                break
+            self._lines.append(chunk)
+
+
+class Engine(object):
+
+    """Asyncio based backend for running shell commands.
+
+    The event loop runs in a dedicated thread, so the engine can be
+    shared by all the commands from the current process (including the
+    ones started by the scheduler). The number of the child processes
+    that run at the same time is bounded by the `limit` value.
+    """
+
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self._limit = max(1, limit or DEFAULT_LIMIT)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._semaphore = None
+        self._thread = None
+        self._children = set()
+
+    @property
+    def limit(self):
+        """The maximum number of child processes that can run at once."""
+        return self._limit
+
+    @property
+    def loop(self):
+        """The event loop used by the current engine."""
+        with self._lock:
+            if self._loop is None:
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run_loop,
+                                                args=(ready, ),
+                                                name="arestor-engine")
+                self._thread.daemon = True
+                self._thread.start()
+                ready.wait()
+        return self._loop
+
+    def _run_loop(self, ready):
+        """Create the event loop and run it until the engine is stopped."""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self._limit)
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def stop(self):
+        """Stop the event loop used by the current engine."""
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = self._thread = self._semaphore = None
+
+    def run(self, coroutine):
+        """Run the received coroutine on the engine loop and wait
+        for its result.
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("The engine can not wait for a coroutine "
+                               "from its own event loop.")
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return future.result()
+
+    async def gather(self, *coroutines):
+        """Run the received coroutines at the same time."""
+        return await asyncio.gather(*coroutines)
+
+    async def _spawn(self, command, shell, cwd, env_variables):
+        """Start a new child process, in its own process group."""
+        if shell:
+            # Mirror the behaviour of `subprocess.Popen` with `shell=True`
+            command = ["/bin/sh", "-c"] + list(command)
+
+        return await asyncio.create_subprocess_exec(
+            *command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, cwd=cwd, env=env_variables,
+            limit=LINE_LIMIT, start_new_session=True)
+
+    @staticmethod
+    def _signal(process, signum):
+        """Send the received signal to the process group of the child."""
+        try:
+            os.killpg(process.pid, signum)
+        except OSError:
+            # The process group is already gone
+            pass
+
+    async def _terminate(self, process):
+        """Stop the child process and all its descendants: SIGTERM first
+        and SIGKILL for the ones that are still running after
+        `KILL_GRACE` seconds.
+        """
+        self._signal(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE)
+        except asyncio.TimeoutError:
+            pass
+        # The descendants might survive the child process
+        self._signal(process, signal.SIGKILL)
+        await process.wait()
+
+    def kill_children(self):
+        """Kill the process groups of the running child processes."""
+        for process in list(self._children):
+            self._signal(process, signal.SIGKILL)
+
+    @staticmethod
+    async def _stream(process, handler, log_file, stdout, stderr):
+        """Pass the output of the child process to the received handler
+        and / or log file as it arrives.
+
+        :param stdout:  The :class:`OutputTail` for stdout.
+        :param stderr:  The :class:`OutputTail` for stderr.
+        :returns: The last lines from stdout and stderr.
+        """
+        process.stdin.close()
+        if log_file:
+            log_dir = os.path.dirname(log_file)
+            if log_dir and not os.path.isdir(log_dir):
+                os.makedirs(log_dir)
+            log_file = open(log_file, "ab")
+
+        try:
+            await asyncio.gather(
+                stdout.consume(process.stdout, handler, log_file),
+                stderr.consume(process.stderr, handler, log_file))
+            await process.wait()
+        finally:
+            if log_file:
+                log_file.close()
+
+        return stdout.output, stderr.output
+
+    @staticmethod
+    async def _collect(process, stdout, stderr):
+        """Collect the output of the child process into the received
+        :class:`OutputTail` objects, so what was received is available
+        even if the child process is stopped.
+
+        :returns: The output from stdout and stderr.
+        """
+        process.stdin.close()
+        await asyncio.gather(stdout.collect(process.stdout),
+                             stderr.collect(process.stderr))
+        await process.wait()
+        return stdout.output, stderr.output
+
+    async def _communicate(self, process, stream, log_file, tails):
+        """Wait for the child process and return its output."""
+        if tails is None:
+            return await process.communicate()
+        if stream is None and log_file is None:
+            return await self._collect(process, *tails)
+        return await self._stream(process, stream, log_file, *tails)
+
+    async def execute(self, command, logger, retry_policy=None,
+                      check_exit_code=None, binary=False, cwd=None,
+                      env_variables=None, shell=False, stream=None,
+                      log_file=None, tail=DEFAULT_TAIL, observer=None,
+                      timeout=None):
+        """Shell out and execute a command.
+
+        :param command:         The command passed to the child process.
+        :param logger:          The logger used for reporting.
+        :param retry_policy:    The :class:`retry.RetryPolicy` that decides
+                                if a failed attempt should be retried.
+        :param check_exit_code: A list of allowed exit codes or None if
+                                the exit code should be ignored.
+        :param binary:          Return stdout and stderr as bytes if binary
+                                is True, as Unicode otherwise.
+        :param cwd:             Set the current working directory
+        :param env_variables:   Environment variables and their values that
+                                will be set for the process.
+        :param shell:           whether or not there should be a shell used to
+                                execute this command.
+        :param stream:          A callable that receives every line from the
+                                output, as soon as it is available.
+        :param log_file:        The file where the output will be appended
+                                as soon as it is available.
+        :param tail:            How many lines of output to keep in memory
+                                when stream or log_file are used.
+        :param observer:        A callable that receives the number of
+                                attempts, the last exit code, the duration
+                                and the status (`done` or `failed`) once
+                                the command finished.
+        :param timeout:         How long an attempt can run, in seconds.
+                                The process group of the child is stopped
+                                when the timeout expires and the attempt
+                                fails with :class:`CommandTimeout`.
+
+        When stream or log_file are used only the last `tail` lines from
+        stdout and stderr are returned (or attached to the raised error),
+        otherwise the whole output is. The output received before the
+        timeout is attached to :class:`CommandTimeout` in both cases.
+
+        :raises:                :class:`subprocess.CalledProcessError`
+        """
+        retry_policy = retry_policy or retry.RetryPolicy(attempts=1)
+        tracer = trace.get_tracer()
+        registry = metrics.get_registry()
+        name = describe(command)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            logger.debug("Execute command: %r (attempt %d)",
+                         command, attempt)
+            try:
+                with tracer.async_span("waiting for %s" % name, "queue"):
+                    await self._semaphore.acquire()
+                registry.increment("arestor_execute_attempts_total",
+                                   program=name)
+                timed_out = False
+                tails = None
+                if stream is not None or log_file is not None:
+                    tails = (OutputTail("stdout", tail),
+                             OutputTail("stderr", tail))
+                elif timeout:
+                    # Keep the whole output, for the timed out attempts
+                    tails = (OutputTail("stdout", None),
+                             OutputTail("stderr", None))
+                try:
+                    with tracer.async_span(
+                            name, "process", command=" ".join(command),
+                            attempt=attempt) as details:
+                        process = await self._spawn(command, shell, cwd,
+                                                    env_variables)
+                        self._children.add(process)
+                        try:
+                            stdout, stderr = await asyncio.wait_for(
+                                self._communicate(process, stream,
+                                                  log_file, tails),
+                                timeout)
+                        except asyncio.TimeoutError:
+                            logger.warning("%r timed out after %s seconds, "
+                                           "stopping it.", command, timeout)
+                            await self._terminate(process)
+                            # Keep what was received before the timeout
+                            stdout, stderr = (tails[0].output,
+                                              tails[1].output)
+                            timed_out = True
+                            details["timeout"] = timeout
+                        finally:
+                            self._children.discard(process)
+                        details["return_code"] = process.returncode
+                finally:
+                    self._semaphore.release()
+                return_code = process.returncode
+                registry.increment("arestor_execute_exit_codes_total",
+                                   program=name, code=return_code)
+                if timed_out:
+                    registry.increment("arestor_execute_timeouts_total",
+                                       program=name)
+                logger.debug("%r (return code %s)", command, return_code)
+
+                if not binary:
+                    # Decode from the locale using using the surrogate escape
+                    # error handler (decoding cannot fail)
+                    stdout = os.fsdecode(stdout)
+                    stderr = os.fsdecode(stderr)
+
+                if timed_out:
+                    raise CommandTimeout(returncode=return_code,
+                                         cmd=command, timeout=timeout,
+                                         output=(stdout, stderr))
+                if (check_exit_code is not None and
+                        return_code not in check_exit_code):
+                    raise subprocess.CalledProcessError(
+                        returncode=return_code, cmd=command,
+                        output=(stdout, stderr))
+                if observer is not None:
+                    observer(attempt, return_code,
+                             time.monotonic() - started, "done")
+                return (stdout, stderr)
+            except subprocess.CalledProcessError as exc:
+                delay = retry_policy.next_delay(attempt, exc,
+                                                time.monotonic() - started)
+                if delay is None:
+                    if observer is not None:
+                        observer(attempt, exc.returncode,
+                                 time.monotonic() - started, "failed")
+                    raise
+                logger.debug("%r failed with return code %s, retrying in "
+                             "%.2f seconds.", command, exc.returncode, delay)
+                registry.increment("arestor_execute_retries_total",
+                                   program=name)
+                with tracer.async_span("retry %s" % name, "retry",
+                                       attempt=attempt, delay=delay):
+                    await asyncio.sleep(delay)
+
+
+def describe(command):
+    """Return a short name for the received command, used for tracing.
+
+    The `sudo -u <user>` prefix is skipped and only the name of the
+    program and its first argument are kept (`pip install`). Paths are
+    not used as the first argument, so the name doesn't depend on the
+    build.
+    """
+    command = list(command)
+    if command[:1] == ["sudo"]:
+        command = command[3:] if command[1:2] == ["-u"] else command[1:]
+    if not command:
+        return "sudo"
+
+    name = [os.path.basename(command[0])]
+    if (len(command) > 1 and not command[1].startswith("-") and
+            os.sep not in command[1]):
+        name.append(command[1])
+    return " ".join(name)
+
+
+def kill_children():
+    """Kill the child processes started by the engine of the current
+    process (if it was already created)."""
+    if _ENGINE is not None:
+        _ENGINE.kill_children()
+
+
+def _on_sigterm(signum, frame):
+    """Kill the child processes before arestor is stopped."""
+    kill_children()
+    if callable(_PREVIOUS_SIGTERM):
+        _PREVIOUS_SIGTERM(signum, frame)
+    else:
+        raise SystemExit(128 + signum)
+
+
+def handle_sigterm():
+    """Kill the child processes when the current process receives
+    SIGTERM.
+
+    The signals can only be handled from the main thread, so this must
+    be called from it before the commands are started (the child
+    processes run in their own sessions and they don't receive the
+    signals sent to the process group of arestor).
+    """
+    global _PREVIOUS_SIGTERM  # pylint: disable=global-statement
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+    if previous in (_on_sigterm, signal.SIG_IGN):
+        return
+    _PREVIOUS_SIGTERM = previous
+    signal.signal(signal.SIGTERM, _on_sigterm)
+
+
+def get_engine(limit=None):
+    """Return the engine shared by all the commands from the
+    current process.
+    """
+    global _ENGINE  # pylint: disable=global-statement
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = Engine(limit)
+            # The child processes run in their own process groups, so
+            # they don't receive the signals sent to arestor
+            atexit.register(_ENGINE.kill_children)
+    return _ENGINE
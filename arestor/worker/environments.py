@@ -0,0 +1,194 @@
+"""
+Build environments:
+    The virtual environments of the builds, with the removal of the
+    stale ones moved out of the critical path and a disk quota.
+"""
+
+import fcntl
+import os
+import shutil
+import time
+import uuid
+
+from arestor.worker import util
+
+ROOT = "/tmp/argus-env"
+
+
+class EnvironmentManager(object):
+
+    """Manage the virtual environments from the root directory.
+
+    Removing a virtual environment takes a while, so the environments
+    are first moved aside (in the trash directory, on the same file
+    system) with a rename and deleted later by :meth:`reap`, usually
+    from a detached process.
+
+    The environments which were not used recently are evicted, the
+    least recently used first, until the quota is respected.
+
+    ::
+        <root>/
+            <build>/            # the virtual environment of the build
+            <build>.journal     # the journal of the build
+            .trash/             # the environments waiting to be deleted
+
+    :param root:        The directory that contains the environments.
+    :param max_count:   How many environments can be kept.
+                        (Default: no limit)
+    :param max_size:    How much disk space the environments can use,
+                        in bytes. (Default: no limit)
+    :param grace:       The environments used in the last `grace`
+                        seconds are never evicted, they probably belong
+                        to running builds.
+    """
+
+    TRASH = ".trash"
+    GRACE = 3600
+    SUFFIXES = (".journal", ".journal.lock")
+
+    def __init__(self, root=ROOT, max_count=0, max_size=0, grace=GRACE):
+        self._root = root
+        self._trash = os.path.join(root, self.TRASH)
+        self._max_count = max(0, max_count or 0)
+        self._max_size = max(0, max_size or 0)
+        self._grace = grace
+
+    @property
+    def root(self):
+        """The directory that contains the environments."""
+        return self._root
+
+    @staticmethod
+    def touch(environment):
+        """Record that the received environment was used."""
+        try:
+            os.utime(environment, None)
+        except OSError:
+            pass
+
+    def discard(self, environment, journal=False):
+        """Move the received environment aside, it will be deleted
+        by :meth:`reap`.
+
+        :param journal: Discard the journal of the build too.
+        :returns: True if the environment was moved, False otherwise.
+        """
+        if journal:
+            for suffix in self.SUFFIXES:
+                if os.path.exists(environment + suffix):
+                    os.remove(environment + suffix)
+
+        if not os.path.isdir(environment):
+            return False
+        util.ensure_dir(self._trash)
+        target = os.path.join(self._trash, "%s-%s" % (
+            os.path.basename(environment), uuid.uuid4().hex))
+        try:
+            os.rename(environment, target)
+        except OSError:
+            # Probably on another file system, delete it right away
+            shutil.rmtree(environment, ignore_errors=True)
+        return True
+
+    def environments(self):
+        """Return the environments, the least recently used first."""
+        try:
+            names = os.listdir(self._root)
+        except OSError:
+            return []
+
+        entries = []
+        for name in names:
+            path = os.path.join(self._root, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        return [path for _, path in sorted(entries)]
+
+    @staticmethod
+    def disk_usage(path):
+        """Return how much disk space the received directory uses."""
+        total = 0
+        for directory, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(directory,
+                                                   name)).st_blocks * 512
+                except OSError:
+                    continue
+        return total
+
+    def evict(self, keep=()):
+        """Discard the least recently used environments until the
+        quota is respected.
+
+        :param keep:    The environments that must not be evicted.
+        :returns: The evicted environments.
+        """
+        if not self._max_count and not self._max_size:
+            return []
+
+        environments = self.environments()
+        sizes = {}
+        if self._max_size:
+            sizes = dict((path, self.disk_usage(path))
+                         for path in environments)
+
+        evicted = []
+        count, size = len(environments), sum(sizes.values())
+        deadline = time.time() - self._grace
+        for path in environments:
+            over_count = self._max_count and count > self._max_count
+            over_size = self._max_size and size > self._max_size
+            if not over_count and not over_size:
+                break
+            try:
+                if path in keep or os.path.getmtime(path) > deadline:
+                    continue
+            except OSError:
+                continue
+            if self.discard(path, journal=True):
+                evicted.append(path)
+                count -= 1
+                size -= sizes.get(path, 0)
+        return evicted
+
+    def reap(self):
+        """Delete the environments from the trash directory.
+
+        Only one process reaps at a time, the others return without
+        waiting for it.
+
+        :returns: How many environments were deleted.
+        """
+        if not os.path.isdir(self._trash):
+            return 0
+
+        lock_path = os.path.join(self._trash, ".reap.lock")
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return 0
+
+            try:
+                deleted, seen = 0, set()
+                while True:
+                    # New environments can be discarded in the meantime
+                    names = [name for name in os.listdir(self._trash)
+                             if not name.startswith(".") and
+                             name not in seen]
+                    if not names:
+                        return deleted
+                    for name in names:
+                        seen.add(name)
+                        path = os.path.join(self._trash, name)
+                        shutil.rmtree(path, ignore_errors=True)
+                        if not os.path.exists(path):
+                            deleted += 1
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,220 @@
+"""
+Host facts:
+    What the current machine provides (distribution, interpreters,
+    tools and their versions), gathered once and cached on disk.
+"""
+
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from arestor.worker import util
+
+_FACTS = {}
+_FACTS_LOCK = threading.Lock()
+
+DEFAULT_TTL = 3600
+# The tools and the interpreters checked when the facts are gathered
+TOOLS = ("apt-get", "dpkg-query", "git", "pip", "sudo", "virtualenv",
+         "/usr/bin/python2.7")
+# The tools whose versions are recorded
+VERSIONS = {
+    "git": ["git", "--version"],
+    "pip": ["pip", "--version"],
+    "virtualenv": ["virtualenv", "--version"],
+}
+MODULES = ("glanceclient", "keystoneclient", "neutronclient")
+# Files which change when packages are installed or removed
+WATCHED_FILES = ("/etc/os-release", "/var/lib/dpkg/status")
+
+
+def _distribution():
+    """Return the id and the version of the Linux distribution."""
+    release = {}
+    try:
+        with open("/etc/os-release", "r") as release_file:
+            for line in release_file:
+                key, _, value = line.strip().partition("=")
+                release[key] = value.strip('"\'')
+    except (IOError, OSError):
+        pass
+    return release.get("ID", ""), release.get("VERSION_ID", "")
+
+
+def _which(tool):
+    """Return the full path of the received tool or None."""
+    if os.path.isabs(tool):
+        return tool if os.access(tool, os.X_OK) else None
+    return shutil.which(tool)
+
+
+def _version(command):
+    """Return the first line printed by the received command."""
+    try:
+        with open(os.devnull, "wb") as devnull:
+            output = subprocess.check_output(command, stderr=devnull,
+                                             timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    lines = output.decode("utf-8", "replace").strip().splitlines()
+    return lines[0] if lines else None
+
+
+class HostFacts(object):
+
+    """The facts about the current machine.
+
+    The facts are stored in the cache directory and reused until they
+    expire or until the signature of the machine changes. The signature
+    contains $PATH, the modification time of every directory from it
+    and the modification time of the package database. As a result,
+    installing or removing a tool invalidates the facts.
+
+    :param cache_dir:   The directory where the facts are stored.
+                        (Default: the facts are not cached)
+    :param ttl:         How long the cached facts are valid, in seconds.
+    :param refresh:     Ignore the facts which are already cached.
+    """
+
+    FILE_NAME = "facts.json"
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL, refresh=False):
+        self._path = (os.path.join(cache_dir, self.FILE_NAME)
+                      if cache_dir else None)
+        self._ttl = ttl
+        self._refresh = refresh
+        self._lock = threading.Lock()
+        self._facts = None
+
+    @staticmethod
+    def signature():
+        """Return the details which invalidate the cached facts."""
+        paths = os.environ.get("PATH", "").split(os.pathsep)
+        watched = [path for path in paths if path] + list(WATCHED_FILES)
+        modified = {}
+        for path in watched:
+            try:
+                modified[path] = os.stat(path).st_mtime
+            except OSError:
+                modified[path] = None
+        return {"path": os.environ.get("PATH", ""), "modified": modified,
+                "python": sys.executable}
+
+    @staticmethod
+    def gather():
+        """Probe the current machine."""
+        distribution, version = _distribution()
+        tools = dict((tool, _which(tool)) for tool in TOOLS)
+        return {
+            "platform": sys.platform,
+            "distribution": distribution,
+            "distribution_version": version,
+            "machine": platform.machine(),
+            "tools": tools,
+            "versions": dict((tool, _version(command))
+                             for tool, command in VERSIONS.items()
+                             if tools.get(tool)),
+            "modules": dict((module,
+                             importlib.util.find_spec(module) is not None)
+                            for module in MODULES),
+        }
+
+    def _load(self, signature):
+        """Return the cached facts if they are still valid."""
+        if not self._path or self._refresh:
+            return None
+        try:
+            with open(self._path, "r") as facts_file:
+                entry = json.load(facts_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if entry.get("signature") != signature:
+            return None
+        if time.time() - entry.get("created", 0) > self._ttl:
+            return None
+        return entry.get("facts")
+
+    def _save(self, signature, facts):
+        """Store the received facts in the cache directory."""
+        if not self._path:
+            return
+        entry = {"signature": signature, "created": time.time(),
+                 "facts": facts}
+        try:
+            util.atomic_write(self._path, json.dumps(entry, indent=2,
+                                                     sort_keys=True))
+        except (IOError, OSError):
+            pass
+
+    @property
+    def facts(self):
+        """All the facts about the current machine."""
+        with self._lock:
+            if self._facts is None:
+                # The signature uses the values from before the probing,
+                # so concurrent changes invalidate the cache.
+                signature = json.loads(json.dumps(self.signature()))
+                facts = self._load(signature)
+                if facts is None:
+                    facts = self.gather()
+                    self._save(signature, facts)
+                self._facts = facts
+            return self._facts
+
+    def invalidate(self):
+        """Forget the facts, they will be gathered again on the next
+        access (for example, after installing new packages).
+        """
+        with self._lock:
+            self._facts = None
+            self._refresh = True
+
+    @property
+    def platform(self):
+        """The platform of the current machine (`sys.platform`)."""
+        return self.facts["platform"]
+
+    @property
+    def distribution(self):
+        """The id of the Linux distribution (for example `ubuntu`)."""
+        return self.facts["distribution"]
+
+    def which(self, tool):
+        """Return the full path of the received tool or None."""
+        tools = self.facts["tools"]
+        if tool not in tools:
+            return _which(tool)
+        return tools[tool]
+
+    def version(self, tool):
+        """Return the version reported by the received tool."""
+        return self.facts["versions"].get(tool)
+
+    def has_module(self, module):
+        """Check if the received Python module can be imported."""
+        modules = self.facts["modules"]
+        if module not in modules:
+            return importlib.util.find_spec(module) is not None
+        return modules[module]
+
+    def missing(self, tools):
+        """Return the tools which are not available."""
+        return [tool for tool in tools if not self.which(tool)]
+
+
+def get_facts(cache_dir=None, ttl=DEFAULT_TTL, refresh=False):
+    """Return the facts about the current machine, shared by all the
+    commands from the current process.
+    """
+    with _FACTS_LOCK:
+        if cache_dir not in _FACTS:
+            _FACTS[cache_dir] = HostFacts(cache_dir, ttl=ttl,
+                                          refresh=refresh)
+        return _FACTS[cache_dir]
@@ -0,0 +1,252 @@
+"""
+Timing history:
+    How long every task, phase and command took, stored in a SQLite
+    database shared by all the builds from the current machine.
+"""
+
+import json
+import os
+import threading
+import time
+
+from arestor.worker import util
+
+# Most of the command line calls only write a few rows, if any
+sqlite3 = util.LazyModule("sqlite3")  # pylint: disable=invalid-name
+
+_HISTORY = None
+_HISTORY_LOCK = threading.Lock()
+
+FILE_NAME = "history.sqlite"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS timings (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    build TEXT,
+    task TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    command TEXT,
+    attempts INTEGER,
+    duration REAL NOT NULL,
+    status TEXT,
+    exit_code INTEGER,
+    refs TEXT
+);
+CREATE INDEX IF NOT EXISTS timings_phase ON timings (phase, started);
+"""
+
+
+def percentile(values, fraction):
+    """Return the received percentile (0 - 1) of the sorted values,
+    using linear interpolation.
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position -
+                                                              lower)
+
+
+class History(object):
+
+    """Record the timings of the current process.
+
+    Every task is recorded with the `task` phase, its prologue, work and
+    epilogue with their own names and every executed command with the
+    `execute` phase. The history is best effort: a database which can't
+    be written never fails a build.
+
+    :param path:    The location of the SQLite database.
+                    (Default: the timings are not recorded)
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def path(self):
+        """The location of the SQLite database."""
+        return self._path
+
+    @property
+    def enabled(self):
+        """Whether the timings are recorded or not."""
+        return bool(self._path)
+
+    def _connect(self):
+        """Open the database, creating it if it is missing."""
+        if self._connection is None:
+            util.ensure_dir(os.path.dirname(self._path))
+            connection = sqlite3.connect(self._path, timeout=30,
+                                         check_same_thread=False)
+            # Let the concurrent builds write without blocking the readers
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def record(self, task, phase, duration, started=None, build=None,
+               command=None, attempts=None, status=None, exit_code=None,
+               refs=None):
+        """Add a new timing to the history.
+
+        :param task:        The name of the task.
+        :param phase:       `task`, `prologue`, `work`, `epilogue` or
+                            `execute`.
+        :param duration:    How long it took, in seconds.
+        :param started:     When it started. (Default: now - duration)
+        :param build:       The build id.
+        :param command:     The executed command.
+        :param attempts:    How many times the command was executed.
+        :param status:      `done`, `skipped` or `failed`.
+        :param exit_code:   The exit code of the last attempt.
+        :param refs:        The branches / revisions used by the task.
+        """
+        if not self.enabled:
+            return
+        if started is None:
+            started = time.time() - duration
+        row = (started, build, task, phase, command, attempts, duration,
+               status, exit_code,
+               json.dumps(refs, sort_keys=True) if refs else None)
+        with self._lock:
+            try:
+                connection = self._connect()
+                with connection:
+                    connection.execute(
+                        "INSERT INTO timings (started, build, task, phase, "
+                        "command, attempts, duration, status, exit_code, "
+                        "refs) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            except sqlite3.Error:
+                pass
+
+    def timings(self, phase="task", since=None, status="done"):
+        """Return the recorded timings, the oldest first.
+
+        :returns: A list of dictionaries with the task, the refs, when
+                  it started and the duration.
+        """
+        if not self.enabled or not os.path.exists(self._path):
+            return []
+        query = ("SELECT task, command, refs, started, duration FROM timings "
+                 "WHERE phase = ?")
+        parameters = [phase]
+        if since is not None:
+            query += " AND started >= ?"
+            parameters.append(since)
+        if status is not None:
+            query += " AND status = ?"
+            parameters.append(status)
+        query += " ORDER BY started"
+
+        with self._lock:
+            rows = self._connect().execute(query, parameters).fetchall()
+        return [{"task": task, "command": command,
+                 "refs": json.loads(refs) if refs else {},
+                 "started": started, "duration": duration}
+                for task, command, refs, started, duration in rows]
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def report(timings, window, threshold=1.5, now=None):
+    """Summarize the received timings (see :meth:`History.timings`).
+
+    The timings are grouped by task and branch. The median of the last
+    `window` seconds is compared with the median of the task (for all
+    the branches) from the window before it. The groups that became
+    slower by more than `threshold` times are flagged as regressions.
+
+    :returns: A list of dictionaries, sorted by task and branch.
+    """
+    now = time.time() if now is None else now
+    recent_start, previous_start = now - window, now - 2 * window
+
+    groups, baselines = {}, {}
+    for timing in timings:
+        task = timing["command"] or timing["task"]
+        branch = timing["refs"].get("branch", "")
+        groups.setdefault((task, branch), []).append(timing)
+        if previous_start <= timing["started"] < recent_start:
+            baselines.setdefault(task, []).append(timing["duration"])
+
+    summary = []
+    for (task, branch), group in sorted(groups.items()):
+        durations = sorted(timing["duration"] for timing in group)
+        recent = sorted(timing["duration"] for timing in group
+                        if timing["started"] >= recent_start)
+        baseline = percentile(sorted(baselines.get(task, [])), 0.5)
+        current = percentile(recent, 0.5)
+        change = current / baseline if current and baseline else None
+        summary.append({
+            "task": task,
+            "branch": branch,
+            "runs": len(durations),
+            "p50": percentile(durations, 0.50),
+            "p95": percentile(durations, 0.95),
+            "p99": percentile(durations, 0.99),
+            "recent": current,
+            "baseline": baseline,
+            "change": change,
+            "regression": bool(change and change >= threshold),
+        })
+    return summary
+
+
+def trend(timings, period=86400):
+    """Return the median duration of every task for every period.
+
+    :returns: A dictionary with the task as key and a list of
+              (start of the period, runs, median) as value.
+    """
+    buckets = {}
+    for timing in timings:
+        task = timing["command"] or timing["task"]
+        start = timing["started"] - timing["started"] % period
+        buckets.setdefault(task, {}).setdefault(start, []).append(
+            timing["duration"])
+    return dict((task, [(start, len(values), percentile(sorted(values), 0.5))
+                        for start, values in sorted(periods.items())])
+                for task, periods in buckets.items())
+
+
+def location(args):
+    """Return the database selected by the command line arguments:
+    the `history` argument or the default one from the cache directory.
+    """
+    path = args.get("history")
+    if path is None and args.get("cache_dir"):
+        path = os.path.join(args["cache_dir"], FILE_NAME)
+    return path or None
+
+
+def get_history():
+    """Return the timing history used by the current process."""
+    global _HISTORY  # pylint: disable=global-statement
+    with _HISTORY_LOCK:
+        if _HISTORY is None:
+            _HISTORY = History()
+    return _HISTORY
+
+
+def configure(path):
+    """Start recording the timings of the current process.
+
+    :returns: The timing history.
+    """
+    global _HISTORY  # pylint: disable=global-statement
+    with _HISTORY_LOCK:
+        if _HISTORY is None or _HISTORY.path != path:
+            if _HISTORY is not None:
+                _HISTORY.close()
+            _HISTORY = History(path)
+    return _HISTORY
@@ -0,0 +1,84 @@
+"""
+Task journal:
+    Keep track of the tasks that were successfully completed for a
+    build, in order to skip them when the build is resumed.
+"""
+
+import json
+import threading
+import time
+import uuid
+
+from arestor.worker import util
+
+
+class Journal(object):
+
+    """The persistent record of the completed tasks of a build.
+
+    Every entry contains the fingerprint of the task inputs and a stamp
+    which changes every time the task runs. The tasks include the stamps
+    of their dependencies in their fingerprint, so running a task again
+    invalidates all the tasks that depend on it.
+
+    :param path: The location of the journal file.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """The location of the journal file."""
+        return self._path
+
+    def _load(self):
+        """Read the entries from the journal file."""
+        try:
+            with open(self._path, "r") as journal_file:
+                return json.load(journal_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _update(self, callback):
+        """Apply the received callback on the journal entries and save
+        the result.
+        """
+        with self._lock, util.file_lock(self._path + ".lock"):
+            entries = self._load()
+            result = callback(entries)
+            util.atomic_write(self._path, json.dumps(entries, indent=2,
+                                                     sort_keys=True))
+        return result
+
+    def entry(self, task):
+        """Return the journal entry for the received task (or None)."""
+        return self._load().get(task)
+
+    def stamp(self, task):
+        """Return the stamp of the last successful run of the task."""
+        entry = self.entry(task)
+        return entry["stamp"] if entry else None
+
+    def is_valid(self, task, fingerprint):
+        """Check if the task was completed with the same inputs."""
+        entry = self.entry(task)
+        return bool(entry) and entry.get("fingerprint") == fingerprint
+
+    def record(self, task, fingerprint):
+        """Mark the received task as completed."""
+        def _record(entries):
+            stamp = uuid.uuid4().hex
+            entries[task] = {"fingerprint": fingerprint, "stamp": stamp,
+                             "completed": time.time()}
+            return stamp
+        return self._update(_record)
+
+    def remove(self, task):
+        """Forget the received task."""
+        self._update(lambda entries: entries.pop(task, None))
+
+    def clear(self):
+        """Forget all the tasks."""
+        self._update(lambda entries: entries.clear())
@@ -0,0 +1,242 @@
+"""
+Metrics:
+    Counters and histograms exported in the Prometheus textfile
+    collector format.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from arestor.worker import util
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+TASK_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800)
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# name: (type, help, buckets)
+METRICS = {
+    "arestor_task_duration_seconds": (
+        HISTOGRAM, "How long the tasks take, by task and status.",
+        TASK_BUCKETS),
+    "arestor_execute_attempts_total": (
+        COUNTER, "How many times the commands were executed.", None),
+    "arestor_execute_retries_total": (
+        COUNTER, "How many failed commands were retried.", None),
+    "arestor_execute_exit_codes_total": (
+        COUNTER, "The exit codes of the executed commands.", None),
+    "arestor_execute_timeouts_total": (
+        COUNTER, "How many commands were stopped because they timed "
+                 "out.", None),
+    "arestor_openstack_request_duration_seconds": (
+        HISTOGRAM, "How long the OpenStack API calls take.", API_BUCKETS),
+    "arestor_cache_requests_total": (
+        COUNTER, "The cache lookups, by cache and result (hit / miss).",
+        None),
+    "arestor_environments_discarded_total": (
+        COUNTER, "The build environments moved aside, by reason "
+                 "(stale / quota).", None),
+}
+
+
+def _labels(labels):
+    """Return a hashable representation of the received labels."""
+    return tuple(sorted((str(name), str(value))
+                        for name, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    """Format the labels of a sample."""
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, value.replace("\\", "\\\\")
+                     .replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels)
+
+
+def _format_number(value):
+    """Format a bucket bound or a sample value."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry(object):
+
+    """Collect the metrics of the current process.
+
+    The values collected since the last flush are added to the totals
+    stored in the metrics directory, so all the arestor processes from
+    the machine (including the short-lived ones) report to the same
+    `arestor.prom` file.
+
+    :param directory:   The directory read by the textfile collector.
+                        (Default: the metrics are not collected)
+    """
+
+    FILE_NAME = "arestor.prom"
+    STATE_FILE = ".arestor-metrics.json"
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    @property
+    def directory(self):
+        """The directory read by the textfile collector."""
+        return self._directory
+
+    @property
+    def enabled(self):
+        """Whether the metrics are collected or not."""
+        return bool(self._directory)
+
+    def increment(self, name, value=1, **labels):
+        """Increment the received counter."""
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add a new observation to the received histogram."""
+        if not self.enabled:
+            return
+        buckets = METRICS[name][2]
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                key, {"buckets": [0] * len(buckets), "sum": 0, "count": 0})
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the body of the `with` statement takes."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - started, **labels)
+
+    def _merge(self, state):
+        """Add the values collected since the last flush to the
+        received state and forget them.
+        """
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            histograms, self._histograms = self._histograms, {}
+
+        totals = state.setdefault("counters", {})
+        for (name, labels), value in counters.items():
+            key = json.dumps([name, labels])
+            totals[key] = totals.get(key, 0) + value
+
+        totals = state.setdefault("histograms", {})
+        for (name, labels), histogram in histograms.items():
+            key = json.dumps([name, labels])
+            total = totals.setdefault(key, {
+                "buckets": [0] * len(histogram["buckets"]),
+                "sum": 0, "count": 0})
+            total["buckets"] = [old + new for old, new in
+                                zip(total["buckets"], histogram["buckets"])]
+            total["sum"] += histogram["sum"]
+            total["count"] += histogram["count"]
+        return state
+
+    @staticmethod
+    def render(state):
+        """Return the received state in the Prometheus text format."""
+        series = {}
+        for key, value in state.get("counters", {}).items():
+            name, labels = json.loads(key)
+            series.setdefault(name, []).append((labels, [
+                "%s%s %s" % (name, _format_labels(labels),
+                             _format_number(value))]))
+
+        for key, histogram in state.get("histograms", {}).items():
+            name, labels = json.loads(key)
+            lines = []
+            for bound, value in zip(METRICS[name][2], histogram["buckets"]):
+                lines.append("%s_bucket%s %d" % (
+                    name, _format_labels(labels,
+                                         [("le", _format_number(bound))]),
+                    value))
+            lines.append("%s_bucket%s %d" % (
+                name, _format_labels(labels, [("le", "+Inf")]),
+                histogram["count"]))
+            lines.append("%s_sum%s %s" % (name, _format_labels(labels),
+                                          _format_number(histogram["sum"])))
+            lines.append("%s_count%s %d" % (name, _format_labels(labels),
+                                            histogram["count"]))
+            series.setdefault(name, []).append((labels, lines))
+
+        output = []
+        for name in sorted(series):
+            metric_type, description, _ = METRICS[name]
+            output.append("# HELP %s %s" % (name, description))
+            output.append("# TYPE %s %s" % (name, metric_type))
+            for _, lines in sorted(series[name]):
+                output.extend(lines)
+        return "\n".join(output) + "\n"
+
+    def flush(self):
+        """Add the collected values to the metrics file."""
+        if not self.enabled:
+            return
+
+        state_file = os.path.join(self._directory, self.STATE_FILE)
+        with util.file_lock(state_file + ".lock"):
+            try:
+                with open(state_file, "r") as state_handle:
+                    state = json.load(state_handle)
+            except (IOError, OSError, ValueError):
+                state = {}
+
+            state = self._merge(state)
+            util.atomic_write(state_file, json.dumps(state))
+            util.atomic_write(os.path.join(self._directory, self.FILE_NAME),
+                              self.render(state))
+
+
+def get_registry():
+    """Return the metrics registry used by the current process."""
+    global _REGISTRY  # pylint: disable=global-statement
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = Registry()
+    return _REGISTRY
+
+
+def configure(directory):
+    """Start collecting the metrics of the current process.
+
+    :returns: The metrics registry.
+    """
+    global _REGISTRY  # pylint: disable=global-statement
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None or _REGISTRY.directory != directory:
+            _REGISTRY = Registry(directory)
+    return _REGISTRY
+
+
+def flush():
+    """Add the metrics collected by the current process to the
+    metrics file.
+    """
+    get_registry().flush()
@@ -0,0 +1,95 @@
+"""
+Git mirrors:
+    Local bare mirrors of the remote repositories, shared by all the
+    builds from the current machine.
+"""
+
+import os
+import re
+import shutil
+import uuid
+
+from arestor.worker import util
+
+
+class GitMirror(object):
+
+    """A bare mirror of a remote git repository.
+
+    The mirror is cloned once and then updated incrementally. All the
+    changes are made under an exclusive lock, while the readers (the
+    builds cloning from the mirror) hold a shared lock.
+
+    :param url:     The URL of the remote repository.
+    :param root:    The directory that contains all the mirrors.
+    :param execute: A callable used for running the git commands
+                    (see :meth:`worker.base.Command._execute`).
+    """
+
+    def __init__(self, url, root, execute):
+        self._url = url
+        self._execute = execute
+
+        name = re.sub(r"[^A-Za-z0-9._-]+", "_", url.split("://", 1)[-1])
+        if not name.endswith(".git"):
+            name += ".git"
+        self._path = os.path.join(root, "git", name)
+        self._lock = self._path + ".lock"
+
+    @property
+    def url(self):
+        """The URL of the remote repository."""
+        return self._url
+
+    @property
+    def path(self):
+        """The location of the mirror."""
+        return self._path
+
+    def _git(self, *arguments, **kwargs):
+        """Run a git command against the mirror."""
+        return self._execute(["git", "--git-dir", self._path] +
+                             list(arguments), **kwargs)
+
+    def update(self):
+        """Create the mirror or fetch the latest changes from the
+        remote repository.
+        """
+        with util.file_lock(self._lock):
+            if os.path.isdir(self._path):
+                self._git("remote", "update", "--prune")
+                return
+
+            staging = "%s.%s.tmp" % (self._path, uuid.uuid4().hex)
+            try:
+                self._execute(["git", "clone", "--mirror", self._url,
+                               staging])
+                os.rename(staging, self._path)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+    def resolve(self, reference):
+        """Return the commit SHA for the received branch / tag / revision
+        or an empty string if the reference is unknown.
+        """
+        with util.file_lock(self._lock, shared=True):
+            stdout, _ = self._git("rev-parse", "--verify", "--quiet",
+                                  "%s^{commit}" % reference,
+                                  check_exit_code=False, attempts=1)
+        return stdout.strip()
+
+    def checkout(self, revision, target, user=None):
+        """Create a working copy of the received revision.
+
+        The working copy shares the objects with the mirror, so no
+        object is copied or downloaded.
+        """
+        prefix = ["sudo", "-u", user] if user else []
+        with util.file_lock(self._lock, shared=True):
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            self._execute(prefix + ["git", "clone", "--quiet", "--shared",
+                                    "--no-checkout", self._path, target])
+            self._execute(prefix + ["git", "-C", target, "checkout",
+                                    "--quiet", "--detach", revision])
+        return target
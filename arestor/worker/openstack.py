@@ -0,0 +1,420 @@
+"""
+OpenStack helpers:
+    The authenticated session shared by the builds and the snapshots
+    of the OpenStack resources required for generating the tempest
+    configuration.
+"""
+
+import calendar
+import contextlib
+import os
+import re
+import threading
+import time
+
+from arestor.worker import metrics
+from arestor.worker import trace
+from arestor.worker import util
+
+# The OpenStack clients are expensive to import and only the tasks
+# that configure tempest need them.
+# pylint: disable=invalid-name
+glance_client = util.LazyModule("glanceclient.client")
+keystone_client = util.LazyModule("keystoneclient.v2_0.client")
+neutron_client = util.LazyModule("neutronclient.v2_0.client")
+# pylint: enable=invalid-name
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def api_call(name, **details):
+    """Trace and measure an OpenStack API call."""
+    with trace.get_tracer().span(name, "api", **details) as span:
+        with metrics.get_registry().timer(
+                "arestor_openstack_request_duration_seconds", call=name):
+            yield span
+
+
+class Session(object):
+
+    """An authenticated session, shared by all the builds from the
+    current machine.
+
+    The Keystone token, the tenant id and the endpoints of the services
+    are stored in the disk cache (when available) and reused by all the
+    processes until shortly before the token expires. Only one process
+    authenticates at a time, the others wait for it and use the new
+    token. The clients are created once per process, so they reuse
+    their HTTP connections.
+
+    :param credentials: The `OS_*` credentials (auth_url, username,
+                        password and tenant_name).
+    :param cache:       A :class:`cache.DiskCache` object (optional).
+    :param margin:      How long before its expiration a token is
+                        considered expired, in seconds.
+    """
+
+    NAMESPACE = "tokens"
+    SERVICES = ("image", "network")
+    DEFAULT_LIFETIME = 3600
+
+    def __init__(self, credentials, cache=None, margin=300):
+        self._credentials = credentials
+        self._cache = cache
+        self._margin = margin
+        self._lock = threading.Lock()
+        self._access = None
+        self._clients = {}
+
+    @property
+    def key(self):
+        """The key that identifies the OpenStack endpoint and the
+        credentials in the disk cache."""
+        return "%s|%s|%s" % (self._credentials.get("auth_url"),
+                             self._credentials.get("tenant_name"),
+                             self._credentials.get("username"))
+
+    def _is_valid(self, access):
+        """Check if the received token can still be used."""
+        return bool(access and
+                    access.get("expires", 0) - self._margin > time.time())
+
+    def _authenticate(self):
+        """Request a new token from Keystone."""
+        with api_call("keystone.authenticate"):
+            keystone = keystone_client.Client(**self._credentials)
+
+        expires = getattr(keystone.auth_ref, "expires", None)
+        if expires is not None:
+            expires = calendar.timegm(expires.utctimetuple())
+        else:
+            expires = time.time() + self.DEFAULT_LIFETIME
+        return {
+            "token": keystone.auth_token,
+            "expires": expires,
+            "tenant_id": keystone.auth_tenant_id,
+            "endpoints": dict(
+                (service, keystone.service_catalog.url_for(
+                    service_type=service, endpoint_type="publicURL"))
+                for service in self.SERVICES),
+        }
+
+    def _cached(self):
+        """Return the token from the disk cache, if it is still valid."""
+        # The token is valid until it expires, not for the TTL of the cache
+        access = self._cache.get(self.NAMESPACE, self.key, ttl=float("inf"))
+        return access if self._is_valid(access) else None
+
+    @property
+    def access(self):
+        """The token, the tenant id and the endpoints of the services."""
+        with self._lock:
+            if self._is_valid(self._access):
+                return self._access
+
+            if not self._cache:
+                self._access = self._authenticate()
+                return self._access
+
+            access = self._cached()
+            if access is None:
+                lock_path = os.path.join(self._cache.root, self.NAMESPACE,
+                                         ".authenticate.lock")
+                with util.file_lock(lock_path):
+                    # Another process might have authenticated meanwhile
+                    access = self._cached()
+                    if access is None:
+                        access = self._authenticate()
+                        self._cache.set(self.NAMESPACE, self.key, access)
+            self._access = access
+            return self._access
+
+    def invalidate(self):
+        """Forget the current token (for example, after it was revoked)."""
+        with self._lock:
+            self._access = None
+            self._clients.clear()
+            if self._cache:
+                self._cache.invalidate(self.NAMESPACE, self.key)
+
+    @property
+    def tenant_id(self):
+        """The tenant id for the current user."""
+        return self.access["tenant_id"]
+
+    def _client(self, service, factory):
+        """Return the client of the received service, created with the
+        current token."""
+        access = self.access
+        with self._lock:
+            client, token = self._clients.get(service, (None, None))
+            if client is None or token != access["token"]:
+                client = factory(access["endpoints"][service],
+                                 access["token"])
+                self._clients[service] = (client, access["token"])
+            return client
+
+    @property
+    def neutron(self):
+        """Expose the neutron client."""
+        return self._client(
+            "network", lambda endpoint, token: neutron_client.Client(
+                endpoint_url=endpoint, token=token))
+
+    @property
+    def glance(self):
+        """Expose the glance client (API v2)."""
+        return self._client(
+            "image", lambda endpoint, token: glance_client.Client(
+                "2", endpoint=endpoint, token=token))
+
+
+def _resolve(client):
+    """Return the received client, creating it if a function that
+    returns the client was received instead."""
+    return client() if callable(client) else client
+
+
+def is_unauthorized(exc):
+    """Check if the received exception is the `401 Unauthorized` answer
+    of an OpenStack API (the token expired or was revoked)."""
+    # neutronclient, glanceclient and keystoneclient respectively
+    return any(getattr(exc, attribute, None) == 401
+               for attribute in ("status_code", "code", "http_status"))
+
+
+def _authorized(client, function, renew=None):
+    """Call the received function with the client.
+
+    When the token of the client is rejected, the credentials are
+    renewed and the function is called once more with a new client
+    (only if a function that returns the client was received).
+
+    :param client:   The client or a function that returns it.
+    :param function: The function that uses the client.
+    :param renew:    The function that renews the credentials.
+    """
+    try:
+        return function(_resolve(client))
+    except Exception as exc:  # pylint: disable=broad-except
+        if renew is None or not callable(client) or not is_unauthorized(exc):
+            raise
+    renew()
+    return function(_resolve(client))
+
+
+def get_session(credentials, cache=None):
+    """Return the session for the received credentials, shared by all
+    the commands from the current process.
+    """
+    session = Session(credentials, cache=cache)
+    with _SESSIONS_LOCK:
+        return _SESSIONS.setdefault((session.key, cache and cache.root),
+                                    session)
+
+
+class Topology(object):
+
+    """A snapshot of the networks, subnets and routers required by
+    the tempest configuration.
+
+    All the resources are fetched at once, using server-side filters,
+    and indexed by name and id. The snapshot is stored in the disk cache
+    (when available) and reused until it expires.
+
+    :param neutron:  The neutron client (or a function that returns it,
+                     so the client is created only if it is needed).
+    :param networks: The names of the required networks.
+    :param routers:  The names of the required routers.
+    :param cache:    A :class:`cache.DiskCache` object (optional).
+    :param key:      The key used for the cache (it should identify the
+                     OpenStack endpoint and the credentials).
+    :param renew:    The function that renews the credentials after the
+                     token was rejected (optional).
+    """
+
+    NAMESPACE = "topology"
+
+    def __init__(self, neutron, networks, routers, cache=None, key=None,
+                 renew=None):
+        self._neutron = neutron
+        self._renew = renew
+        self._networks = sorted(networks)
+        self._routers = sorted(routers)
+        self._cache = cache
+        self._key = "%s|%s|%s" % (key, ",".join(self._networks),
+                                  ",".join(self._routers))
+        self._snapshot = None
+        self._index = {}
+
+    @property
+    def snapshot(self):
+        """The raw snapshot of the topology."""
+        if self._snapshot is None:
+            snapshot = None
+            if self._cache:
+                snapshot = self._cache.get(self.NAMESPACE, self._key)
+            if snapshot is None:
+                snapshot = self._fetch()
+                if self._cache:
+                    self._cache.set(self.NAMESPACE, self._key, snapshot)
+            self._snapshot = snapshot
+            self._build_index()
+        return self._snapshot
+
+    def _fetch(self):
+        """Get the required resources from the Neutron API."""
+        return _authorized(self._neutron, self._list, self._renew)
+
+    def _list(self, neutron):
+        """List the required resources with the received client."""
+        with api_call("neutron.list_networks"):
+            networks = neutron.list_networks(
+                name=self._networks).get("networks", [])
+        subnets = []
+        if networks:
+            with api_call("neutron.list_subnets"):
+                subnets = neutron.list_subnets(
+                    network_id=[network["id"] for network in networks]
+                ).get("subnets", [])
+        with api_call("neutron.list_routers"):
+            routers = neutron.list_routers(
+                name=self._routers).get("routers", [])
+        auth_info = neutron.get_auth_info()
+
+        return {
+            "networks": networks,
+            "subnets": subnets,
+            "routers": routers,
+            "tenant_id": auth_info.get("auth_tenant_id"),
+        }
+
+    def _build_index(self):
+        """Index the resources from the snapshot by name and id."""
+        self._index = {}
+        for resource in ("networks", "subnets", "routers"):
+            by_name, by_id = {}, {}
+            for item in self._snapshot.get(resource, []):
+                by_name.setdefault(item.get("name"), item)
+                by_id[item["id"]] = item
+            self._index[resource] = {"name": by_name, "id": by_id}
+
+    def _find(self, resource, name=None, resource_id=None):
+        """Return the resource with the received name or id."""
+        # Make sure that the snapshot is available
+        _ = self.snapshot
+        if resource_id is not None:
+            return self._index[resource]["id"].get(resource_id)
+        return self._index[resource]["name"].get(name)
+
+    @property
+    def tenant_id(self):
+        """The tenant id for the current user."""
+        return self.snapshot.get("tenant_id")
+
+    def network(self, name=None, network_id=None):
+        """Return the network with the received name or id."""
+        return self._find("networks", name, network_id)
+
+    def router(self, name=None, router_id=None):
+        """Return the router with the received name or id."""
+        return self._find("routers", name, router_id)
+
+    def subnets(self, network):
+        """Return the subnets of the received network."""
+        subnets = []
+        for subnet_id in network.get("subnets", []):
+            subnet = self._find("subnets", resource_id=subnet_id)
+            if subnet:
+                subnets.append(subnet)
+        return subnets
+
+    def cidr(self, network_name):
+        """Return the CIDR of the first subnet of the received network."""
+        network = self.network(network_name)
+        for subnet in self.subnets(network or {}):
+            if "cidr" in subnet:
+                return subnet["cidr"]
+        return None
+
+
+class ImageIndex(object):
+
+    """Find the images using the Glance API.
+
+    The images are filtered on the server side whenever possible and
+    listed page by page, stopping at the first match. The results are
+    stored in the disk cache (when available) for every pattern.
+
+    :param glance:    The glance client, API v2 (or a function that
+                      returns it, so the client is created only if it
+                      is needed).
+    :param cache:     A :class:`cache.DiskCache` object (optional).
+    :param key:       The key used for the cache (it should identify the
+                      OpenStack endpoint and the credentials).
+    :param page_size: How many images are requested at once.
+    :param renew:     The function that renews the credentials after the
+                      token was rejected (optional).
+    """
+
+    NAMESPACE = "images"
+    SPECIAL = frozenset(".^$*+?{}[]\\|()")
+
+    def __init__(self, glance, cache=None, key=None, page_size=100,
+                 renew=None):
+        self._glance = glance
+        self._cache = cache
+        self._key = key
+        self._page_size = page_size
+        self._renew = renew
+
+    def _images(self, glance, name=None):
+        """List the active images, page by page."""
+        filters = {"status": "active"}
+        if name is not None:
+            filters["name"] = name
+        return glance.images.list(filters=filters,
+                                  page_size=self._page_size,
+                                  sort_key="name", sort_dir="asc")
+
+    def _search(self, glance, pattern):
+        """Search the image with the received client."""
+        queries = [None]
+        if not any(char in self.SPECIAL for char in pattern):
+            # Literal pattern, try first to let the API do the filtering
+            queries.insert(0, pattern)
+
+        regexp = re.compile(pattern)
+        for name in queries:
+            with api_call("glance.images.list", name_filter=name) as details:
+                for image in self._images(glance, name):
+                    if regexp.match(image.get("name") or ""):
+                        details["found"] = image["name"]
+                        return {"id": image["id"], "name": image["name"]}
+        return None
+
+    def search(self, pattern):
+        """Return the first image whose name matches the received
+        pattern, without using the cache.
+        """
+        return _authorized(
+            self._glance, lambda glance: self._search(glance, pattern),
+            self._renew)
+
+    def find(self, pattern):
+        """Return the id of the first image whose name matches the
+        received pattern or None if there is no such image.
+        """
+        key = "%s|%s" % (self._key, pattern)
+        image = None
+        if self._cache:
+            image = self._cache.get(self.NAMESPACE, key)
+
+        if image is None:
+            image = self.search(pattern)
+            if image and self._cache:
+                self._cache.set(self.NAMESPACE, key, image)
+
+        return image["id"] if image else None
@@ -0,0 +1,201 @@
+"""
+Virtual environment pool:
+    Base virtual environments created ahead of time, ready to be
+    claimed by the builds.
+"""
+
+import fcntl
+import os
+import shutil
+import time
+import uuid
+
+from arestor.worker import environments
+from arestor.worker import util
+
+
+class EnvironmentPool(object):
+
+    """A pool of ready to use virtual environments.
+
+    Every environment is created (and has its pip upgraded) in the
+    pool directory and it is marked as ready only after all the steps
+    succeeded. A build claims an environment by moving it to its own
+    location, so claiming never blocks on the creation of a new one.
+
+    The pool is kept in the directory of the build environments, so
+    claiming one is a rename on the same file system.
+
+    ::
+        <root>/.pool/<user>-<python>/
+            <id>/           # the virtual environment
+            <id>.ready      # created once the environment is usable
+
+    :param root:    The directory that contains the build environments
+                    (and the pool).
+    :param user:    The owner of the virtual environments.
+    :param python:  The interpreter used by the virtual environments.
+    :param execute: A callable used for running the commands
+                    (see :meth:`worker.base.Command._execute`).
+    :param size:    How many ready environments should be available.
+    """
+
+    POOL = ".pool"
+    READY = ".ready"
+
+    def __init__(self, user, python, execute, size=0,
+                 root=environments.ROOT):
+        self._user = user
+        self._python = python
+        self._execute = execute
+        self._size = max(0, size or 0)
+        self._path = os.path.join(
+            root, self.POOL,
+            "%s-%s" % (user, os.path.basename(python)))
+
+    @property
+    def path(self):
+        """The directory that contains the environments."""
+        return self._path
+
+    @property
+    def size(self):
+        """How many ready environments should be available."""
+        return self._size
+
+    def _entries(self):
+        """Return the ready environments, the oldest first."""
+        try:
+            names = os.listdir(self._path)
+        except OSError:
+            return []
+
+        entries = []
+        for name in names:
+            if not name.endswith(self.READY):
+                continue
+            environment = os.path.join(self._path, name[:-len(self.READY)])
+            try:
+                created = os.path.getmtime(environment + self.READY)
+            except OSError:
+                continue
+            if os.path.isdir(environment):
+                entries.append((created, environment))
+        return [environment for _, environment in sorted(entries)]
+
+    def available(self):
+        """Return how many ready environments are in the pool."""
+        return len(self._entries())
+
+    def claim(self, target):
+        """Move a ready environment to the received location.
+
+        The environment stays in the pool if it can't be moved there.
+
+        :returns: True if an environment was claimed, False if the pool
+                  is empty (or the environment can't be moved there).
+        """
+        if not os.path.isdir(self._path):
+            return False
+
+        with util.file_lock(os.path.join(self._path, ".claim.lock")):
+            for environment in self._entries():
+                util.ensure_dir(os.path.dirname(target))
+                os.rename(environment, target)
+                os.remove(environment + self.READY)
+                self._relocate(environment, target)
+                return True
+        return False
+
+    @staticmethod
+    def _relocate(source, target):
+        """Replace the old location of the environment in the scripts
+        and in the symbolic links created by virtualenv.
+
+        The scripts are rewritten in place, so they keep their owner.
+        """
+        old, new = source.encode("utf-8"), target.encode("utf-8")
+        for directory, subdirectories, files in os.walk(target):
+            for name in subdirectories + files:
+                path = os.path.join(directory, name)
+                if os.path.islink(path):
+                    link = os.readlink(path)
+                    if link.startswith(source):
+                        os.remove(path)
+                        os.symlink(target + link[len(source):], path)
+                    continue
+
+                if os.path.basename(directory) != "bin" or name not in files:
+                    continue
+                with open(path, "r+b") as script:
+                    content = script.read()
+                    if old in content:
+                        script.seek(0)
+                        script.write(content.replace(old, new))
+                        script.truncate()
+
+    def _create(self):
+        """Create a new environment and mark it as ready."""
+        environment = os.path.join(self._path, uuid.uuid4().hex)
+        try:
+            self._execute(["sudo", "-u", self._user, "virtualenv",
+                           environment, "--python", self._python])
+            self._execute(["sudo", "-u", self._user,
+                           os.path.join(environment, "bin", "pip"),
+                           "install", "pip", "--upgrade"])
+        except Exception:
+            shutil.rmtree(environment, ignore_errors=True)
+            raise
+
+        with open(environment + self.READY, "w") as ready:
+            ready.write("%f\n" % time.time())
+        return environment
+
+    def _prepare(self):
+        """Create the pool directory, owned by the user of the pool."""
+        if os.path.isdir(self._path):
+            return
+        util.ensure_dir(self._path, user=self._user)
+
+    def _cleanup(self):
+        """Remove the environments left behind by interrupted fills
+        and the markers left behind by interrupted claims."""
+        for name in os.listdir(self._path):
+            path = os.path.join(self._path, name)
+            if name.startswith("."):
+                continue
+            if name.endswith(self.READY):
+                if not os.path.isdir(path[:-len(self.READY)]):
+                    os.remove(path)
+            elif (os.path.isdir(path) and
+                    not os.path.exists(path + self.READY)):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def fill(self):
+        """Create environments until the pool is full.
+
+        Only one process fills the pool at a time, the others return
+        without waiting for it.
+
+        :returns: How many environments were created.
+        """
+        if not self._size:
+            return 0
+
+        self._prepare()
+        lock_path = os.path.join(self._path, ".fill.lock")
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return 0
+
+            try:
+                self._cleanup()
+                created = 0
+                while self.available() < self._size:
+                    self._create()
+                    created += 1
+                return created
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,89 @@
+"""
+Verification probe:
+    Executed by the interpreter of a virtual environment in order to
+    check, at once, everything that was installed in it.
+
+The probe receives the checks as a JSON list and prints the results as
+a JSON object on the last line of its output. The source of this module
+is executed with `python -c`, by the Python version of the virtual
+environment (including 2.7), so it must not import anything from
+arestor.
+
+::
+    python -c "$(cat probe.py)" '[
+        {"check": "import", "name": "tempest"},
+        {"check": "version", "name": "six", "expected": "1.10.0"},
+        {"check": "file", "name": "/path/to/tempest.conf"}]'
+"""
+
+from __future__ import print_function
+
+import importlib
+import json
+import sys
+
+
+def _error(exc):
+    """Describe the received exception."""
+    return "%s: %s" % (type(exc).__name__, exc)
+
+
+def check_import(name):
+    """Import the received module."""
+    importlib.import_module(name)
+
+
+def check_version(name, expected=None):
+    """Check the version of the received distribution."""
+    import pkg_resources
+    version = pkg_resources.get_distribution(name).version
+    if expected is not None and version != expected:
+        raise ValueError("expected %s, found %s" % (expected, version))
+    return version
+
+
+def check_file(name):
+    """Check that the received file can be read."""
+    with open(name, "r") as handle:
+        handle.read()
+
+
+CHECKS = {
+    "import": check_import,
+    "version": check_version,
+    "file": check_file,
+}
+
+
+def run(checks):
+    """Run the received checks and return their results."""
+    results = []
+    for check in checks:
+        result = dict(check)
+        arguments = dict((key, value) for key, value in check.items()
+                         if key != "check")
+        try:
+            value = CHECKS[check["check"]](**arguments)
+        except Exception as exc:  # pylint: disable=broad-except
+            result.update({"ok": False, "error": _error(exc)})
+        else:
+            result["ok"] = True
+            if value is not None:
+                result["value"] = value
+        results.append(result)
+    return {"ok": all(result["ok"] for result in results),
+            "python": sys.version.split()[0], "results": results}
+
+
+def main(argv):
+    """Run the checks received on the command line."""
+    print(json.dumps(run(json.loads(argv[1])), sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    # The modules from the current directory (or from arestor, when
+    # the probe runs from a file) must not shadow the ones installed in
+    # the virtual environment.
+    del sys.path[0]
+    sys.exit(main(sys.argv))
@@ -0,0 +1,211 @@
+"""
+Retry policies:
+    Decide if a failed command is worth retrying and how long to
+    wait before the next attempt.
+"""
+
+import abc
+import random
+import re
+
+RETRY = True
+FAIL = False
+
+
+class Classifier(object, metaclass=abc.ABCMeta):
+
+    """Contract class for all the failure classifiers.
+
+    A classifier receives the error raised by a failed attempt and
+    returns `RETRY`, `FAIL` or None if it can't decide.
+    """
+
+    def __call__(self, error):
+        return self.classify(error)
+
+    @abc.abstractmethod
+    def classify(self, error):
+        """Classify the received :class:`subprocess.CalledProcessError`."""
+        pass
+
+
+class ExitCodeClassifier(Classifier):
+
+    """Classify the failures using the exit code of the process."""
+
+    def __init__(self, codes, decision=RETRY):
+        self._codes = frozenset(codes)
+        self._decision = decision
+
+    def classify(self, error):
+        """Classify the received :class:`subprocess.CalledProcessError`."""
+        if error.returncode in self._codes:
+            return self._decision
+        return None
+
+
+class OutputClassifier(Classifier):
+
+    """Classify the failures using the output of the process."""
+
+    def __init__(self, patterns, decision=RETRY):
+        self._regexp = re.compile("|".join(
+            "(?:%s)" % pattern for pattern in patterns))
+        self._decision = decision
+
+    @staticmethod
+    def _output(error):
+        """Return the output attached to the received error as text."""
+        output = error.output
+        if not isinstance(output, (tuple, list)):
+            output = (output, )
+
+        chunks = []
+        for chunk in output:
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode("utf-8", "replace")
+            chunks.append(chunk or "")
+        return "\n".join(chunks)
+
+    def classify(self, error):
+        """Classify the received :class:`subprocess.CalledProcessError`."""
+        if self._regexp.search(self._output(error)):
+            return self._decision
+        return None
+
+
+class TimeoutClassifier(Classifier):
+
+    """Retry the attempts stopped because they timed out (the errors
+    with a `timeout` attribute, see :class:`engine.CommandTimeout`)."""
+
+    def __init__(self, decision=RETRY):
+        self._decision = decision
+
+    def classify(self, error):
+        """Classify the received :class:`subprocess.CalledProcessError`."""
+        if getattr(error, "timeout", None) is not None:
+            return self._decision
+        return None
+
+
+TIMEOUT = TimeoutClassifier()
+
+APT_LOCK = OutputClassifier([
+    r"Could not get lock",
+    r"Unable to lock the (administration|download) directory",
+    r"Unable to acquire the dpkg frontend lock",
+])
+
+NETWORK_ERROR = OutputClassifier([
+    r"Connection reset by peer",
+    r"Connection (timed out|refused|aborted)",
+    r"Temporary failure (in name resolution|resolving)",
+    r"Could not resolve host",
+    r"Failed to fetch",
+    r"(ReadTimeout|ConnectTimeout|ProtocolError|NewConnectionError)",
+    r"The remote end hung up unexpectedly",
+    r"early EOF",
+    r"RPC failed",
+])
+
+
+class RetryPolicy(object):
+
+    """Exponential backoff with jitter, bounded by a total time budget.
+
+    :param attempts:    How many times to try running the command.
+    :param interval:    The interval before the first retry, in seconds.
+    :param backoff:     The factor used to increase the interval after
+                        every attempt.
+    :param max_interval: The upper limit for the interval between attempts.
+    :param jitter:      The fraction of the interval that is randomized
+                        in order to spread the retries.
+    :param budget:      The total time, in seconds, that can be spent
+                        on a command (None for no limit).
+    :param classifiers: A list of classifiers used in order to decide if
+                        a failure is worth retrying.
+    :param default:     What to do when no classifier can decide.
+
+    The attempts and the interval can be left unset and filled in later
+    with the values received from the command line (see :meth:`bind`).
+    """
+
+    def __init__(self, attempts=None, interval=None, backoff=1.0,
+                 max_interval=None, jitter=0.0, budget=None,
+                 classifiers=(), default=RETRY):
+        self.attempts = attempts
+        self.interval = interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.budget = budget
+        self.classifiers = tuple(classifiers)
+        self.default = default
+
+    def bind(self, attempts, interval):
+        """Return a copy of the current policy with the missing attempts
+        and interval filled in with the received values.
+        """
+        policy = RetryPolicy(
+            attempts=attempts if self.attempts is None else self.attempts,
+            interval=interval if self.interval is None else self.interval,
+            backoff=self.backoff, max_interval=self.max_interval,
+            jitter=self.jitter, budget=self.budget,
+            classifiers=self.classifiers, default=self.default)
+        return policy
+
+    def classify(self, error):
+        """Check if the received error is worth retrying."""
+        for classifier in self.classifiers:
+            decision = classifier(error)
+            if decision is not None:
+                return decision
+        return self.default
+
+    def delay(self, attempt):
+        """Return the interval to wait after the received attempt."""
+        delay = (self.interval or 0) * self.backoff ** (attempt - 1)
+        if self.max_interval is not None:
+            delay = min(delay, self.max_interval)
+        if self.jitter:
+            spread = delay * self.jitter
+            delay = random.uniform(delay - spread, delay + spread)
+        return max(delay, 0)
+
+    def next_delay(self, attempt, error, elapsed):
+        """Decide what to do after a failed attempt.
+
+        :param attempt: The number of the attempt that failed (from 1).
+        :param error:   The :class:`subprocess.CalledProcessError` raised.
+        :param elapsed: The time spent on the command, in seconds.
+
+        :returns: The interval to wait before the next attempt or None
+                  if the command should not be retried.
+        """
+        if attempt >= (self.attempts or 1):
+            return None
+        if not self.classify(error):
+            return None
+
+        delay = self.delay(attempt)
+        if self.budget is not None and elapsed + delay > self.budget:
+            return None
+        return delay
+
+
+# Package managers: retry on lock contention, network failures and
+# timeouts. The tasks that use the policies limit their commands to a
+# fraction of the budget (see `Command.TIMEOUT`), otherwise a timed
+# out attempt would leave no budget for retrying it.
+APT_POLICY = RetryPolicy(interval=2, backoff=2, max_interval=60, jitter=0.5,
+                         budget=1800,
+                         classifiers=(TIMEOUT, APT_LOCK, NETWORK_ERROR),
+                         default=FAIL)
+
+# Installs from remote repositories: retry only on network failures
+# (a stuck download usually ends with a timeout).
+NETWORK_POLICY = RetryPolicy(interval=1, backoff=2, max_interval=30,
+                             jitter=0.5, budget=3600,
+                             classifiers=(TIMEOUT, NETWORK_ERROR),
+                             default=FAIL)
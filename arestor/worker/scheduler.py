@@ -0,0 +1,191 @@
+"""
+Task scheduler:
+    Run the commands in the order required by their dependencies,
+    executing the independent ones at the same time.
+"""
+
+import queue
+import threading
+
+from arestor.worker import engine
+
+
+class Scheduler(object):
+
+    """Run a set of commands on a bounded pool of workers.
+
+    Every command declares the commands it depends on through the
+    `DEPENDS` class attribute. A command is started only after all
+    of its dependencies finished successfully. When a command fails,
+    all the commands that depend on it (directly or not) are cancelled.
+
+    ::
+    Example:
+    ::
+        scheduler = Scheduler(executor, workers=2)
+        scheduler.add(command.CreateEnvironment)
+        scheduler.add(command.InstallTempest)
+        scheduler.add(command.InstallArgusCi)
+        status = scheduler.run()
+    """
+
+    def __init__(self, executor, tasks=None, workers=1):
+        self._executor = executor
+        self._workers = max(1, workers or 1)
+        self._tasks = []
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+
+        self._done = set()
+        self._failed = set()
+        self._cancelled = set()
+
+        for task in tasks or ():
+            self.add(task)
+
+    @property
+    def logger(self):
+        """Expose the logger object."""
+        return self._executor.logger
+
+    @property
+    def done(self):
+        """The commands that successfully finished."""
+        return frozenset(self._done)
+
+    @property
+    def failed(self):
+        """The commands that failed."""
+        return frozenset(self._failed)
+
+    @property
+    def cancelled(self):
+        """The commands that were not executed because one of their
+        dependencies failed.
+        """
+        return frozenset(self._cancelled)
+
+    def add(self, task):
+        """Register a new command in the current scheduler."""
+        if task not in self._tasks:
+            self._tasks.append(task)
+
+    def _dependences(self, task):
+        """Return the dependences of the received command that are
+        handled by the current scheduler.
+        """
+        return [dependence for dependence in task.DEPENDS
+                if dependence in self._tasks]
+
+    def _dependents(self, task):
+        """Return all the commands which depend (directly or not)
+        on the received command.
+        """
+        dependents, stack = set(), [task]
+        while stack:
+            current = stack.pop()
+            for candidate in self._tasks:
+                if candidate in dependents:
+                    continue
+                if current in self._dependences(candidate):
+                    dependents.add(candidate)
+                    stack.append(candidate)
+        return dependents
+
+    def _check(self):
+        """Check that the dependency graph does not contain cycles."""
+        visited, in_progress = set(), set()
+
+        def visit(task):
+            """Depth-first visit of the dependency graph."""
+            if task in in_progress:
+                raise ValueError("Circular dependency detected for %(task)s"
+                                 % {"task": task.__name__})
+            if task in visited:
+                return
+            in_progress.add(task)
+            for dependence in self._dependences(task):
+                visit(dependence)
+            in_progress.remove(task)
+            visited.add(task)
+
+        for task in self._tasks:
+            visit(task)
+
+    def _ready(self, pending):
+        """Return the pending commands that can be started."""
+        return [task for task in self._tasks if task in pending and
+                all(dependence in self._done
+                    for dependence in self._dependences(task))]
+
+    def _worker(self):
+        """Process the commands received from the scheduler."""
+        while True:
+            task = self._jobs.get()
+            if task is None:
+                break
+
+            try:
+                instance = task(self._executor)
+                result = instance.run()
+                error = instance.error
+            except Exception as exc:
+                result, error = None, exc
+                self.logger.error("Task %s failed: %s", task.__name__, exc)
+            self._results.put((task, error, result))
+
+    def run(self):
+        """Run all the registered commands.
+
+        :returns: True if all the commands successfully finished.
+        """
+        self._check()
+        self._done.clear()
+        self._failed.clear()
+        self._cancelled.clear()
+
+        threads = []
+        for _ in range(min(self._workers, len(self._tasks))):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        pending = set(self._tasks)
+        running = 0
+        try:
+            while pending or running:
+                for task in self._ready(pending):
+                    pending.remove(task)
+                    running += 1
+                    self.logger.debug("Scheduling task %s", task.__name__)
+                    self._jobs.put(task)
+
+                if not running:
+                    # Nothing can be started anymore.
+                    break
+
+                task, error, _ = self._results.get()
+                running -= 1
+                if error is None:
+                    self._done.add(task)
+                    continue
+
+                self._failed.add(task)
+                for dependent in self._dependents(task) & pending:
+                    self.logger.warning("Task %s cancelled: %s failed.",
+                                        dependent.__name__, task.__name__)
+                    pending.remove(dependent)
+                    self._cancelled.add(dependent)
+        except (KeyboardInterrupt, SystemExit):
+            # The workers wait for their child processes, which run in
+            # their own sessions and didn't receive the signal.
+            engine.kill_children()
+            raise
+        finally:
+            for _ in threads:
+                self._jobs.put(None)
+            for thread in threads:
+                thread.join()
+
+        return not (self._failed or self._cancelled)
@@ -0,0 +1,132 @@
+"""
+Config templates:
+    Compile the INI templates (like tempest.conf) once and render
+    them using the received values.
+"""
+
+import os
+import threading
+
+from arestor.worker import util
+
+_COMPILED = {}
+_COMPILED_LOCK = threading.Lock()
+
+
+class ConfigTemplate(object):
+
+    """A compiled INI template.
+
+    The template is split in literal chunks and substitution slots
+    (section, key, default value). The values used for rendering can
+    be keyed by `key` or, for a specific section, by `section.key`.
+
+    :param tokens:  A list of literal strings and [section, key, default]
+                    slots, as returned by :meth:`parse`.
+    """
+
+    NAMESPACE = "templates"
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+
+    @property
+    def tokens(self):
+        """The compiled form of the template."""
+        return self._tokens
+
+    @property
+    def slots(self):
+        """The (section, key) pairs that can be replaced."""
+        return [(token[0], token[1]) for token in self._tokens
+                if not isinstance(token, str)]
+
+    @staticmethod
+    def parse(content):
+        """Split the received template in literal chunks and slots."""
+        tokens, literal, section = [], [], None
+        for line in content.splitlines(True):
+            stripped = line.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                section = stripped[1:-1].strip()
+
+            key, separator, value = line.partition("=")
+            if (not separator or stripped.startswith(("#", ";")) or
+                    section is None):
+                literal.append(line)
+                continue
+
+            if literal:
+                tokens.append("".join(literal))
+                literal = []
+            ending = line[len(line.rstrip("\r\n")):]
+            tokens.append([section, key.strip(), value.strip()])
+            tokens.append(ending)
+
+        if literal:
+            tokens.append("".join(literal))
+        return tokens
+
+    @classmethod
+    def compile(cls, path, cache=None):
+        """Return the compiled template for the received file.
+
+        The compiled form is kept in memory for the current process and,
+        if a cache is available, on disk for the next invocations. It is
+        invalidated when the template file changes.
+        """
+        stat = os.stat(path)
+        key = "%s|%s|%s" % (os.path.abspath(path), stat.st_mtime, stat.st_size)
+        with _COMPILED_LOCK:
+            template = _COMPILED.get(key)
+        if template is not None:
+            return template
+
+        tokens = cache.get(cls.NAMESPACE, key) if cache else None
+        if tokens is None:
+            with open(path, "r") as template_file:
+                tokens = cls.parse(template_file.read())
+            if cache:
+                cache.set(cls.NAMESPACE, key, tokens)
+
+        template = cls(tokens)
+        with _COMPILED_LOCK:
+            _COMPILED[key] = template
+        return template
+
+    def render(self, values):
+        """Replace the slots with the received values.
+
+        The slots without a value (or with None) keep the value from
+        the template.
+        """
+        chunks = []
+        for token in self._tokens:
+            if isinstance(token, str):
+                chunks.append(token)
+                continue
+
+            section, key, default = token
+            value = values.get("%s.%s" % (section, key), values.get(key))
+            if value is None:
+                value = default
+            chunks.append("%s = %s" % (key, value))
+        return "".join(chunks)
+
+    def write(self, path, values, mode=None):
+        """Render the template in the received file.
+
+        The file is replaced atomically and only if its content changed.
+
+        :returns: True if the file was written.
+        """
+        content = self.render(values).encode("utf-8")
+        try:
+            with open(path, "rb") as config_file:
+                if config_file.read() == content:
+                    return False
+        except (IOError, OSError):
+            pass
+
+        util.atomic_write(path, content, mode=mode)
+        return True
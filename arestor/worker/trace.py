@@ -0,0 +1,150 @@
+"""
+Tracing:
+    Record how long the tasks, the child processes and the API calls
+    take, in the Chrome trace event format (chrome://tracing, Perfetto
+    or speedscope can be used for viewing the trace).
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+
+from arestor.worker import util
+
+_TRACER = None
+_TRACER_LOCK = threading.Lock()
+
+
+class Tracer(object):
+
+    """Collect the spans recorded by the current process.
+
+    The spans are kept in memory and written to the trace file by
+    :meth:`flush`. When the tracer has no file all the spans are
+    ignored, so the instrumented code pays almost nothing for them.
+
+    :param path:    The file where the trace events are written.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._events = []
+        self._threads = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @property
+    def path(self):
+        """The file where the trace events are written."""
+        return self._path
+
+    @property
+    def enabled(self):
+        """Whether the spans are recorded or not."""
+        return bool(self._path)
+
+    @staticmethod
+    def _now():
+        """The current time, in microseconds."""
+        return time.time() * 1e6
+
+    def _add(self, event):
+        """Record a new trace event."""
+        thread = threading.current_thread()
+        event.setdefault("pid", self._pid)
+        event.setdefault("tid", thread.ident)
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self._events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, category="arestor", **details):
+        """Record the time spent in the body of the `with` statement.
+
+        The spans from the same thread are nested. The yielded dictionary
+        can be updated with details which are known only at the end of
+        the span (like the exit code of a process).
+        """
+        if not self.enabled:
+            yield details
+            return
+
+        started = self._now()
+        try:
+            yield details
+        except Exception as exc:
+            details["error"] = str(exc)
+            raise
+        finally:
+            self._add({"name": name, "cat": category, "ph": "X",
+                       "ts": started, "dur": self._now() - started,
+                       "args": details})
+
+    @contextlib.contextmanager
+    def async_span(self, name, category="arestor", **details):
+        """Record a span which can overlap with the other spans from
+        the current thread (like the coroutines from the event loop).
+        """
+        if not self.enabled:
+            yield details
+            return
+
+        span_id = next(self._ids)
+        self._add({"name": name, "cat": category, "ph": "b",
+                   "id": span_id, "ts": self._now(), "args": {}})
+        try:
+            yield details
+        except Exception as exc:
+            details["error"] = str(exc)
+            raise
+        finally:
+            self._add({"name": name, "cat": category, "ph": "e",
+                       "id": span_id, "ts": self._now(), "args": details})
+
+    def flush(self):
+        """Write all the recorded events to the trace file."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            events = [{"name": "thread_name", "ph": "M", "pid": self._pid,
+                       "tid": ident, "args": {"name": name}}
+                      for ident, name in self._threads.items()]
+            events.extend(self._events)
+
+        util.atomic_write(self._path, json.dumps(
+            {"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+def get_tracer():
+    """Return the tracer used by the current process."""
+    global _TRACER  # pylint: disable=global-statement
+    with _TRACER_LOCK:
+        if _TRACER is None:
+            _TRACER = Tracer()
+    return _TRACER
+
+
+def configure(path):
+    """Start recording the spans of the current process in the
+    received file.
+
+    :returns: The new tracer.
+    """
+    global _TRACER  # pylint: disable=global-statement
+    with _TRACER_LOCK:
+        _TRACER = Tracer(path)
+    return _TRACER
+
+
+def finish():
+    """Write the trace file and stop recording the spans."""
+    global _TRACER  # pylint: disable=global-statement
+    with _TRACER_LOCK:
+        tracer, _TRACER = _TRACER, None
+    if tracer:
+        tracer.flush()
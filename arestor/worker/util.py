@@ -0,0 +1,157 @@
+"""Various helpers shared by the workers."""
+
+import contextlib
+import fcntl
+import importlib
+import os
+import shutil
+import stat
+import tempfile
+import uuid
+
+
+class LazyModule(object):
+
+    """A module imported the first time one of its attributes is used.
+
+    Used for the expensive modules (like the OpenStack clients) which
+    are required only by some of the commands, so the other commands
+    don't pay for importing them.
+
+    :param name:    The full name of the module.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return "<LazyModule %r (%s)>" % (
+            self._name, "loaded" if self._module else "not loaded")
+
+
+def ensure_dir(path, user=None):
+    """Create the received directory if it is missing.
+
+    :param path:    The path of the directory.
+    :param user:    The owner of the directory, for the directories
+                    where the commands executed as another user (with
+                    `sudo -u`) write. (Default: the current user)
+    """
+    if not path:
+        return
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # The directory was created by a concurrent process
+            if not os.path.isdir(path):
+                raise
+    if user and user != "root":
+        shutil.chown(path, user=user)
+
+
+def check_private_dir(path):
+    """Create the received directory if it is missing and check that
+    no other user can change its content.
+
+    The directories shared by the builds (like the cache) contain
+    artifacts which are installed without any other check, so they
+    must not be writable by other users.
+
+    :raises: ValueError if the directory is owned by another user or
+             if it can be written by the group or by the other users.
+    """
+    ensure_dir(path)
+    details = os.stat(path)
+    if details.st_uid not in (0, os.geteuid()):
+        raise ValueError("%(path)s is owned by another user (uid %(uid)d)."
+                         % {"path": path, "uid": details.st_uid})
+    if details.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise ValueError("%(path)s can be written by other users (mode "
+                         "%(mode)o)." % {"path": path,
+                                         "mode": details.st_mode & 0o7777})
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """Hold an advisory lock on the received file.
+
+    :param path:    The path of the lock file (created if it is missing).
+    :param shared:  Acquire a shared lock instead of an exclusive one.
+    """
+    ensure_dir(os.path.dirname(path))
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write(path, data, mode=None):
+    """Write the received data in a temporary file and move it in
+    place, so the readers never see a partially written file.
+
+    :param path:    The path of the file.
+    :param data:    The content of the file (bytes or text).
+    :param mode:    The permissions for the new file. (Default: the
+                    permissions of the existing file or 0644)
+    """
+    directory = os.path.dirname(path) or "."
+    ensure_dir(directory)
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=directory, prefix=".%s." % os.path.basename(path))
+    try:
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if mode is None:
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except OSError:
+                mode = 0o644
+        os.chmod(temp_path, mode)
+        os.rename(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def publish_dir(path, build, user=None):
+    """Create the received directory with the `build` function, unless
+    it already exists.
+
+    The directory is built in a private location and published with an
+    atomic rename, so the concurrent builds never see partial results.
+
+    :param path:    The path of the directory.
+    :param build:   A function that fills in the directory it receives.
+    :param user:    The owner of the parent directory, when the build
+                    runs as another user (see :func:`ensure_dir`).
+    :returns: True if the directory already existed, False otherwise.
+    """
+    if os.path.isdir(path):
+        return True
+
+    ensure_dir(os.path.dirname(path), user=user)
+    staging = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+    try:
+        build(staging)
+        os.rename(staging, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+        # Another build published the same directory
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return False
@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+"""
+Fake tool:
+    Stand-in for sudo, apt-get, git, pip, python and virtualenv used by
+    the benchmarks. The tool is selected by the name of the link used
+    for running it.
+
+The behaviour is controlled through the environment:
+
+    ARESTOR_FAKE_LATENCY        How long every call takes, in seconds.
+    ARESTOR_FAKE_LINES          How many lines of output every call prints.
+    ARESTOR_FAKE_FAILURE_RATE   The probability of a call to fail (0 - 1).
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import random
+import sys
+import time
+
+SHA = "0123456789abcdef0123456789abcdef01234567"
+
+
+def _sudo(arguments):
+    """Run the command as if it was run by another user."""
+    if arguments[:1] == ["-u"]:
+        arguments = arguments[2:]
+    if not arguments:
+        return 1
+    sys.stdout.flush()
+    os.execvp(arguments[0], arguments)
+
+
+def _virtualenv(arguments):
+    """Create a directory that looks like a virtual environment."""
+    if not arguments or arguments[0].startswith("-"):
+        # Probably `virtualenv --version`
+        return 0
+    target = os.path.join(arguments[0], "bin")
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    tool = os.path.realpath(__file__)
+    for name in ("python", "pip"):
+        link = os.path.join(target, name)
+        if not os.path.lexists(link):
+            os.symlink(tool, link)
+    return 0
+
+
+def _git(arguments):
+    """Pretend to clone, fetch and resolve references."""
+    while arguments and arguments[0] in ("--git-dir", "-C"):
+        arguments = arguments[2:]
+    if not arguments:
+        return 1
+
+    action = arguments[0]
+    if action == "clone":
+        target = arguments[-1]
+        if not os.path.isdir(target):
+            os.makedirs(target)
+    elif action == "ls-remote":
+        for reference in arguments[2:]:
+            print("%s\trefs/heads/%s" % (SHA, reference))
+    elif action == "rev-parse":
+        print(SHA)
+    return 0
+
+
+# The options of pip followed by a value
+PIP_OPTIONS = ("--wheel-dir", "--find-links", "--constraint", "-c")
+# The distributions installed in a fake virtual environment
+INSTALLED = "installed.json"
+
+
+def _environment():
+    """Return the virtual environment of the tool (`<venv>/bin/pip`)."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))
+
+
+def _installed(environment):
+    """Return the distributions installed in the received environment."""
+    try:
+        with open(os.path.join(environment, INSTALLED), "r") as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _option(arguments, *names):
+    """Return the values of the received pip option."""
+    return [arguments[index + 1] for index, argument in enumerate(arguments)
+            if argument in names and index + 1 < len(arguments)]
+
+
+def _requirements(arguments):
+    """Return the (name, version) of every requirement received by pip.
+
+    The pinned requirements and the wheels keep their versions, the
+    other sources are named after their last path component.
+    """
+    requirements, skip = [], False
+    for argument in arguments[1:]:
+        if skip or argument.startswith("-"):
+            skip = argument in PIP_OPTIONS
+            continue
+        if "==" in argument:
+            requirements.append(tuple(argument.split("==", 1)))
+        elif argument.endswith(".whl"):
+            requirements.append(tuple(
+                os.path.basename(argument).split("-")[:2]))
+        else:
+            source = argument.rsplit("@", 1)[0].rstrip("/")
+            name = os.path.basename(source).replace(".git", "")
+            requirements.append((name.replace("-", "_"), "0.1"))
+    return requirements
+
+
+def _constraints(arguments):
+    """Return the versions pinned by the constraint files."""
+    pins = []
+    for path in _option(arguments, "-c", "--constraint"):
+        with open(path, "r") as constraints:
+            pins.extend(tuple(line.strip().split("==", 1))
+                        for line in constraints
+                        if "==" in line and not line.startswith("#"))
+    return pins
+
+
+def _pip(arguments):
+    """Pretend to build wheels and install packages.
+
+    Every requirement gets its own wheel. When the dependencies are
+    resolved a wheel is added for them too (or the ones pinned by the
+    constraint files). The installed distributions are recorded in the
+    virtual environment, for the verification probe.
+    """
+    requirements = _requirements(arguments)
+    if "--no-deps" not in arguments:
+        requirements.extend(_constraints(arguments) or [("fakedep", "1.0")])
+
+    if arguments[:1] == ["install"]:
+        environment = _environment()
+        installed = _installed(environment)
+        installed.update(dict(requirements))
+        with open(os.path.join(environment, INSTALLED), "w") as handle:
+            json.dump(installed, handle)
+    elif arguments[:1] == ["wheel"] and "--wheel-dir" in arguments:
+        wheelhouse = _option(arguments, "--wheel-dir")[0]
+        if not os.path.isdir(wheelhouse):
+            os.makedirs(wheelhouse)
+        for name, version in requirements:
+            open(os.path.join(wheelhouse, "%s-%s-py2.py3-none-any.whl" %
+                              (name, version)), "w").close()
+    return 0
+
+
+def _probe(check, installed):
+    """Run a check of the verification probe (the imports can't be
+    checked, they always pass)."""
+    if check["check"] == "file" and not os.path.isfile(check["name"]):
+        return "IOError: No such file: %s" % check["name"]
+    if check["check"] == "version":
+        version = installed.get(check["name"])
+        if version is None:
+            return "DistributionNotFound: %s" % check["name"]
+        if version != check.get("expected", version):
+            return "ValueError: expected %s, found %s" % (
+                check["expected"], version)
+    return None
+
+
+def _python(arguments):
+    """Answer the verification probe using the distributions recorded
+    by the fake pip."""
+    if arguments[:1] == ["-c"] and len(arguments) > 2:
+        installed = _installed(_environment())
+        results = []
+        for check in json.loads(arguments[2]):
+            result = dict(check, ok=True)
+            error = _probe(check, installed)
+            if error:
+                result.update({"ok": False, "error": error})
+            results.append(result)
+        print(json.dumps({"ok": all(result["ok"] for result in results),
+                          "python": "2.7", "results": results}))
+    return 0
+
+
+TOOLS = {
+    "sudo": _sudo,
+    "python": _python,
+    "virtualenv": _virtualenv,
+    "git": _git,
+    "pip": _pip,
+}
+
+
+def main():
+    """Simulate the tool selected by the name of the link."""
+    name = os.path.basename(sys.argv[0])
+    arguments = sys.argv[1:]
+    if name == "sudo":
+        return _sudo(arguments)
+
+    time.sleep(float(os.environ.get("ARESTOR_FAKE_LATENCY", 0)))
+    # The output of git is parsed, so its progress goes to stderr
+    output = sys.stderr if name == "git" else sys.stdout
+    for index in range(int(os.environ.get("ARESTOR_FAKE_LINES", 0))):
+        print("%s: output line %d" % (name, index), file=output)
+
+    if random.random() < float(os.environ.get("ARESTOR_FAKE_FAILURE_RATE",
+                                              0)):
+        print("%s: simulated failure" % name, file=sys.stderr)
+        return 1
+
+    return TOOLS.get(name, lambda arguments: 0)(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
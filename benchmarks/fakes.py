@@ -0,0 +1,158 @@
+"""
+Fakes:
+    Stand-ins for the external tools and the OpenStack APIs, used for
+    benchmarking arestor without a real machine or cloud.
+"""
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+FAKE_TOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "fake_tool.py")
+TOOLS = ("apt-get", "dpkg-query", "git", "pip", "python", "sudo",
+         "virtualenv")
+
+
+class FakeTools(object):
+
+    """A directory with fake tools which is added in front of $PATH.
+
+    :param latency:      How long every call takes, in seconds.
+    :param lines:        How many lines of output every call prints.
+    :param failure_rate: The probability of a call to fail (0 - 1).
+    """
+
+    def __init__(self, latency=0.0, lines=0, failure_rate=0.0):
+        self._settings = {
+            "ARESTOR_FAKE_LATENCY": str(latency),
+            "ARESTOR_FAKE_LINES": str(lines),
+            "ARESTOR_FAKE_FAILURE_RATE": str(failure_rate),
+        }
+        self._root = None
+        self._environment = None
+
+    @property
+    def root(self):
+        """The directory which contains the fake tools."""
+        return self._root
+
+    def __enter__(self):
+        self._root = tempfile.mkdtemp(prefix="arestor-bench-")
+        tool = os.path.join(self._root, "fake_tool.py")
+        with open(FAKE_TOOL, "r") as source:
+            lines = source.readlines()
+        with open(tool, "w") as target:
+            # Use the current interpreter for the fake tools
+            target.write("#! %s\n" % sys.executable)
+            target.writelines(lines[1:])
+        os.chmod(tool, os.stat(tool).st_mode | stat.S_IXUSR)
+
+        bin_dir = os.path.join(self._root, "bin")
+        os.makedirs(bin_dir)
+        for name in TOOLS:
+            os.symlink(tool, os.path.join(bin_dir, name))
+
+        self._environment = dict(os.environ)
+        os.environ.update(self._settings)
+        os.environ["PATH"] = os.pathsep.join(
+            [bin_dir, os.environ.get("PATH", "")])
+        return self
+
+    def __exit__(self, *exc_info):
+        os.environ.clear()
+        os.environ.update(self._environment)
+        shutil.rmtree(self._root, ignore_errors=True)
+
+
+class FakeNeutron(object):
+
+    """In-process stand-in for the Neutron client.
+
+    :param latency: How long every API call takes, in seconds.
+    """
+
+    def __init__(self, latency=0.0):
+        self._latency = latency
+        self.calls = 0
+        self._networks = [{"id": "net-public", "name": "public",
+                           "subnets": ["subnet-public"]}]
+        self._subnets = [{"id": "subnet-public", "name": "public-subnet",
+                          "network_id": "net-public",
+                          "cidr": "172.24.4.0/24"}]
+        self._routers = [{"id": "router-1", "name": "router1"}]
+
+    def _call(self):
+        """Simulate the latency of an API call."""
+        self.calls += 1
+        time.sleep(self._latency)
+
+    def list_networks(self, name=None):
+        """List the networks with the received names."""
+        self._call()
+        return {"networks": [network for network in self._networks
+                             if name is None or network["name"] in name]}
+
+    def list_subnets(self, network_id=None):
+        """List the subnets of the received networks."""
+        self._call()
+        return {"subnets": [subnet for subnet in self._subnets
+                            if network_id is None or
+                            subnet["network_id"] in network_id]}
+
+    def list_routers(self, name=None):
+        """List the routers with the received names."""
+        self._call()
+        return {"routers": [router for router in self._routers
+                            if name is None or router["name"] in name]}
+
+    @staticmethod
+    def get_auth_info():
+        """Return the details of the current token."""
+        return {"auth_tenant_id": "tenant-benchmark"}
+
+
+class FakeImages(object):
+
+    """The images API of :class:`FakeGlance`."""
+
+    def __init__(self, glance, count):
+        self._glance = glance
+        self._images = [{"id": "image-%05d" % index,
+                         "name": "image-%05d" % index}
+                        for index in range(count)]
+        self._images.append({"id": "image-argus", "name": "argus-ci"})
+        self._images.sort(key=lambda image: image["name"])
+
+    def list(self, filters=None, page_size=100, **_):
+        """List the images, page by page."""
+        name = (filters or {}).get("name")
+        images = [image for image in self._images
+                  if name is None or image["name"] == name]
+        for start in range(0, len(images), page_size):
+            self._glance.call()
+            for image in images[start:start + page_size]:
+                yield image
+
+
+class FakeGlance(object):
+
+    """In-process stand-in for the Glance client (API v2).
+
+    :param latency: How long every page takes, in seconds.
+    :param images:  How many images are available (besides the one
+                    used by argus).
+    """
+
+    def __init__(self, latency=0.0, images=100):
+        self._latency = latency
+        self.calls = 0
+        self.images = FakeImages(self, images)
+
+    def call(self):
+        """Simulate the latency of an API call."""
+        self.calls += 1
+        time.sleep(self._latency)
@@ -0,0 +1,178 @@
+"""
+Benchmark harness:
+    Run an operation under a configurable load and report the
+    throughput and the latency percentiles.
+"""
+
+import concurrent.futures
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+# pylint: disable=wrong-import-position
+from arestor.worker.history import percentile          # noqa: E402
+
+
+class Result(object):
+
+    """The measurements of a benchmark run.
+
+    :param name:        The name of the benchmark.
+    :param parameters:  The load used for the run.
+    :param latencies:   How long every successful operation took.
+    :param errors:      How many operations failed.
+    :param elapsed:     How long the whole run took, in seconds.
+    """
+
+    def __init__(self, name, parameters, latencies, errors, elapsed):
+        self.name = name
+        self.parameters = parameters
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+
+    @property
+    def throughput(self):
+        """Successful operations per second."""
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        """Return the measurements as a dictionary."""
+        return {
+            "name": self.name,
+            "parameters": self.parameters,
+            "operations": len(self.latencies),
+            "errors": self.errors,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+            "p50": percentile(self.latencies, 0.50),
+            "p90": percentile(self.latencies, 0.90),
+            "p99": percentile(self.latencies, 0.99),
+            "max": self.latencies[-1] if self.latencies else None,
+        }
+
+
+def run(name, operation, iterations, concurrency=1, parameters=None,
+        warmup=1):
+    """Run the operation `iterations` times, on `concurrency` threads.
+
+    The operation receives the index of the iteration. The first
+    `warmup` iterations are executed before the measurements start.
+
+    :returns: A :class:`Result` object.
+    """
+    for index in range(warmup):
+        operation(-index - 1)
+
+    def _measure(index):
+        """Return how long the operation took (or None on failure)."""
+        started = time.time()
+        try:
+            operation(index)
+        except Exception:  # pylint: disable=broad-except
+            return None
+        return time.time() - started
+
+    parameters = dict(parameters or {})
+    parameters.update({"iterations": iterations,
+                       "concurrency": concurrency})
+    started = time.time()
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, concurrency)) as pool:
+        timings = list(pool.map(_measure, range(iterations)))
+    elapsed = time.time() - started
+
+    latencies = [timing for timing in timings if timing is not None]
+    return Result(name, parameters, latencies,
+                  errors=len(timings) - len(latencies), elapsed=elapsed)
+
+
+def _revision():
+    """Return the git revision of the benchmarked code."""
+    try:
+        with open(os.devnull, "wb") as devnull:
+            output = subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode("utf-8").strip()
+
+
+def _format(value, unit="s"):
+    """Format a measurement for the report."""
+    if value is None:
+        return "-"
+    if unit == "s":
+        return "%.1fms" % (value * 1000)
+    return "%.1f" % value
+
+
+def report(results, baseline=None):
+    """Print the received results, compared with the baseline (the
+    last recorded run of every benchmark with the same parameters).
+    """
+    baseline = baseline or {}
+    print("%-24s %8s %6s %10s %10s %10s %10s %10s" % (
+        "BENCHMARK", "OPS", "ERRORS", "OPS/S", "P50", "P90", "P99",
+        "VS BASE"))
+    for result in results:
+        summary = result.summary()
+        previous = baseline.get(_key(summary))
+        change = "-"
+        if previous and previous.get("p50") and summary["p50"]:
+            change = "%+.1f%%" % ((summary["p50"] / previous["p50"] - 1) *
+                                  100)
+        print("%-24s %8d %6d %10s %10s %10s %10s %10s" % (
+            summary["name"], summary["operations"], summary["errors"],
+            _format(summary["throughput"], unit=None),
+            _format(summary["p50"]), _format(summary["p90"]),
+            _format(summary["p99"]), change))
+
+
+def _key(summary):
+    """Return the key used for comparing the runs."""
+    return json.dumps([summary["name"], summary["parameters"]],
+                      sort_keys=True)
+
+
+def load(path):
+    """Return the last recorded run for every benchmark from the
+    received history file.
+    """
+    history = {}
+    try:
+        with open(path, "r") as history_file:
+            for line in history_file:
+                if line.strip():
+                    summary = json.loads(line)
+                    history[_key(summary)] = summary
+    except (IOError, OSError):
+        pass
+    return history
+
+
+def save(results, path):
+    """Append the received results to the history file (JSON lines),
+    together with the details required for comparing the runs.
+    """
+    metadata = {
+        "timestamp": time.time(),
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "host": socket.gethostname(),
+        "platform": sys.platform,
+    }
+    with open(path, "a") as history_file:
+        for result in results:
+            summary = result.summary()
+            summary.update(metadata)
+            history_file.write(json.dumps(summary, sort_keys=True) + "\n")
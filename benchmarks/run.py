@@ -0,0 +1,368 @@
+#! /usr/bin/env python3
+"""
+Benchmark suite:
+    Measure the orchestration overhead of arestor using fake tools
+    (sudo, apt-get, git, pip, virtualenv) and fake OpenStack clients.
+
+::
+    python benchmarks/run.py --iterations 50 --concurrency 4 \\
+        --latency 0.05 --history benchmarks.jsonl
+
+Every run is appended to the history file (when provided) and compared
+with the last run of the same benchmark, using the same parameters.
+"""
+
+import argparse
+import getpass
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import fake_tool
+import fakes
+import harness  # adds the repository to sys.path
+
+# pylint: disable=wrong-import-position
+from arestor.client import batch                       # noqa: E402
+from arestor.client import shell                       # noqa: E402
+from arestor.worker import base as worker_base         # noqa: E402
+from arestor.worker import command                     # noqa: E402
+from arestor.worker import retry                       # noqa: E402
+from arestor.worker import scheduler                   # noqa: E402
+
+TEMPLATE = os.path.join(harness.ROOT, "resources", "tempest.conf")
+
+
+class Probe(worker_base.Command):
+
+    """Command used for driving the execution engine."""
+
+    def _work(self):
+        """Nothing to do, the benchmarks call the helpers directly."""
+        pass
+
+
+class BenchEnvironment(command.CreateEnvironment):
+
+    """CreateEnvironment using the fake interpreter."""
+
+    PYTHON = "python"
+    REQUIRES = ("sudo", "virtualenv", PYTHON)
+
+
+class BenchTempest(command.InstallTempest):
+
+    """InstallTempest using the fake OpenStack clients."""
+
+    DEPENDS = (BenchEnvironment, )
+    MODULES = ()
+    NEUTRON = None
+    GLANCE = None
+    TEMPLATE = TEMPLATE
+
+    def __init__(self, executor):
+        super(BenchTempest, self).__init__(executor=executor)
+        self._neutron = self.NEUTRON
+        self._glance = self.GLANCE
+        self._template = self.TEMPLATE
+
+
+class BenchArgusCi(command.InstallArgusCi):
+
+    """InstallArgusCi using the fake interpreter."""
+
+    DEPENDS = (BenchEnvironment, )
+
+
+class BenchRequirements(command.InstallRequirements):
+
+    """InstallRequirements for the fake repositories."""
+
+    DEPENDS = (BenchTempest, BenchArgusCi)
+    REPOSITORIES = DEPENDS
+
+
+class BenchVerify(command.VerifyEnvironment):
+
+    """VerifyEnvironment for the fake installs."""
+
+    DEPENDS = (BenchRequirements, )
+    REPOSITORIES = (BenchTempest, BenchArgusCi, BenchRequirements)
+
+
+class RecordingBuild(batch.Build):
+
+    """A build which remembers the tasks skipped by the journal."""
+
+    def __init__(self, args, logger):
+        super(RecordingBuild, self).__init__(args, logger)
+        self.skipped = set()
+
+    def on_task_done(self, task, result):
+        """Record the tasks that were up to date."""
+        if task._skipped:  # pylint: disable=protected-access
+            self.skipped.add(type(task))
+        super(RecordingBuild, self).on_task_done(task, result)
+
+
+INSTALL_TASKS = (BenchEnvironment, BenchTempest, BenchArgusCi,
+                 BenchRequirements, BenchVerify)
+
+
+class Suite(object):
+
+    """The benchmarks that can be run by the suite.
+
+    :param args:    The parsed command line arguments.
+    """
+
+    def __init__(self, args):
+        self._args = args
+        self._root = tempfile.mkdtemp(prefix="arestor-bench-cache-")
+        self._logger = logging.getLogger("arestor.benchmark")
+        self._logger.addHandler(logging.NullHandler())
+        self._logger.propagate = False
+        self._builds = []
+
+        BenchTempest.NEUTRON = fakes.FakeNeutron(latency=args.api_latency)
+        BenchTempest.GLANCE = fakes.FakeGlance(latency=args.api_latency,
+                                               images=args.images)
+        # The rebuild benchmark changes the template
+        BenchTempest.TEMPLATE = os.path.join(self._root, "tempest.conf")
+        shutil.copyfile(TEMPLATE, BenchTempest.TEMPLATE)
+
+    def cleanup(self):
+        """Remove everything created by the benchmarks."""
+        for venv in self._builds:
+            shutil.rmtree(venv, ignore_errors=True)
+            for suffix in (".journal", ".journal.lock"):
+                if os.path.exists(venv + suffix):
+                    os.remove(venv + suffix)
+        shutil.rmtree(self._root, ignore_errors=True)
+
+    def build_args(self, build):
+        """Return the arguments used for the received build."""
+        if build:
+            self._builds.append(os.path.join("/tmp/argus-env", build))
+        return {
+            "build": build,
+            "user": getpass.getuser(),
+            "argus_branch": "master",
+            "tempest_branch": "tags/7",
+            "attempts": 1,
+            "retry_interval": 0,
+            "workers": self._args.workers,
+            "max_processes": self._args.max_processes,
+            "cache_dir": os.path.join(self._root, "cache"),
+            "cache_ttl": 300,
+            "refresh_cache": False,
+            "pool_size": 0,
+            "env_max_count": 0,
+            "env_max_size": 0,
+            "journal": True,
+        }
+
+    @staticmethod
+    def _build_name(benchmark, index):
+        """Return a unique build name for the received iteration."""
+        return "bench-%s-%d-%d" % (benchmark, os.getpid(), index + 10)
+
+    def execute(self):
+        """A single command, with the output collected in memory."""
+        probe = Probe(batch.Build(self.build_args(""), self._logger))
+        return lambda index: probe._execute(["pip", "--version"])
+
+    def execute_stream(self):
+        """A single command, with the output streamed line by line."""
+        probe = Probe(batch.Build(self.build_args(""), self._logger))
+        return lambda index: probe._execute(["pip", "install", "fake"],
+                                            stream=True)
+
+    def retry(self):
+        """The retry loop, with a failure rate of 50%."""
+        probe = Probe(batch.Build(self.build_args(""), self._logger))
+        environment = dict(os.environ, ARESTOR_FAKE_FAILURE_RATE="0.5")
+        policy = retry.RetryPolicy(attempts=20, interval=0)
+        return lambda index: probe._execute(
+            ["apt-get", "install", "-y", "fake"], retry_policy=policy,
+            env_variables=environment)
+
+    def _provision(self, args, tasks=INSTALL_TASKS):
+        """Run the task graph for the received build.
+
+        :returns: The :class:`RecordingBuild` and the status.
+        """
+        build = RecordingBuild(args, self._logger)
+        task_scheduler = scheduler.Scheduler(
+            executor=build, tasks=tasks, workers=self._args.workers)
+        return build, task_scheduler.run()
+
+    def install_argus(self):
+        """The whole InstallArgusCi task graph, for a new build."""
+        def _operation(index):
+            """Provision a new build."""
+            build, status = self._provision(
+                self.build_args(self._build_name("install", index)))
+            if not status:
+                raise RuntimeError("Build failed: %s" % build.failures)
+        return _operation
+
+    def rebuild(self):
+        """The task graph run again for an existing build, cycling
+        through three cases:
+
+        - nothing changed: the journal skips every task, except for
+          the verification.
+        - the template changed: InstallTempest runs again and writes
+          the new config file.
+        - a requirement was replaced: the verification fails.
+
+        The runs are serialized, they share the same build.
+        """
+        args = self.build_args(self._build_name("rebuild", 0))
+        build, status = self._provision(args)
+        if not status:
+            raise RuntimeError("Build failed: %s" % build.failures)
+        venv = self._builds[-1]
+        installed_file = os.path.join(venv, fake_tool.INSTALLED)
+        config_file = os.path.join(venv, "etc", "tempest.conf")
+        lock = threading.Lock()
+
+        def _unchanged(index):
+            """Run the build again, without changes."""
+            build, status = self._provision(args)
+            expected = set(INSTALL_TASKS) - {BenchVerify}
+            if not status or build.skipped != expected:
+                raise RuntimeError("The journal was not used: %s skipped, "
+                                   "%s" % (build.skipped, build.failures))
+
+        def _template(index):
+            """Run the build again, after the template changed."""
+            marker = "# rebuild %d\n" % index
+            with open(BenchTempest.TEMPLATE, "a") as template:
+                template.write(marker)
+            build, status = self._provision(args)
+            if not status or BenchTempest in build.skipped:
+                raise RuntimeError("The template change was not detected: "
+                                   "%s" % build.failures)
+            with open(config_file, "r") as config:
+                if marker not in config.read():
+                    raise RuntimeError("The config file was not updated.")
+
+        def _broken(index):
+            """Run the build again, with a replaced requirement."""
+            with open(installed_file, "r") as handle:
+                installed = json.load(handle)
+            with open(installed_file, "w") as handle:
+                json.dump(dict(installed, fakedep="0.0"), handle)
+            try:
+                build, status = self._provision(args)
+            finally:
+                with open(installed_file, "w") as handle:
+                    json.dump(installed, handle)
+            failed = [task for task, _ in build.failures]
+            if status or failed != [BenchVerify.__name__]:
+                raise RuntimeError("The verification did not fail: %s" %
+                                   build.failures)
+
+        cases = (_unchanged, _template, _broken)
+
+        def _operation(index):
+            """Run one of the cases against the existing build."""
+            with lock:
+                cases[index % len(cases)](index)
+        return _operation
+
+    def write_config(self):
+        """Render and write the tempest config file."""
+        def _operation(index):
+            """Write the config file for a new build."""
+            build = self.build_args(self._build_name("config", index))
+            task = BenchTempest(batch.Build(build, self._logger))
+            # pylint: disable=protected-access
+            os.makedirs(os.path.dirname(task._config_file))
+            task._write_config()
+        return _operation
+
+    @staticmethod
+    def cli():
+        """Build the command tree and parse a command line."""
+        def _operation(index):
+            """Parse a new command line."""
+            client = shell.ArestorClient(["install", "argus", "--build",
+                                          "bench-%d" % index])
+            client._prologue()  # pylint: disable=protected-access
+        return _operation
+
+
+BENCHMARKS = ("execute", "execute_stream", "retry", "install_argus",
+              "rebuild", "write_config", "cli")
+
+
+def main():
+    """Run the benchmark suite."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the arestor orchestration overhead.")
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help="The benchmarks to run: %s. (Default: all)"
+                        % ", ".join(BENCHMARKS))
+    parser.add_argument("--iterations", type=int, default=20,
+                        help="How many operations are measured. "
+                             "(Default: 20)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="How many operations run at the same time. "
+                             "(Default: 1)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="How long every fake tool call takes, in "
+                             "seconds. (Default: 0)")
+    parser.add_argument("--lines", type=int, default=100,
+                        help="How many output lines every fake tool call "
+                             "prints. (Default: 100)")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="How long every fake OpenStack call takes, "
+                             "in seconds. (Default: 0)")
+    parser.add_argument("--images", type=int, default=500,
+                        help="How many images the fake Glance has. "
+                             "(Default: 500)")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="The task scheduler workers. (Default: 2)")
+    parser.add_argument("--max-processes", type=int, default=8,
+                        help="The execution engine limit. (Default: 8)")
+    parser.add_argument("--history",
+                        help="Append the results to this JSON lines file "
+                             "and compare them with the previous run.")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % name)
+
+    parameters = {"latency": args.latency, "lines": args.lines,
+                  "api_latency": args.api_latency, "images": args.images,
+                  "workers": args.workers,
+                  "max_processes": args.max_processes}
+    baseline = harness.load(args.history) if args.history else {}
+
+    results = []
+    with fakes.FakeTools(latency=args.latency, lines=args.lines):
+        suite = Suite(args)
+        try:
+            for name in args.benchmarks or BENCHMARKS:
+                operation = getattr(suite, name)()
+                results.append(harness.run(
+                    name, operation, iterations=args.iterations,
+                    concurrency=args.concurrency, parameters=parameters))
+        finally:
+            suite.cleanup()
+
+    harness.report(results, baseline)
+    if args.history:
+        harness.save(results, args.history)
+    return int(any(result.errors for result in results))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#! /usr/bin/env python3
+"""
+Startup benchmark:
+    Measure how long the command line application needs before it
+    starts working and check that it stays under a fixed budget.
+
+The benchmark fails (exit code 1) when the median startup time of any
+command line is over the budget or when the expensive modules are
+imported by commands that don't need them.
+
+::
+    python benchmarks/startup.py --repeat 20 --budget 0.25
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "scripts", "arestor")
+
+COMMAND_LINES = (
+    ["--help"],
+    ["install", "--help"],
+    ["install", "dependences", "--help"],
+    ["install", "argus", "--help"],
+)
+
+# Modules which should be loaded only when a command needs them
+EXPENSIVE_MODULES = ("asyncio", "glanceclient", "keystoneclient",
+                     "neutronclient")
+
+# The command lines parsed in-process while checking the imported modules
+LIGHT_COMMANDS = (
+    ["install", "dependences"],
+    ["install", "argus", "--build", "benchmark"],
+    ["pool", "fill"],
+)
+
+_CHECK_MODULES = """
+import sys
+from arestor.client import shell
+client = shell.ArestorClient(%(command_line)r)
+client._prologue()
+print(",".join(sorted(module for module in sys.modules
+                      if module.split(".")[0] in %(modules)r)))
+"""
+
+
+def _environment():
+    """Return the environment for the child processes."""
+    environment = dict(os.environ)
+    environment.pop("ARESTOR_SOCKET", None)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [path for path in
+                  environment.get("PYTHONPATH", "").split(os.pathsep)
+                  if path])
+    return environment
+
+
+def measure(command_line, repeat):
+    """Return the median wall clock time of the received command line."""
+    environment = _environment()
+    timings = []
+    with open(os.devnull, "wb") as devnull:
+        for _ in range(repeat):
+            started = time.time()
+            subprocess.call([sys.executable, SCRIPT] + command_line,
+                            stdout=devnull, stderr=devnull,
+                            env=environment)
+            timings.append(time.time() - started)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def imported_modules(command_line):
+    """Return the expensive modules loaded while parsing the received
+    command line.
+    """
+    code = _CHECK_MODULES % {"command_line": command_line,
+                             "modules": EXPENSIVE_MODULES}
+    output = subprocess.check_output([sys.executable, "-c", code],
+                                      env=_environment())
+    return [module for module in output.decode("utf-8").strip().split(",")
+            if module]
+
+
+def main():
+    """Run the startup benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "--repeat", type=int, default=10,
+        help="How many times every command line runs. (Default: 10)")
+    parser.add_argument(
+        "--budget", type=float,
+        default=float(os.environ.get("ARESTOR_STARTUP_BUDGET", 0.25)),
+        help="The maximum median startup time, in seconds. "
+             "(Default: 0.25)")
+    args = parser.parse_args()
+
+    status = 0
+    for command_line in COMMAND_LINES:
+        elapsed = measure(command_line, max(1, args.repeat))
+        over = elapsed > args.budget
+        status = status or int(over)
+        print("%-40s %8.3fs %s" % (" ".join(command_line), elapsed,
+                                   "OVER BUDGET" if over else "ok"))
+
+    for command_line in LIGHT_COMMANDS:
+        modules = imported_modules(command_line)
+        status = status or int(bool(modules))
+        print("%-40s %s" % (" ".join(command_line),
+                            "imports %s" % ", ".join(modules)
+                            if modules else "ok"))
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-#! /usr/bin/env python
+#! /usr/bin/env python3
 """Arestor install script."""
 
 try:
@@ -16,7 +16,8 @@ setup(
     long_description=open("README.md").read(),
     packages=["arestor", "arestor.client", "arestor.worker"],
     scripts=["scripts/arestor"],
-    requires=["six", "neutron"],
+    python_requires=">=3.7",
+    requires=["neutron", "glanceclient", "keystoneclient"],
     data_files=[
         ("share/doc/arestor", "resources/tempest.conf"),
     ],